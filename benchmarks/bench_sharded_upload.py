@@ -0,0 +1,213 @@
+"""
+Benchmarks the sharded uploader's scaling.
+
+1. Key balance: rows per hash bucket for each shard key. A writer gets whole buckets, so the largest
+   bucket bounds how far adding writers can help.
+2. Writer balance for 1, 2, 4, ... writers. The exchange does not deal the buckets evenly: each writer queue
+   is bound with weight 1, and every bucket key lands on a pseudo-random queue of the ring. Prints the
+   buckets per writer and the speedup bound (all rows / the busiest writer's rows) for that split, next to
+   the ideal largest-first deal. With --rabbitmq the split is read from a temporary consistent-hash exchange
+   on the broker (RABBITMQ_* settings). Without it, it is modelled with jump consistent hashing, the
+   exchange's algorithm, on another key hash: same statistics, different buckets.
+3. With --postgres, loads the same rows with that many writer processes, split as in 2. Each writer
+   bulk-loads its buckets into a copy of raw_data in flushes of WRITER_FLUSH_ROWS rows, one transaction per
+   flush, the way the sharded writers do. Prints the total rows/s, the speedup over one writer and the
+   rows/s of every writer. Uses the POSTGRES_* settings of the services.
+
+    python benchmarks/bench_sharded_upload.py --rows 200000
+    python benchmarks/bench_sharded_upload.py --rows 1000000 --writers 1 2 4 8 --rabbitmq --postgres
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import broker  # noqa: E402
+import uploader  # noqa: E402
+from synthetic import make_raw_batch  # noqa: E402
+
+TABLE = "bench_sharded_raw"
+
+
+def report_balance(records, keys):
+    print(f"key balance over {broker.SHARD_BUCKETS} buckets, {len(records)} rows")
+    print(f"{'key':>8}{'buckets used':>14}{'largest bucket':>16}{'max speedup':>13}")
+    for key in keys:
+        sizes = [len(group) for group in broker.split_by_shard(records, key).values()]
+        share = max(sizes) / len(records)
+        print(f"{key:>8}{len(sizes):>14}{share:>15.1%}{1 / share:>12.1f}x")
+
+
+def assign_buckets(groups, writers):
+    """
+    Deals the buckets to writers largest first, a near-even split of whole buckets. Returns {bucket: writer}.
+    """
+    loads = [0] * writers
+    assignment = {}
+    for bucket, group in sorted(groups.items(), key=lambda item: len(item[1]), reverse=True):
+        writer = loads.index(min(loads))
+        assignment[bucket] = writer
+        loads[writer] += len(group)
+    return assignment
+
+
+def jump_hash(key, buckets):
+    """
+    Jump consistent hash (Lamping and Veach), which the consistent-hash exchange uses to pick a queue.
+    """
+    chosen, candidate = -1, 0
+    while candidate < buckets:
+        chosen = candidate
+        key = (key * 2862933555777866757 + 1) % 2 ** 64
+        candidate = int((chosen + 1) * (2 ** 31 / ((key >> 33) + 1)))
+    return chosen
+
+
+def modelled_buckets(writers):
+    """
+    Models the exchange's split of the bucket keys over `writers` queues bound with weight 1.
+    """
+    return {bucket: jump_hash(zlib.crc32(str(bucket).encode()), writers) for bucket in range(broker.SHARD_BUCKETS)}
+
+
+def exchange_buckets(writers):
+    """
+    Reads the split of the bucket keys over `writers` queues bound with weight 1 from a temporary
+    consistent-hash exchange on the broker, publishing one message per bucket key.
+    """
+    exchange = "bench_shard_ring"
+    with uploader.connect_to_rabbitmq() as connection, connection.channel() as channel:
+        channel.confirm_delivery()
+        channel.exchange_declare(exchange=exchange, exchange_type="x-consistent-hash", auto_delete=True)
+        queues = [channel.queue_declare(queue="", exclusive=True).method.queue for _ in range(writers)]
+        for queue in queues:
+            channel.queue_bind(queue=queue, exchange=exchange, routing_key="1")
+        for bucket in range(broker.SHARD_BUCKETS):
+            channel.basic_publish(exchange=exchange, routing_key=str(bucket), body=str(bucket))
+
+        assignment = {}
+        for writer, queue in enumerate(queues):
+            while True:
+                method, _, body = channel.basic_get(queue=queue, auto_ack=True)
+                if method is None:
+                    break
+                assignment[int(body)] = writer
+        channel.exchange_delete(exchange=exchange)
+    return assignment
+
+
+def split_rows(groups, assignment, writers):
+    shards = [[] for _ in range(writers)]
+    for bucket, group in groups.items():
+        shards[assignment[bucket]].extend(group)
+    return shards
+
+
+def speedup_bound(shards):
+    """
+    All rows over the busiest writer's rows: the speedup the split allows if every writer runs at the same rate.
+    """
+    return sum(len(shard) for shard in shards) / max(len(shard) for shard in shards)
+
+
+def report_writer_balance(records, key, writer_counts, split):
+    groups = broker.split_by_shard(records, key)
+    source = "broker" if split is exchange_buckets else "model"
+    print(f"\nwriter balance by {key}, exchange split from the {source}")
+    print(f"{'writers':>8}{'ideal bound':>13}{'exchange bound':>16}  buckets per writer (exchange)")
+    for writers in writer_counts:
+        assignment = split(writers)
+        ideal = speedup_bound(split_rows(groups, assign_buckets(groups, writers), writers))
+        actual = speedup_bound(split_rows(groups, assignment, writers))
+        per_writer = [sorted(bucket for bucket, writer in assignment.items() if writer == w) for w in range(writers)]
+        print(f"{writers:>8}{ideal:>12.2f}x{actual:>15.2f}x  "
+              f"{' | '.join(','.join(map(str, buckets)) or '-' for buckets in per_writer)}")
+
+
+def run_writer(records, start, results):
+    conn = uploader.connect_to_postgres()
+    try:
+        values = uploader.raw_values(records)
+        start.wait()
+        began = time.perf_counter()
+        for i in range(0, len(values), uploader.WRITER_FLUSH_ROWS):
+            uploader.bulk_copy(conn, TABLE, uploader.RAW_COLUMNS, values[i:i + uploader.WRITER_FLUSH_ROWS])
+            conn.commit()
+        results.put((len(values), began, time.perf_counter()))
+    finally:
+        conn.close()
+
+
+def bench_postgres(records, writer_counts, key, split):
+    conn = uploader.connect_to_postgres()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+            cursor.execute(f"CREATE TABLE {TABLE} (LIKE raw_data INCLUDING DEFAULTS INCLUDING INDEXES)")
+            # Own ids instead of drawing from raw_data's sequence
+            cursor.execute(f"""
+                ALTER TABLE {TABLE} ALTER COLUMN transaction_id DROP DEFAULT,
+                ALTER COLUMN transaction_id ADD GENERATED BY DEFAULT AS IDENTITY
+            """)
+        conn.commit()
+
+        groups = broker.split_by_shard(records, key)
+        print(f"\nPostgres, {len(records)} rows by {key}, flushes of {uploader.WRITER_FLUSH_ROWS} rows")
+        print(f"{'writers':>8}{'rows/s':>12}{'speedup':>9}  per writer rows/s")
+        baseline = None
+        for writers in writer_counts:
+            with conn.cursor() as cursor:
+                cursor.execute(f"TRUNCATE {TABLE}")
+            conn.commit()
+
+            # Writers the exchange leaves without buckets get no process
+            shards = [shard for shard in split_rows(groups, split(writers), writers) if shard]
+            start = multiprocessing.Barrier(len(shards) + 1)
+            results = multiprocessing.Queue()
+            processes = [
+                multiprocessing.Process(target=run_writer, args=(shard, start, results))
+                for shard in shards
+            ]
+            for process in processes:
+                process.start()
+            start.wait()
+            finished = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+
+            rows = sum(loaded for loaded, _, _ in finished)
+            elapsed = max(end for _, _, end in finished) - min(began for _, began, _ in finished)
+            rate = rows / elapsed
+            baseline = baseline or rate
+            per_writer = ", ".join(f"{loaded / (end - began):,.0f}" for loaded, began, end in finished)
+            print(f"{writers:>8}{rate:>12,.0f}{rate / baseline:>8.2f}x  {per_writer}")
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        conn.commit()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--key", default=broker.RAW_SHARD_KEY, choices=["state", "cc_num"])
+    parser.add_argument("--rabbitmq", action="store_true", help="read the bucket split from a broker exchange")
+    parser.add_argument("--postgres", action="store_true", help="also load the rows into Postgres")
+    args = parser.parse_args()
+
+    records = make_raw_batch(args.rows).to_dict(orient="records")
+    split = exchange_buckets if args.rabbitmq else modelled_buckets
+    report_balance(records, ["state", "cc_num"])
+    report_writer_balance(records, args.key, args.writers, split)
+    if args.postgres:
+        bench_postgres(records, args.writers, args.key, split)
+
+
+if __name__ == "__main__":
+    main()
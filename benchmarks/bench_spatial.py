@@ -0,0 +1,240 @@
+"""
+Benchmarks the geospatial features and queries.
+
+1. Features: the vectorized haversine distance and geohash of clean_data against a plain Python
+   row-at-a-time implementation (math.* and bisection), the way clean_data computes the age.
+2. Near queries in memory: covering geohash cells answered as sorted prefix ranges (what the btree on
+   processed_transactions.geohash does) against a full haversine scan, over the frauds and over all
+   transactions. Both must return the same rows.
+3. With --postgres, the same near query and the map's per-cell aggregation on a temporary copy of
+   the data in Postgres, with the partial geohash index enabled and disabled, plus the plan's scan type.
+   Uses the POSTGRES_* settings of the services.
+
+    python benchmarks/bench_spatial.py --rows 1000000 --queries 200
+    python benchmarks/bench_spatial.py --rows 1000000 --postgres
+"""
+import argparse
+import math
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import geo  # noqa: E402
+from synthetic import make_raw_batch  # noqa: E402
+
+RADII_KM = (5, 25, 100)
+
+
+def make_points(rows, fraud_rate, seed=0):
+    """
+    Returns cardholder and merchant coordinates and fraud flags, spread around the synthetic cities.
+    """
+    rng = np.random.default_rng(seed)
+    raw = make_raw_batch(rows, seed)
+    lat = raw["lat"].to_numpy() + rng.normal(0, 0.05, rows)
+    lon = raw["long"].to_numpy() + rng.normal(0, 0.05, rows)
+    is_fraud = rng.random(rows) < fraud_rate
+    return lat, lon, raw["merch_lat"].to_numpy(), raw["merch_long"].to_numpy(), raw["amt"].to_numpy(), is_fraud
+
+
+def haversine_row(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * geo.EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def geohash_row(lat, lon, precision=geo.GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    code, chars = 0, []
+    for i in range(5 * precision):
+        value, interval = (lon, lon_range) if i % 2 == 0 else (lat, lat_range)
+        mid = (interval[0] + interval[1]) / 2
+        bit = value >= mid
+        interval[0 if bit else 1] = mid
+        code = code * 2 + bit
+        if i % 5 == 4:
+            chars.append(geo.BASE32[code])
+            code = 0
+    return "".join(chars)
+
+
+def row_at_a_time(lat, lon, merch_lat, merch_long):
+    distances, hashes = [], []
+    for a, b, c, d in zip(lat.tolist(), lon.tolist(), merch_lat.tolist(), merch_long.tolist()):
+        distances.append(haversine_row(a, b, c, d))
+        hashes.append(geohash_row(a, b))
+    return distances, hashes
+
+
+def bench_features(lat, lon, merch_lat, merch_long):
+    start = time.perf_counter()
+    geo.haversine_km(lat, lon, merch_lat, merch_long)
+    geo.encode_geohash(lat, lon)
+    vectorized = time.perf_counter() - start
+
+    sample = min(len(lat), 100000)
+    start = time.perf_counter()
+    row_at_a_time(lat[:sample], lon[:sample], merch_lat[:sample], merch_long[:sample])
+    per_row = (time.perf_counter() - start) / sample * len(lat)
+
+    print(f"features ({len(lat)} rows): vectorized {vectorized * 1000:.0f} ms "
+          f"({len(lat) / vectorized:,.0f} rows/s), row at a time ~{per_row * 1000:.0f} ms "
+          f"(extrapolated from {sample} rows), {per_row / vectorized:.0f}x")
+
+
+def near_by_ranges(sorted_hashes, order, lat, lon, center_lat, center_lon, radius_km):
+    """
+    Candidate rows from prefix ranges of the covering cells, then the exact distance check.
+    """
+    candidates = []
+    for cell in geo.covering_cells(center_lat, center_lon, radius_km):
+        lo = np.searchsorted(sorted_hashes, cell, side="left")
+        hi = np.searchsorted(sorted_hashes, cell + "~", side="left")
+        candidates.append(order[lo:hi])
+    candidates = np.concatenate(candidates)
+    distance = geo.haversine_km(lat[candidates], lon[candidates], center_lat, center_lon)
+    return np.sort(candidates[distance <= radius_km]), len(candidates)
+
+
+def near_by_scan(lat, lon, center_lat, center_lon, radius_km):
+    return np.flatnonzero(geo.haversine_km(lat, lon, center_lat, center_lon) <= radius_km)
+
+
+def bench_near_queries(lat, lon, label, queries, seed=1):
+    hashes = geo.encode_geohash(lat, lon).astype(str)
+    order = np.argsort(hashes, kind="stable")
+    sorted_hashes = hashes[order]
+
+    rng = np.random.default_rng(seed)
+    centers = rng.integers(0, len(lat), queries)
+    print(f"\nnear X over {len(lat)} {label}, {queries} queries per radius")
+    print(f"{'radius km':>10}{'ranges ms':>11}{'scan ms':>9}{'rows':>10}{'candidates':>12}")
+    for radius_km in RADII_KM:
+        range_times, scan_times, found, scanned = [], [], [], []
+        for i in centers:
+            center_lat, center_lon = lat[i] + 0.01, lon[i] - 0.01
+
+            start = time.perf_counter()
+            rows, candidates = near_by_ranges(sorted_hashes, order, lat, lon, center_lat, center_lon, radius_km)
+            range_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            expected = near_by_scan(lat, lon, center_lat, center_lon, radius_km)
+            scan_times.append(time.perf_counter() - start)
+
+            assert np.array_equal(rows, expected), f"range lookup differs from scan at radius {radius_km}"
+            found.append(len(rows))
+            scanned.append(candidates)
+        print(f"{radius_km:>10}{statistics.median(range_times) * 1000:>11.3f}"
+              f"{statistics.median(scan_times) * 1000:>9.3f}{statistics.mean(found):>10.1f}"
+              f"{statistics.mean(scanned):>12.1f}")
+
+
+def bench_postgres(lat, lon, merch_lat, merch_long, amt, is_fraud, queries, seed=1):
+    """
+    Loads the points into a temporary table shaped like processed_transactions and times the
+    dashboard's spatial queries with and without the geohash index.
+    """
+    import io
+    import json
+
+    from uploader import connect_to_postgres
+
+    conn = connect_to_postgres()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TEMP TABLE bench_spatial (
+                    transaction_id SERIAL PRIMARY KEY,
+                    amt FLOAT, is_fraud BOOLEAN, lat FLOAT, long FLOAT,
+                    distance_km FLOAT, geohash VARCHAR(12) COLLATE "C"
+                )
+            """)
+            buffer = io.StringIO()
+            distances = geo.haversine_km(lat, lon, merch_lat, merch_long)
+            hashes = geo.encode_geohash(lat, lon)
+            for row in zip(amt, is_fraud, lat, lon, distances, hashes):
+                buffer.write("\t".join("\\N" if value is None else str(value) for value in row) + "\n")
+            buffer.seek(0)
+            cursor.copy_expert(
+                "COPY bench_spatial (amt, is_fraud, lat, long, distance_km, geohash) FROM STDIN", buffer
+            )
+            cursor.execute("CREATE INDEX ON bench_spatial (geohash) WHERE is_fraud")
+            cursor.execute("ANALYZE bench_spatial")
+
+            rng = np.random.default_rng(seed)
+            fraud_idx = np.flatnonzero(is_fraud)
+            centers = rng.choice(fraud_idx, queries)
+
+            def run(sql, params):
+                cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, params)
+                plan = cursor.fetchone()[0]
+                plan = json.loads(plan) if isinstance(plan, str) else plan
+                return plan[0]["Execution Time"], scan_types(plan[0]["Plan"])
+
+            print(f"\nPostgres, {len(lat)} rows ({len(fraud_idx)} frauds)")
+            print(f"{'query':<22}{'index':>7}{'median ms':>11}  scans")
+            for index_on in (True, False):
+                cursor.execute(f"SET enable_indexscan = {'on' if index_on else 'off'}")
+                cursor.execute(f"SET enable_bitmapscan = {'on' if index_on else 'off'}")
+                cursor.execute(f"SET enable_indexonlyscan = {'on' if index_on else 'off'}")
+                for radius_km in RADII_KM:
+                    times, scans = [], set()
+                    for i in centers:
+                        condition, params = geo.near_filter(float(lat[i]), float(lon[i]), radius_km)
+                        sql = f"SELECT * FROM bench_spatial WHERE is_fraud AND {condition}"
+                        elapsed, scan = run(*to_pyformat(sql, params))
+                        times.append(elapsed)
+                        scans.update(scan)
+                    print(f"{f'near, {radius_km} km':<22}{'on' if index_on else 'off':>7}"
+                          f"{statistics.median(times):>11.2f}  {', '.join(sorted(scans))}")
+                elapsed, scan = run(
+                    "SELECT left(geohash, 4), COUNT(*), SUM(amt) FROM bench_spatial "
+                    "WHERE is_fraud AND geohash IS NOT NULL GROUP BY 1", {}
+                )
+                print(f"{'map grid (precision 4)':<22}{'on' if index_on else 'off':>7}{elapsed:>11.2f}  {', '.join(sorted(scan))}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+
+def to_pyformat(sql, params):
+    """
+    Rewrites :name parameters for psycopg2; longest names first so :cell_1 does not clip :cell_10.
+    """
+    sql = sql.replace("%", "%%")
+    for name in sorted(params, key=len, reverse=True):
+        sql = sql.replace(f":{name}", f"%({name})s")
+    return sql, params
+
+
+def scan_types(plan):
+    scans = {plan["Node Type"]} if "Scan" in plan["Node Type"] else set()
+    for child in plan.get("Plans", []):
+        scans |= scan_types(child)
+    return scans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--fraud-rate", type=float, default=0.006)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--postgres", action="store_true", help="also time the queries in Postgres")
+    args = parser.parse_args()
+
+    lat, lon, merch_lat, merch_long, amt, is_fraud = make_points(args.rows, args.fraud_rate)
+    bench_features(lat, lon, merch_lat, merch_long)
+    bench_near_queries(lat[is_fraud], lon[is_fraud], "frauds", args.queries)
+    bench_near_queries(lat, lon, "transactions", args.queries)
+    if args.postgres:
+        bench_postgres(lat, lon, merch_lat, merch_long, amt, is_fraud, args.queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Measures the start-up cost of each entry point: the wall time of a fresh interpreter importing
+the module, and the heaviest imports reported by `python -X importtime`.
+
+Importing a worker module runs everything up to its `start_*()` call, which is what an autoscaled
+pod pays before it can connect. Importing app.py runs the dashboard script once in bare mode
+(the Home page), like the first Streamlit run of a new server process. Modules loaded with
+startup.lazy_import are only paid for when the first batch or page actually uses them.
+
+    python benchmarks/bench_startup.py --repeat 5 --top 8
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+ENTRY_POINTS = ("processor", "uploader", "producer", "backfill", "archiver", "analytics_store", "app")
+
+
+def run_import(module, importtime=False):
+    """
+    Imports the module in a fresh interpreter and returns (wall seconds, stderr).
+    """
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", f"import {module}"]
+    env = {**os.environ, "STARTUP_REPORT": "0"}
+
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=SRC_DIR, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    return elapsed, result.stderr
+
+
+def heaviest_imports(importtime_output, module, top):
+    """
+    Returns the packages the module pulled in with the largest cumulative import time, in ms.
+    """
+    packages = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        if package in (module, "site", "encodings"):
+            continue
+        packages[package] = max(packages.get(package, 0), int(cumulative) / 1000)
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the import-time start-up of each entry point.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="heaviest imports to list per entry point")
+    parser.add_argument("entry_points", nargs="*", default=ENTRY_POINTS)
+    args = parser.parse_args()
+
+    interpreter = statistics.median(run_import("sys")[0] for _ in range(args.repeat))
+    print(f"bare interpreter: {interpreter * 1000:.0f} ms (subtracted below)\n")
+
+    print(f"{'entry point':<18}{'median ms':>10}{'min ms':>9}  heaviest imports (cumulative ms)")
+    for module in args.entry_points:
+        timings = [run_import(module)[0] - interpreter for _ in range(args.repeat)]
+        _, output = run_import(module, importtime=True)
+        heaviest = ', '.join(f"{name} {ms:.0f}" for name, ms in heaviest_imports(output, module, args.top))
+        print(f"{module:<18}{statistics.median(timings) * 1000:>10.0f}{min(timings) * 1000:>9.0f}  {heaviest}")
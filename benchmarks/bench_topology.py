@@ -0,0 +1,86 @@
+"""
+Compares broker bytes and CPU time per row of the split and fused pipeline topologies.
+
+Split:  producer -> raw_data (fanned out to raw_data_process and raw_data_upload)
+        processor -> clean_data -> processed_data_upload, uploader stores both tables.
+Fused:  producer -> raw_data -> raw_data_store, one service cleans and stores both tables.
+
+Only serialization, cleaning and insert-row building are timed; the database round trips are
+the same in both topologies and are left out.
+
+    python benchmarks/bench_topology.py --rows 100000 --batch-size 1000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from processor import clean_data  # noqa: E402
+from synthetic import make_raw_batch  # noqa: E402
+from uploader import processed_values, raw_values  # noqa: E402
+
+
+def run_split(raw_body):
+    """
+    Returns (bytes published, bytes delivered, cpu seconds) for one batch through the split topology.
+    """
+    start = time.process_time()
+    # processor
+    cleaned = clean_data(pd.DataFrame(json.loads(raw_body)))
+    clean_body = json.dumps(cleaned.to_dict(orient="records")).encode()
+    # uploader, raw and clean messages
+    raw_values(json.loads(raw_body))
+    processed_values(json.loads(clean_body))
+    cpu = time.process_time() - start
+
+    published = len(raw_body) + len(clean_body)
+    delivered = 2 * len(raw_body) + len(clean_body)
+    return published, delivered, cpu
+
+
+def run_fused(raw_body):
+    """
+    Returns (bytes published, bytes delivered, cpu seconds) for one batch through the fused topology.
+    """
+    start = time.process_time()
+    data = json.loads(raw_body)
+    cleaned = clean_data(pd.DataFrame(data)).to_dict(orient="records")
+    raw_values(data)
+    processed_values(cleaned)
+    cpu = time.process_time() - start
+
+    return len(raw_body), len(raw_body), cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    data = make_raw_batch(args.rows)
+    bodies = [
+        json.dumps(data[i:i + args.batch_size].to_dict(orient="records")).encode()
+        for i in range(0, len(data), args.batch_size)
+    ]
+
+    print(f"{args.rows} rows in batches of {args.batch_size}")
+    print(f"{'topology':<10}{'published B/row':>18}{'delivered B/row':>18}{'broker B/row':>15}{'CPU us/row':>13}")
+    for name, run in (("split", run_split), ("fused", run_fused)):
+        published = delivered = cpu = 0
+        for body in bodies:
+            p, d, c = run(body)
+            published += p
+            delivered += d
+            cpu += c
+        print(f"{name:<10}{published / args.rows:>18.1f}{delivered / args.rows:>18.1f}"
+              f"{(published + delivered) / args.rows:>15.1f}{cpu / args.rows * 1e6:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Synthetic batches with the fraudTrain.csv schema, used by the benchmarks so they run without the dataset.
+"""
+import numpy as np
+import pandas as pd
+
+
+CATEGORIES = [
+    "gas_transport", "grocery_net", "grocery_pos", "shopping_net", "shopping_pos", "entertainment",
+    "misc_net", "misc_pos", "food_dining", "travel", "home", "health_fitness", "personal_care", "kids_pets",
+]
+JOBS = [
+    "Software engineer", "Nurse, adult", "Teacher, primary school", "Accountant, chartered",
+    "Solicitor", "Chef", "Research scientist (life sciences)", "Illustrator", "Farm manager",
+    "Systems analyst", "Civil engineer, contracting", "Psychologist, clinical", "Barrister",
+]
+STATES = ["NY", "CA", "TX", "PA", "OH", "IL", "FL", "MI", "AL", "MO", "MN", "WI", "NC", "VA", "WA"]
+
+
+def make_raw_batch(n, seed=0, n_merchants=700, n_cities=900):
+    """
+    Returns a DataFrame of `n` raw transactions shaped like fraudTrain.csv.
+    """
+    rng = np.random.default_rng(seed)
+    merchants = np.array([f"fraud_Merchant {i}-Group" for i in range(n_merchants)])
+    cities = np.array([f"City {i}" for i in range(n_cities)])
+    city_idx = rng.integers(0, n_cities, n)
+    lat = 25 + (city_idx % 97) * 0.22
+    long = -120 + (city_idx % 89) * 0.55
+    trans_time = pd.Timestamp("2019-01-01") + pd.to_timedelta(rng.integers(0, 540 * 86400, n), unit="s")
+    dob = pd.Timestamp("1930-01-01") + pd.to_timedelta(rng.integers(0, 75 * 365, n), unit="D")
+
+    return pd.DataFrame({
+        "Unnamed: 0": np.arange(n),
+        "trans_date_trans_time": trans_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "cc_num": rng.integers(10**15, 10**16, n),
+        "merchant": merchants[rng.integers(0, n_merchants, n)],
+        "category": np.array(CATEGORIES)[rng.integers(0, len(CATEGORIES), n)],
+        "amt": rng.gamma(1.5, 45, n).round(2),
+        "first": "Jane",
+        "last": "Doe",
+        "gender": np.where(rng.random(n) < 0.55, "F", "M"),
+        "street": "1 Main Street",
+        "city": cities[city_idx],
+        "state": np.array(STATES)[city_idx % len(STATES)],
+        "zip": 10000 + city_idx,
+        "lat": lat,
+        "long": long,
+        "city_pop": 1000 + city_idx * 37,
+        "job": np.array(JOBS)[rng.integers(0, len(JOBS), n)],
+        "dob": dob.strftime("%Y-%m-%d"),
+        "trans_num": [f"{x:032x}" for x in rng.integers(0, 2**62, n)],
+        "unix_time": 1325376000 + rng.integers(0, 540 * 86400, n),
+        "merch_lat": lat + rng.normal(0, 0.5, n),
+        "merch_long": long + rng.normal(0, 0.5, n),
+        "is_fraud": (rng.random(n) < 0.006).astype(int),
+    })
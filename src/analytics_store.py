@@ -0,0 +1,191 @@
+import os
+
+from startup import lazy_import
+
+# Loaded on the first append or rebuild, so uploaders without the store enabled never import them
+duckdb = lazy_import("duckdb")
+pd = lazy_import("pandas")
+
+
+# Embedded columnar copy of processed_transactions for the dashboard's full-table scans
+DUCKDB_PATH = os.getenv('DUCKDB_PATH', '../data/analytics.duckdb')
+
+# processed_transactions columns and the clean_data record keys they come from
+COLUMNS = {
+    'merchant_id': 'merchant_id',
+    'transaction_time': 'trans_date_trans_time',
+    'category': 'category',
+    'job_category': 'job_category',
+    'job_id': 'job_id',
+    'amt': 'amt',
+    'gender': 'gender',
+    'city_id': 'city_id',
+    'state': 'state',
+    'is_fraud': 'is_fraud',
+    'hour': 'hour',
+    'age_at_transaction': 'age_at_trans',
+    'day_of_week': 'day_of_week',
+    'month': 'month',
+    'is_weekend': 'is_weekend',
+    'year': 'year',
+    'lat': 'lat',
+    'long': 'long',
+    'distance_km': 'distance_km',
+    'geohash': 'geohash',
+}
+
+# Dimension tables mirrored from Postgres, filled from the names carried in the records
+DIMENSION_INSERTS = (
+    "INSERT OR IGNORE INTO dim_merchant SELECT DISTINCT merchant_id, merchant FROM batch WHERE merchant_id IS NOT NULL",
+    "INSERT OR IGNORE INTO dim_city SELECT DISTINCT city_id, city, state FROM batch WHERE city_id IS NOT NULL",
+    "INSERT OR IGNORE INTO dim_job SELECT DISTINCT job_id, job FROM batch WHERE job_id IS NOT NULL",
+)
+
+
+def create_schema(con):
+    """
+    Creates the analytics tables, mirroring processed_transactions and its dimensions in Postgres.
+    """
+    con.execute("CREATE SEQUENCE IF NOT EXISTS transaction_id_seq")
+    con.execute("CREATE TABLE IF NOT EXISTS dim_merchant (merchant_id INTEGER PRIMARY KEY, name VARCHAR)")
+    con.execute("CREATE TABLE IF NOT EXISTS dim_city (city_id INTEGER PRIMARY KEY, city VARCHAR, state VARCHAR)")
+    con.execute("CREATE TABLE IF NOT EXISTS dim_job (job_id INTEGER PRIMARY KEY, name VARCHAR)")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS processed_transactions (
+            transaction_id BIGINT DEFAULT nextval('transaction_id_seq'),
+            merchant_id INTEGER,
+            transaction_time TIMESTAMP,
+            category VARCHAR,
+            job_category VARCHAR,
+            job_id INTEGER,
+            amt DOUBLE,
+            gender VARCHAR,
+            city_id INTEGER,
+            state VARCHAR,
+            is_fraud BOOLEAN,
+            hour INTEGER,
+            age_at_transaction INTEGER,
+            day_of_week INTEGER,
+            month INTEGER,
+            is_weekend BOOLEAN,
+            year INTEGER,
+            lat DOUBLE,
+            long DOUBLE,
+            distance_km DOUBLE,
+            geohash VARCHAR,
+            processed_at TIMESTAMP DEFAULT current_timestamp
+        )
+    """)
+    con.execute("""
+        CREATE OR REPLACE VIEW transactions_view AS
+        SELECT
+            p.transaction_id, m.name AS merchant, p.transaction_time, p.category, p.job_category,
+            j.name AS job, p.amt, p.gender, c.city, p.state, p.is_fraud, p.hour,
+            p.age_at_transaction, p.day_of_week, p.month, p.is_weekend, p.year, p.lat, p.long,
+            p.distance_km, p.geohash, p.processed_at
+        FROM processed_transactions p
+        LEFT JOIN dim_merchant m ON m.merchant_id = p.merchant_id
+        LEFT JOIN dim_city c ON c.city_id = p.city_id
+        LEFT JOIN dim_job j ON j.job_id = p.job_id
+    """)
+    # Postgres' width_bucket, so the dashboard queries run unchanged on both engines
+    con.execute("""
+        CREATE OR REPLACE MACRO width_bucket(x, lo, hi, n) AS
+            CASE WHEN x < lo THEN 0
+                 WHEN x >= hi THEN n + 1
+                 ELSE CAST(floor((x - lo) * n / (hi - lo)) AS INTEGER) + 1
+            END
+    """)
+
+
+def sample_clause(sample_percent, seed):
+    """
+    DuckDB's spelling of Postgres' TABLESAMPLE SYSTEM (percent) REPEATABLE (seed).
+    """
+    return f"TABLESAMPLE {float(sample_percent)}% (system, {seed})"
+
+
+def to_frame(records):
+    """
+    Converts cleaned records with interned keys to a DataFrame with the processed_transactions
+    columns, plus the merchant, city and job names for the dimension tables.
+    """
+    df = pd.DataFrame(records, columns=[*COLUMNS.values(), 'merchant', 'city', 'job'])
+    df.columns = [*COLUMNS, 'merchant', 'city', 'job']
+    df['transaction_time'] = pd.to_datetime(df['transaction_time'], errors='coerce')
+    for column in ('amt', 'lat', 'long', 'distance_km'):
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    for column in ('merchant_id', 'job_id', 'city_id', 'hour', 'age_at_transaction', 'day_of_week', 'month', 'year'):
+        df[column] = pd.to_numeric(df[column], errors='coerce').astype('Int64')
+    for column in ('is_fraud', 'is_weekend'):
+        df[column] = df[column].astype(bool)
+    return df
+
+
+def append_batch(records, path=DUCKDB_PATH):
+    """
+    Appends a batch of cleaned records to the analytics store.
+    The file is only held open for the append so the dashboard can open it read-only in between.
+    """
+    batch = to_frame(records)
+    if batch.empty:
+        return 0
+
+    columns = ', '.join(COLUMNS)
+    with duckdb.connect(path) as con:
+        create_schema(con)
+        con.register('batch', batch)
+        con.execute("BEGIN TRANSACTION")
+        for statement in DIMENSION_INSERTS:
+            con.execute(statement)
+        con.execute(f"INSERT INTO processed_transactions ({columns}) SELECT {columns} FROM batch")
+        con.execute("COMMIT")
+    return len(batch)
+
+
+def rebuild_from_postgres(pg_conn, path=DUCKDB_PATH, chunk_size=100000):
+    """
+    Recreates the analytics store from processed_transactions in Postgres, streaming in chunks.
+    """
+    tmp_path = path + '.rebuild'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    columns = [*COLUMNS, 'processed_at']
+    total = 0
+    with duckdb.connect(tmp_path) as con:
+        create_schema(con)
+        with pg_conn.cursor() as cursor:
+            for table in ('dim_merchant', 'dim_city', 'dim_job'):
+                cursor.execute(f"SELECT * FROM {table}")
+                rows = cursor.fetchall()
+                if rows:
+                    con.executemany(f"INSERT INTO {table} VALUES ({', '.join(['?'] * len(rows[0]))})", rows)
+
+    with duckdb.connect(tmp_path) as con, pg_conn.cursor(name='analytics_rebuild') as cursor:
+        cursor.itersize = chunk_size
+        cursor.execute(f"SELECT {', '.join(columns)} FROM processed_transactions ORDER BY transaction_id")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            con.register('chunk', pd.DataFrame(rows, columns=columns))
+            con.execute(f"INSERT INTO processed_transactions ({', '.join(columns)}) SELECT * FROM chunk")
+            con.unregister('chunk')
+            total += len(rows)
+            print(f"Copied {total} rows")
+    pg_conn.rollback()
+
+    os.replace(tmp_path, path)
+    print(f"Rebuilt {path} with {total} rows")
+    return total
+
+
+if __name__ == "__main__":
+    from uploader import connect_to_postgres
+
+    db_conn = connect_to_postgres()
+    try:
+        rebuild_from_postgres(db_conn)
+    finally:
+        db_conn.close()
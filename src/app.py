@@ -1,10 +1,20 @@
+import time
+# Taken before the other imports so the first run of a new server process includes their cost
+run_started = time.perf_counter()
+
 import streamlit as st
 from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool
 import os
 import pandas as pd
-from st_aggrid import AgGrid, GridOptionsBuilder, JsCode
-import pydeck as pdk
-import plotly.express as px
+
+import geo
+from live_monitor import new_live_state, refresh_live_state
+from startup import report_startup
+
+# pydeck, plotly.express/graph_objects and st_aggrid are imported inside the pages that draw with them.
+# (Lazy module proxies don't help here: Streamlit walks sys.modules via inspect and would load them all.)
 
 st.title("Fraud Detection Project")
 
@@ -17,9 +27,26 @@ db_name = os.getenv("POSTGRES_DB")
 
 
 
-try: 
+@st.cache_resource
+def get_engine():
+    """
+    Creates the Postgres engine once per process; every script rerun and session shares its pool.
+    """
     db_url = f"postgresql://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
-    engine = create_engine(db_url)
+    return create_engine(db_url)
+
+
+@st.cache_resource
+def get_analytics_engine(path):
+    """
+    Creates the DuckDB engine once per process.
+    Opened read-only per query, so the uploader can take the write lock between dashboard reads.
+    """
+    return create_engine(f"duckdb:///{path}", connect_args={"read_only": True}, poolclass=NullPool)
+
+
+try:
+    engine = get_engine()
 except Exception as e:
     st.error(f"Error connecting to the database: {e}")
     st.stop()
@@ -34,9 +61,105 @@ page = st.sidebar.selectbox(
         "Demographic Analysis (Age, Gender) 👤",
         "Geographic analytics 🌎",
         "Behavioral & Merchant Analysis ⏱️🏪",
+        "Live Fraud Monitor 🔴",
     )
 )
 
+# --- Fast / approximate mode ---
+# Only the pages that read through transactions_source() sample
+SAMPLED_PAGES = ("Demographic Analysis (Age, Gender) 👤", "Behavioral & Merchant Analysis ⏱️🏪")
+approximate_mode, sample_percent = False, 100.0
+if page in SAMPLED_PAGES:
+    approximate_mode = st.sidebar.toggle("⚡ Fast / approximate mode", value=False)
+    sample_percent = st.sidebar.slider(
+        "Sample size (%)", min_value=0.5, max_value=50.0, value=5.0, step=0.5,
+        disabled=not approximate_mode
+    )
+
+# --- Analytics backend ---
+# The Behavioral and Demographic pages can scan the DuckDB copy kept by the uploader instead of Postgres
+ANALYTICS_BACKENDS = {"postgres": "Postgres", "duckdb": "DuckDB (local columnar store)"}
+ANALYTICS_LOCK_RETRIES = 5
+duckdb_path = os.getenv("DUCKDB_PATH", "../data/analytics.duckdb")
+default_backend = os.getenv("ANALYTICS_BACKEND", "postgres")
+if default_backend not in ANALYTICS_BACKENDS:
+    st.sidebar.warning(f"Unknown ANALYTICS_BACKEND {default_backend!r}, using Postgres.")
+    default_backend = "postgres"
+analytics_backend = st.sidebar.radio(
+    "Analytics backend", list(ANALYTICS_BACKENDS), format_func=ANALYTICS_BACKENDS.get,
+    index=list(ANALYTICS_BACKENDS).index(default_backend)
+)
+if analytics_backend == "duckdb" and not os.path.exists(duckdb_path):
+    st.sidebar.warning(f"No analytics store at {duckdb_path}, using Postgres.")
+    analytics_backend = "postgres"
+
+analytics_engine = get_analytics_engine(duckdb_path) if analytics_backend == "duckdb" else None
+
+
+def read_analytics(query, params=None):
+    """
+    Runs an analytic page query on the selected backend, retrying briefly while the
+    uploader holds the DuckDB write lock.
+    """
+    if analytics_backend != "duckdb":
+        return pd.read_sql(query, engine, params=params)
+    for attempt in range(ANALYTICS_LOCK_RETRIES):
+        try:
+            return pd.read_sql(query, analytics_engine, params=params)
+        except OperationalError:
+            if attempt == ANALYTICS_LOCK_RETRIES - 1:
+                raise
+            time.sleep(0.2 * (attempt + 1))
+
+
+SAMPLE_SEED = 42
+Z_95 = 1.96
+
+
+def transactions_source(alias=""):
+    """
+    Returns the FROM target for analytic queries, block-sampled with TABLESAMPLE in approximate mode.
+    """
+    source = f"processed_transactions {alias}".strip()
+    if approximate_mode and analytics_backend == "duckdb":
+        from analytics_store import sample_clause
+        source += f" {sample_clause(sample_percent, SAMPLE_SEED)}"
+    elif approximate_mode:
+        source += f" TABLESAMPLE SYSTEM ({float(sample_percent)}) REPEATABLE ({SAMPLE_SEED})"
+    return source
+
+
+def scale_estimates(df, count_col="count"):
+    """
+    Scales sampled counts up to population estimates and adds a 95% confidence half-width column.
+    The bound assumes independently sampled rows; SYSTEM samples whole pages, so it is
+    optimistic when similar rows are clustered on disk.
+    """
+    error_col = f"{count_col}_error"
+    if not approximate_mode:
+        df[error_col] = 0.0
+        return df
+    fraction = sample_percent / 100
+    sampled = df[count_col].astype(float)
+    df[count_col] = sampled / fraction
+    df[error_col] = Z_95 * (sampled * (1 - fraction)) ** 0.5 / fraction
+    return df
+
+
+def error_bars(count_col="count"):
+    """
+    Returns the error column name for plotly charts, or None when counts are exact.
+    """
+    return f"{count_col}_error" if approximate_mode else None
+
+
+def show_estimate_notice():
+    if approximate_mode:
+        st.info(
+            f"⚡ Approximate mode: figures below are **estimates** from a ~{sample_percent:g}% "
+            "block sample. Error bars show 95% confidence bounds."
+        )
+
 
 def show_home():
     st.subheader("👋 Welcome to the Fraud Detection Project")
@@ -69,43 +192,66 @@ def show_analytics():
 
 
 
+GRID_PRECISIONS = {2: "~1250 km", 3: "~156 km", 4: "~39 km", 5: "~4.9 km", 6: "~1.2 km"}
+NEAR_LIMIT = 500
+
+
+def load_frauds_near(lat, lon, radius_km, limit=NEAR_LIMIT):
+    """
+    Frauds within radius_km of a point, nearest first. The geohash prefixes of the covering cells are
+    index range scans; only their rows are checked with the exact distance.
+    """
+    condition, params = geo.near_filter(lat, lon, radius_km)
+    return pd.read_sql(text(f"""
+        SELECT transaction_time, merchant, city, state, amt, distance_km,
+               {geo.distance_sql()} AS distance_from_center_km
+        FROM transactions_view
+        WHERE is_fraud = TRUE AND {condition}
+        ORDER BY distance_from_center_km
+        LIMIT :limit
+    """), engine, params={**params, "limit": limit})
+
+
 def show_map():
+    import plotly.express as px
+    import pydeck as pdk
+
     st.subheader("🌍 Geographic Fraud Analysis")
 
     # --- State filter ---
     states = pd.read_sql("SELECT DISTINCT state FROM processed_transactions WHERE is_fraud = TRUE AND state IS NOT NULL", engine)
     state_options = sorted([s for s in states["state"] if pd.notna(s)])
     selected_states = st.multiselect("Filter by State", options=state_options, default=state_options)
+    precision = st.select_slider(
+        "Grid cell size", options=list(GRID_PRECISIONS), value=4, format_func=GRID_PRECISIONS.get
+    )
 
     # Build WHERE clause for state filter
-    where_clause = "is_fraud = TRUE AND lat IS NOT NULL AND long IS NOT NULL"
-    params = {}
+    where_clause = "p.is_fraud = TRUE AND p.geohash IS NOT NULL"
+    params = {"precision": precision}
     if selected_states and len(selected_states) < len(state_options):
-        where_clause += " AND state IN :states"
+        where_clause += " AND p.state IN :states"
         params["states"] = tuple(selected_states)
 
-    # Load map data
-    df = pd.read_sql(
+    # Aggregate frauds per grid cell (a geohash prefix) in the database
+    df_grouped = pd.read_sql(
         text(f"""
-        SELECT city, state, lat AS latitude, long AS longitude, amt
-        FROM processed_transactions
+        SELECT left(p.geohash, :precision) AS cell, COUNT(*) AS fraud_count, SUM(p.amt) AS total_amt
+        FROM processed_transactions p
         WHERE {where_clause}
+        GROUP BY left(p.geohash, :precision)
         """),
         engine,
         params=params
     )
 
-    if df.empty:
+    if df_grouped.empty:
         st.warning("No fraud data for the selected state(s).")
         return
 
-    # Group by location
-    df_grouped = df.groupby(
-        ['city', 'state', 'latitude', 'longitude'], as_index=False
-    ).agg(
-        total_amt=('amt', 'sum'),
-        fraud_count=('amt', 'count')
-    )
+    centers = [geo.geohash_center(cell) for cell in df_grouped["cell"]]
+    df_grouped["latitude"] = [lat for lat, _ in centers]
+    df_grouped["longitude"] = [lon for _, lon in centers]
 
     total_amount = df_grouped["total_amt"].sum()
     total_frauds = df_grouped["fraud_count"].sum()
@@ -135,18 +281,31 @@ def show_map():
                 data=df_grouped,
                 get_position='[longitude, latitude]',
                 get_color='[200, 30, 0, 160]',
-                get_radius="amt * 0.1",  # Adjust radius based on amount
+                get_radius="total_amt * 0.1",  # Adjust radius based on amount
                 pickable=True,
                 radius_min_pixels=5,
                 radius_max_pixels=100,
             ),  
         ],
-        tooltip={"text": "{city}, {state}\nFrauds: {fraud_count}\nTotal: ${total_amt}"}
+        tooltip={"text": "Cell {cell}\nFrauds: {fraud_count}\nTotal: ${total_amt}"}
     ))
 
     # ---- 1. Top 10 cities by number of frauds ----
     st.markdown("### 🏙️ Top 10 Cities by Number of Frauds")
-    city_counts = df.groupby('city').size().reset_index(name='fraud_count').sort_values(by='fraud_count', ascending=False).head(10)
+    city_counts = pd.read_sql(
+        text(f"""
+        SELECT c.city || COALESCE(', ' || c.state, '') AS city, COUNT(*) AS fraud_count,
+               AVG(p.lat) AS latitude, AVG(p.long) AS longitude
+        FROM processed_transactions p
+        JOIN dim_city c ON c.city_id = p.city_id
+        WHERE {where_clause}
+        GROUP BY c.city, c.state
+        ORDER BY fraud_count DESC
+        LIMIT 10
+        """),
+        engine,
+        params=params
+    )
     fig1 = px.bar(city_counts, x='city', y='fraud_count',
                   labels={'city': 'City', 'fraud_count': 'Number of Frauds'},
                   color='fraud_count', color_continuous_scale='Reds')
@@ -154,16 +313,47 @@ def show_map():
 
     # ---- 2. Top 10 states by total fraud amount ----
     st.markdown("### 🗺️ Top 10 States by Total Fraud Amount")
-    state_amt = df.groupby('state')['amt'].sum().reset_index().sort_values(by='amt', ascending=False).head(10)
+    state_amt = pd.read_sql(
+        text(f"""
+        SELECT p.state, SUM(p.amt) AS amt
+        FROM processed_transactions p
+        WHERE {where_clause}
+        GROUP BY p.state
+        ORDER BY amt DESC
+        LIMIT 10
+        """),
+        engine,
+        params=params
+    )
     fig2 = px.bar(state_amt, x='state', y='amt',
                   labels={'state': 'State', 'amt': 'Total Fraud Amount ($)'},
                   color='amt', color_continuous_scale='OrRd')
     st.plotly_chart(fig2, use_container_width=True)
 
+    # ---- 3. Frauds near a location ----
+    st.markdown("### 📍 Frauds Near a Location")
+    locations = {row.city: (row.latitude, row.longitude) for row in city_counts.itertuples()}
+    center = st.selectbox("Center", [*locations, "Custom coordinates"])
+    if center == "Custom coordinates":
+        col1, col2 = st.columns(2)
+        lat = col1.number_input("Latitude", min_value=-90.0, max_value=90.0, value=float(df_grouped["latitude"].mean()))
+        lon = col2.number_input("Longitude", min_value=-180.0, max_value=180.0, value=float(df_grouped["longitude"].mean()))
+    else:
+        lat, lon = locations[center]
+    radius_km = st.slider("Radius (km)", min_value=1, max_value=500, value=25)
+
+    nearby = load_frauds_near(lat, lon, radius_km)
+    st.caption(
+        f"{len(nearby)} frauds within {radius_km} km (at most {NEAR_LIMIT}); "
+        "distance_km is the distance from the cardholder to the merchant."
+    )
+    st.dataframe(nearby, use_container_width=True)
 
 
 
 def data_frame2():
+    from st_aggrid import AgGrid, GridOptionsBuilder, JsCode
+
     # Sidebar filters
     st.sidebar.header("Filters")
     min_amount = st.sidebar.number_input("Min amount", value=0)
@@ -196,7 +386,7 @@ def data_frame2():
 
     fraud_option = st.sidebar.selectbox("Is Fraud?", options=["All", "Yes", "No"])
 
-    cities = pd.read_sql("SELECT DISTINCT city FROM processed_transactions", engine)
+    cities = pd.read_sql("SELECT DISTINCT city FROM dim_city ORDER BY city", engine)
     states = pd.read_sql("SELECT DISTINCT state FROM processed_transactions", engine)
     selected_cities = st.sidebar.multiselect("City", options=list(cities["city"]))
     selected_states = st.sidebar.multiselect("State", options=list(states["state"]))
@@ -244,7 +434,7 @@ def data_frame2():
 
     # Get total records for pagination
     total_query = text(f"""
-        SELECT COUNT(*) FROM processed_transactions
+        SELECT COUNT(*) FROM transactions_view
         WHERE {where_sql}
     """)
     total_records = pd.read_sql(total_query, engine, params=params).iloc[0, 0]
@@ -262,7 +452,7 @@ def data_frame2():
         "offset": (st.session_state.page_num - 1) * st.session_state.page_size
     })
     query = text(f"""
-        SELECT * FROM processed_transactions
+        SELECT * FROM transactions_view
         WHERE {where_sql}
         ORDER BY transaction_id
         LIMIT :limit OFFSET :offset
@@ -286,6 +476,7 @@ def data_frame2():
     gb.configure_column("amt", header_name="Amount ($)")
     gb.configure_column("category", header_name="Category")
     gb.configure_column("job_category", header_name="Job Category")
+    gb.configure_column("job", header_name="Job")
     gb.configure_column("age_at_transaction", header_name="Age")
     gb.configure_column("gender", header_name="Gender")
     gb.configure_column("is_fraud", header_name="Is Fraud")
@@ -349,74 +540,220 @@ def data_frame2():
     
 
 def behavior_merchant_analysis():
-    st.subheader("⏱️🏪 Behavioral & Merchant Analysis")
+    import plotly.express as px
 
-    df = pd.read_sql("SELECT * FROM processed_transactions", engine)
-    df['is_fraud'] = df['is_fraud'].map({False: 'Legit', True: 'Fraud'})
+    st.subheader("⏱️🏪 Behavioral & Merchant Analysis")
+    show_estimate_notice()
 
 
     # ---- 1. Fraud by Hour ----
     st.markdown("### 🕒 Fraud by Hour of Day")
-    hour_fraud = df.groupby('hour')['is_fraud'].value_counts().unstack().fillna(0)
-    fig1 = px.bar(hour_fraud, barmode='group',
-                  labels={'value': 'Count', 'hour': 'Hour of Day'},
+    hour_fraud = read_analytics(f"""
+        SELECT hour, is_fraud, COUNT(*) AS count
+        FROM {transactions_source()}
+        GROUP BY hour, is_fraud
+        ORDER BY hour
+    """)
+    hour_fraud = scale_estimates(hour_fraud)
+    hour_fraud['is_fraud'] = hour_fraud['is_fraud'].map({False: 'Legit', True: 'Fraud'})
+    fig1 = px.bar(hour_fraud, x='hour', y='count', color='is_fraud', barmode='group',
+                  error_y=error_bars(),
+                  labels={'count': 'Count', 'hour': 'Hour of Day'},
                   title='Fraud vs Legit by Hour')
     st.plotly_chart(fig1, use_container_width=True)
 
 
     # ---- 2. Fraud by Day of Week ----
     st.markdown("### 📅 Fraud by Day of Week")
-    dow_fraud = df.groupby('day_of_week')['is_fraud'].value_counts().unstack().fillna(0)
-    fig2 = px.bar(dow_fraud, barmode='group',
-                  labels={'value': 'Count', 'day_of_week': 'Day of Week'},
+    dow_fraud = read_analytics(f"""
+        SELECT day_of_week, is_fraud, COUNT(*) AS count
+        FROM {transactions_source()}
+        GROUP BY day_of_week, is_fraud
+        ORDER BY day_of_week
+    """)
+    dow_fraud = scale_estimates(dow_fraud)
+    dow_fraud['is_fraud'] = dow_fraud['is_fraud'].map({False: 'Legit', True: 'Fraud'})
+    fig2 = px.bar(dow_fraud, x='day_of_week', y='count', color='is_fraud', barmode='group',
+                  error_y=error_bars(),
+                  labels={'count': 'Count', 'day_of_week': 'Day of Week'},
                   title='Fraud vs Legit by Day')
     st.plotly_chart(fig2, use_container_width=True)
 
 
     # ---- 3. Top Merchants with Most Frauds ----
     st.markdown("### 🏪 Top 10 Merchants with Most Fraud Transactions")
-    top_merchants = df[df['is_fraud'] == 'Fraud'].groupby('merchant').size().reset_index(name='fraud_count')
-    top_merchants = top_merchants.sort_values(by='fraud_count', ascending=False).head(10)
+    top_merchants = read_analytics(f"""
+        SELECT m.name AS merchant, top.fraud_count
+        FROM (
+            SELECT merchant_id, COUNT(*) AS fraud_count
+            FROM {transactions_source()}
+            WHERE is_fraud = TRUE
+            GROUP BY merchant_id
+            ORDER BY fraud_count DESC
+            LIMIT 10
+        ) top
+        LEFT JOIN dim_merchant m ON m.merchant_id = top.merchant_id
+        ORDER BY top.fraud_count DESC
+    """)
+    top_merchants = scale_estimates(top_merchants, 'fraud_count')
     fig3 = px.bar(top_merchants, x='merchant', y='fraud_count',
+                  error_y=error_bars('fraud_count'),
                   color='fraud_count', color_continuous_scale='Reds',
                   labels={'merchant': 'Merchant', 'fraud_count': 'Fraud Count'})
     st.plotly_chart(fig3, use_container_width=True)
 
 
 
+AGE_HISTOGRAM_BINS = 30
+BOX_OUTLIER_SAMPLE = 200
+FRAUD_COLORS = {'Fraud': 'red', 'Legit': 'green'}
+
+
+def load_age_histogram(nbins=AGE_HISTOGRAM_BINS):
+    """
+    Returns per-class age histogram counts computed in the database with width_bucket.
+    """
+    query = text(f"""
+        WITH bounds AS (
+            SELECT MIN(age_at_transaction)::float AS lo, MAX(age_at_transaction)::float + 1 AS hi
+            FROM {transactions_source()}
+        )
+        SELECT p.is_fraud, width_bucket(p.age_at_transaction, b.lo, b.hi, :nbins) AS bucket,
+               COUNT(*) AS count, b.lo, b.hi
+        FROM {transactions_source('p')} CROSS JOIN bounds b
+        WHERE p.age_at_transaction IS NOT NULL
+        GROUP BY p.is_fraud, bucket, b.lo, b.hi
+        ORDER BY bucket
+    """)
+    hist = read_analytics(query, params={"nbins": nbins})
+    if hist.empty:
+        return hist
+    hist = scale_estimates(hist)
+    width = (hist["hi"].iloc[0] - hist["lo"].iloc[0]) / nbins
+    hist["bin_start"] = hist["lo"] + (hist["bucket"] - 1) * width
+    hist["bin_center"] = hist["bin_start"] + width / 2
+    hist["width"] = width
+    hist["is_fraud"] = hist["is_fraud"].map({False: 'Legit', True: 'Fraud'})
+    return hist
+
+
+def load_age_box_stats():
+    """
+    Returns quartiles and Tukey whiskers of age per class, computed with percentile_cont.
+    """
+    query = text(f"""
+        WITH quartiles AS (
+            SELECT is_fraud,
+                   percentile_cont(0.25) WITHIN GROUP (ORDER BY age_at_transaction) AS q1,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY age_at_transaction) AS median,
+                   percentile_cont(0.75) WITHIN GROUP (ORDER BY age_at_transaction) AS q3
+            FROM {transactions_source()}
+            WHERE age_at_transaction IS NOT NULL
+            GROUP BY is_fraud
+        )
+        SELECT q.is_fraud, q.q1, q.median, q.q3,
+               MIN(p.age_at_transaction) FILTER (
+                   WHERE p.age_at_transaction >= q.q1 - 1.5 * (q.q3 - q.q1)) AS lowerfence,
+               MAX(p.age_at_transaction) FILTER (
+                   WHERE p.age_at_transaction <= q.q3 + 1.5 * (q.q3 - q.q1)) AS upperfence
+        FROM quartiles q
+        JOIN {transactions_source('p')} ON p.is_fraud = q.is_fraud
+        WHERE p.age_at_transaction IS NOT NULL
+        GROUP BY q.is_fraud, q.q1, q.median, q.q3
+    """)
+    stats = read_analytics(query)
+    stats["is_fraud"] = stats["is_fraud"].map({False: 'Legit', True: 'Fraud'})
+    return stats
+
+
+def load_age_outliers(stats, limit=BOX_OUTLIER_SAMPLE):
+    """
+    Returns up to `limit` distinct outlying ages per class (outside the whiskers) with their counts.
+    """
+    outliers = []
+    for row in stats.itertuples():
+        query = text(f"""
+            SELECT age_at_transaction, COUNT(*) AS count
+            FROM {transactions_source()}
+            WHERE is_fraud = :is_fraud
+              AND (age_at_transaction < :lowerfence OR age_at_transaction > :upperfence)
+            GROUP BY age_at_transaction
+            ORDER BY count DESC
+            LIMIT :limit
+        """)
+        df = read_analytics(query, params={
+            "is_fraud": row.is_fraud == 'Fraud',
+            "lowerfence": row.lowerfence,
+            "upperfence": row.upperfence,
+            "limit": limit,
+        })
+        df = scale_estimates(df)
+        df["is_fraud"] = row.is_fraud
+        outliers.append(df)
+    if not outliers:
+        return pd.DataFrame(columns=["age_at_transaction", "count", "is_fraud"])
+    return pd.concat(outliers, ignore_index=True)
+
+
 def show_demographic_analysis():
-    # Load data
-    df = pd.read_sql("SELECT gender, age_at_transaction, is_fraud FROM processed_transactions", engine)
+    import plotly.express as px
+    import plotly.graph_objects as go
 
+    show_estimate_notice()
 
-    df['is_fraud'] = df['is_fraud'].map({False: 'Legit', True: 'Fraud'})
+    # Load aggregated counts; the raw rows never leave the database
+    gender_fraud = read_analytics(f"""
+        SELECT gender, is_fraud, COUNT(*) AS count
+        FROM {transactions_source()}
+        GROUP BY gender, is_fraud
+    """)
+    gender_fraud = scale_estimates(gender_fraud)
+    gender_fraud['is_fraud'] = gender_fraud['is_fraud'].map({False: 'Legit', True: 'Fraud'})
 
     # ---- 1. Fraud by gender
     st.markdown("### 🚻 Fraud by Gender")
-    gender_fraud = df.groupby(['gender', 'is_fraud']).size().reset_index(name='count')
     fig1 = px.bar(gender_fraud, x='gender', y='count', color='is_fraud', barmode='group',
-                  labels={'count': 'Number of Transactions'}, color_discrete_map={'Fraud': 'red', 'Legit': 'green'})
+                  error_y=error_bars(), labels={'count': 'Number of Transactions'}, color_discrete_map=FRAUD_COLORS)
     st.plotly_chart(fig1, use_container_width=True)
 
     # ---- 2. Age distribution plot
     st.markdown("### 🎂 Age Distribution by Fraud Type")
-    fig2 = px.histogram(df, x='age_at_transaction', color='is_fraud', nbins=30,
-                        labels={'age_at_transaction': 'Age'}, barmode='overlay', opacity=0.6,
-                        color_discrete_map={'Fraud': 'red', 'Legit': 'green'})
+    hist = load_age_histogram()
+    fig2 = go.Figure()
+    for label, group in hist.groupby('is_fraud'):
+        fig2.add_trace(go.Bar(x=group['bin_center'], y=group['count'], width=group['width'],
+                              error_y=dict(type='data', array=group['count_error'], visible=approximate_mode),
+                              name=label, marker_color=FRAUD_COLORS[label], opacity=0.6))
+    fig2.update_layout(barmode='overlay', xaxis_title='Age', yaxis_title='count',
+                       legend_title_text='is_fraud')
     st.plotly_chart(fig2, use_container_width=True)
 
     # ---- 3. Boxplot age
     st.markdown("### 📦 Age Distribution (Box Plot)")
-    fig3 = px.box(df, x='is_fraud', y='age_at_transaction', color='is_fraud',
-                  labels={'age_at_transaction': 'Age', 'is_fraud': 'Transaction Type'},
-                  color_discrete_map={'Fraud': 'red', 'Legit': 'green'})
+    box_stats = load_age_box_stats()
+    outliers = load_age_outliers(box_stats)
+    fig3 = go.Figure()
+    for row in box_stats.itertuples():
+        fig3.add_trace(go.Box(
+            name=row.is_fraud, x=[row.is_fraud],
+            q1=[row.q1], median=[row.median], q3=[row.q3],
+            lowerfence=[row.lowerfence], upperfence=[row.upperfence],
+            marker_color=FRAUD_COLORS[row.is_fraud],
+        ))
+        class_outliers = outliers[outliers['is_fraud'] == row.is_fraud]
+        fig3.add_trace(go.Scatter(
+            x=[row.is_fraud] * len(class_outliers), y=class_outliers['age_at_transaction'],
+            mode='markers', marker_color=FRAUD_COLORS[row.is_fraud], showlegend=False,
+            customdata=class_outliers['count'], hovertemplate='Age %{y}<br>Count %{customdata:,.0f}',
+        ))
+    fig3.update_layout(xaxis_title='Transaction Type', yaxis_title='Age')
     st.plotly_chart(fig3, use_container_width=True)
 
     # ---- 4. Fraud rate by gender
     st.markdown("### 📈 Fraud Rate by Gender")
     # Calculate fraud rate per gender
-    fraud_counts = df[df['is_fraud'] == 'Fraud'].groupby('gender').size()
-    total_counts = df.groupby('gender').size()
+    fraud_counts = gender_fraud[gender_fraud['is_fraud'] == 'Fraud'].groupby('gender')['count'].sum()
+    total_counts = gender_fraud.groupby('gender')['count'].sum()
     gender_rate = (fraud_counts / total_counts * 100).fillna(0).reset_index()
     gender_rate.columns = ['gender', 'Fraud Rate (%)']
     fig4 = px.pie(
@@ -432,6 +769,57 @@ def show_demographic_analysis():
 
 
 
+LIVE_REFRESH_INTERVALS = {"Off": None, "5 s": 5, "15 s": 15, "60 s": 60}
+
+
+def render_live_view():
+    import plotly.express as px
+
+    if "live" not in st.session_state:
+        st.session_state.live = new_live_state()
+    state = st.session_state.live = refresh_live_state(st.session_state.live, engine)
+
+    hourly = state["hourly"].reset_index()
+    total_transactions = int(hourly["count"].sum())
+    frauds = hourly[hourly["is_fraud"] == True]
+    total_frauds = int(frauds["count"].sum())
+    fraud_rate = (total_frauds / total_transactions) * 100 if total_transactions > 0 else 0
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Total Transactions", f"{total_transactions:,}", delta=state["last_delta_rows"] or None)
+    col2.metric("Total Frauds", f"{total_frauds:,}")
+    col3.metric("Fraud Rate (%)", f"{fraud_rate:.2f}")
+    col4.metric("💰 Fraud Amount", f"${frauds['amount'].sum():,.2f}")
+    st.caption(
+        f"Last transaction ID: {state['high_water_mark']} · "
+        f"Last processed at: {state['last_processed_at'] or '—'}"
+    )
+
+    if hourly.empty:
+        st.warning("No processed transactions yet.")
+        return
+
+    hourly["is_fraud"] = hourly["is_fraud"].map({False: 'Legit', True: 'Fraud'})
+    fig = px.bar(hourly, x='hour', y='count', color='is_fraud', barmode='group',
+                 labels={'count': 'Count', 'hour': 'Hour of Day'},
+                 color_discrete_map=FRAUD_COLORS, title='Fraud vs Legit by Hour')
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.markdown("### 🚨 Latest Frauds")
+    st.dataframe(state["recent_frauds"], use_container_width=True, hide_index=True)
+
+
+def show_live_monitor():
+    st.subheader("🔴 Live Fraud Monitor")
+    interval = st.sidebar.selectbox("Auto-refresh", options=list(LIVE_REFRESH_INTERVALS), index=1)
+    if st.sidebar.button("Reset live view"):
+        st.session_state.live = new_live_state()
+
+    # Each tick only reruns this fragment and reads rows above the high-water mark
+    st.fragment(run_every=LIVE_REFRESH_INTERVALS[interval])(render_live_view)()
+
+
+
 #Page routing
 if page == "Analytics 📊":
     show_analytics()
@@ -445,5 +833,9 @@ elif page == "Demographic Analysis (Age, Gender) 👤":
     show_demographic_analysis()
 elif page == "Behavioral & Merchant Analysis ⏱️🏪":
     behavior_merchant_analysis()
+elif page == "Live Fraud Monitor 🔴":
+    show_live_monitor()
 else:
     st.error("Page not found. Please select a valid page from the sidebar.")
+
+report_startup(f"Dashboard ({page})", since=run_started)
@@ -0,0 +1,221 @@
+import argparse
+import datetime
+import os
+import time
+
+import pandas as pd
+import psycopg2
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+POSTGRES_DB=os.getenv('POSTGRES_DB')
+POSTGRES_USER=os.getenv('POSTGRES_USER')
+POSTGRES_PWD=os.getenv('POSTGRES_PASS')
+POSTGRES_HOST=os.getenv('POSTGRES_HOST')
+POSTGRES_PORT=os.getenv('POSTGRES_PORT')
+
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', '../archive/raw_data')
+RETENTION_DAYS = int(os.getenv('RAW_RETENTION_DAYS', 30))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 5000))
+ARCHIVE_PAUSE_SECONDS = float(os.getenv('ARCHIVE_PAUSE_SECONDS', 0.2))
+ARCHIVE_LOCK_TIMEOUT = os.getenv('ARCHIVE_LOCK_TIMEOUT', '2s')
+ARCHIVE_COMPRESSION = 'zstd'
+
+PARTITIONING = ds.partitioning(pa.schema([('day', pa.string())]), flavor='hive')
+
+# Column types of raw_data. Every file is written with this schema: inferring it per day would type a
+# column that is NULL all day as null, which the other days' files cannot be combined with.
+RAW_DATA_SCHEMA = pa.schema([
+    ('transaction_id', pa.int64()),
+    ('cc_num', pa.string()),
+    ('first', pa.string()),
+    ('last', pa.string()),
+    ('transaction_time', pa.timestamp('us')),
+    ('category', pa.string()),
+    ('amount', pa.float64()),
+    ('merchant', pa.string()),
+    ('merchant_latitude', pa.float64()),
+    ('merchant_longitude', pa.float64()),
+    ('job', pa.string()),
+    ('zip', pa.string()),
+    ('gender', pa.string()),
+    ('city', pa.string()),
+    ('city_pop', pa.int64()),
+    ('state', pa.string()),
+    ('latitude', pa.float64()),
+    ('longitude', pa.float64()),
+    ('unix_time', pa.int64()),
+    ('is_fraud', pa.int64()),
+    ('created_at', pa.timestamp('us')),
+])
+
+
+def connect_to_postgres():
+    conn = psycopg2.connect(
+        dbname=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PWD,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT
+    )
+
+    conn.autocommit = False
+    return conn
+
+
+def write_partitions(df, archive_dir=ARCHIVE_DIR):
+    """
+    Writes rows to compressed Parquet files partitioned by the day they were created.
+    File names are derived from the transaction ids, so re-archiving the same rows overwrites them.
+    """
+    days = df['created_at'].dt.strftime('%Y-%m-%d')
+    written = []
+    for day, group in df.groupby(days):
+        partition_dir = os.path.join(archive_dir, f"day={day}")
+        os.makedirs(partition_dir, exist_ok=True)
+        file_name = f"part-{group['transaction_id'].min()}-{group['transaction_id'].max()}.parquet"
+        path = os.path.join(partition_dir, file_name)
+
+        table = pa.Table.from_pandas(group, schema=RAW_DATA_SCHEMA, preserve_index=False)
+        tmp_path = path + '.tmp'
+        pq.write_table(table, tmp_path, compression=ARCHIVE_COMPRESSION)
+        os.replace(tmp_path, path)
+        written.append(path)
+    return written
+
+
+def archive_batch(conn, cutoff, batch_size=ARCHIVE_BATCH_SIZE, archive_dir=ARCHIVE_DIR):
+    """
+    Moves one batch of rows older than the cutoff from raw_data to the archive.
+    Rows are deleted in their own short transaction that only commits after the files are written.
+    """
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET LOCAL lock_timeout = %s", (ARCHIVE_LOCK_TIMEOUT,))
+            cursor.execute("""
+                DELETE FROM raw_data
+                WHERE transaction_id IN (
+                    SELECT transaction_id FROM raw_data
+                    WHERE created_at < %s
+                    ORDER BY created_at, transaction_id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING *
+            """, (cutoff, batch_size))
+            rows = cursor.fetchall()
+            columns = [column[0] for column in cursor.description]
+
+        if not rows:
+            conn.rollback()
+            return 0
+
+        batch = pd.DataFrame(rows, columns=columns).sort_values('transaction_id')
+        batch['created_at'] = pd.to_datetime(batch['created_at'])
+        write_partitions(batch, archive_dir)
+        conn.commit()
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def archive_old_rows(conn, retention_days=RETENTION_DAYS, batch_size=ARCHIVE_BATCH_SIZE,
+                     pause_seconds=ARCHIVE_PAUSE_SECONDS, archive_dir=ARCHIVE_DIR):
+    """
+    Archives all raw_data rows older than `retention_days`, one batch at a time.
+    """
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=retention_days)
+    print(f"Archiving raw_data rows created before {cutoff:%Y-%m-%d %H:%M:%S} to {archive_dir}")
+
+    total = 0
+    while True:
+        try:
+            archived = archive_batch(conn, cutoff, batch_size, archive_dir)
+        except psycopg2.errors.LockNotAvailable:
+            print("Batch is locked by another transaction, retrying later.")
+            time.sleep(pause_seconds * 10)
+            continue
+
+        if archived == 0:
+            break
+        total += archived
+        print(f"Archived {archived} rows ({total} total)")
+        # Give concurrent writers and autovacuum room between batches
+        time.sleep(pause_seconds)
+
+    print(f"Archiving finished, {total} rows moved.")
+    return total
+
+
+def vacuum_raw_data(conn):
+    """
+    Runs VACUUM ANALYZE on raw_data so the space freed by archiving is reused.
+    """
+    conn.commit()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("VACUUM (ANALYZE) raw_data")
+    finally:
+        conn.autocommit = False
+
+
+def list_archived_days(archive_dir=ARCHIVE_DIR):
+    """
+    Returns the sorted list of archived days.
+    """
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(
+        name.split('=', 1)[1] for name in os.listdir(archive_dir) if name.startswith('day=')
+    )
+
+
+def read_archive(start_day=None, end_day=None, columns=None, where=None, archive_dir=ARCHIVE_DIR):
+    """
+    Reads archived raw_data rows for the given inclusive day range ('YYYY-MM-DD') into a DataFrame.
+    Only the matching day partitions are opened; `where` is an optional extra pyarrow expression.
+    """
+    if not list_archived_days(archive_dir):
+        return pd.DataFrame(columns=columns)
+
+    # The explicit schema also reads files written with inferred types before it existed
+    dataset = ds.dataset(
+        archive_dir, format='parquet', partitioning=PARTITIONING,
+        schema=pa.unify_schemas([RAW_DATA_SCHEMA, PARTITIONING.schema])
+    )
+    expression = where
+    if start_day is not None:
+        expression = _and(expression, ds.field('day') >= str(start_day))
+    if end_day is not None:
+        expression = _and(expression, ds.field('day') <= str(end_day))
+
+    read_columns = None if columns is None else list(dict.fromkeys(['transaction_id', *columns]))
+    table = dataset.to_table(columns=read_columns, filter=expression)
+    df = table.to_pandas().drop_duplicates(subset='transaction_id')
+    df = df.sort_values('transaction_id').reset_index(drop=True)
+    return df if columns is None else df[columns]
+
+
+def _and(left, right):
+    return right if left is None else left & right
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old raw_data rows to compressed Parquet archives.")
+    parser.add_argument('--days', type=int, default=RETENTION_DAYS, help="retention age in days")
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR)
+    parser.add_argument('--vacuum', action='store_true', help="run VACUUM ANALYZE on raw_data afterwards")
+    args = parser.parse_args()
+
+    db_conn = connect_to_postgres()
+    try:
+        moved = archive_old_rows(db_conn, args.days, args.batch_size, archive_dir=args.archive_dir)
+        if moved and args.vacuum:
+            vacuum_raw_data(db_conn)
+    finally:
+        db_conn.close()
@@ -0,0 +1,199 @@
+import argparse
+import csv
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import pandas as pd
+
+import dimensions
+from processor import clean_data
+from uploader import PROCESSED_COLUMNS, bulk_copy, connect_to_postgres, processed_values
+
+
+DEFAULT_FILE = "../data/fraudTrain.csv"
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def select_range(chunk, start=None, end=None):
+    """
+    Keeps the rows whose transaction time falls in [start, end).
+    """
+    if start is None and end is None:
+        return chunk
+    times = pd.to_datetime(chunk['trans_date_trans_time'], format="%Y-%m-%d %H:%M:%S", errors='coerce')
+    mask = pd.Series(True, index=chunk.index)
+    if start is not None:
+        mask &= times >= pd.Timestamp(start)
+    if end is not None:
+        mask &= times < pd.Timestamp(end)
+    return chunk[mask]
+
+
+def clean_chunk(chunk, start=None, end=None):
+    """
+    Worker step: filters a raw chunk to the date range and cleans it. Returns cleaned records.
+    """
+    chunk = select_range(chunk, start, end)
+    if chunk.empty:
+        return []
+    return clean_data(chunk).to_dict(orient="records")
+
+
+def ensure_checkpoint_table(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+                job_name VARCHAR(512) PRIMARY KEY,
+                chunk_size INT NOT NULL,
+                last_chunk INT NOT NULL,
+                rows_loaded BIGINT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    conn.commit()
+
+
+def load_checkpoint(conn, job_name, chunk_size):
+    """
+    Returns (last completed chunk, rows loaded) for the job, or (-1, 0) when it has not started.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT chunk_size, last_chunk, rows_loaded FROM backfill_checkpoints WHERE job_name = %s",
+            (job_name,)
+        )
+        row = cursor.fetchone()
+    conn.commit()
+    if row is None:
+        return -1, 0
+    if row[0] != chunk_size:
+        raise ValueError(
+            f"Checkpoint for {job_name} was written with chunk size {row[0]}, not {chunk_size}; "
+            "resume with the same --chunk-size or use --restart"
+        )
+    return row[1], row[2]
+
+
+def save_checkpoint(cursor, job_name, chunk_size, last_chunk, rows_loaded):
+    cursor.execute("""
+        INSERT INTO backfill_checkpoints (job_name, chunk_size, last_chunk, rows_loaded, updated_at)
+        VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (job_name) DO UPDATE
+        SET last_chunk = EXCLUDED.last_chunk, rows_loaded = EXCLUDED.rows_loaded, updated_at = EXCLUDED.updated_at
+    """, (job_name, chunk_size, last_chunk, rows_loaded))
+
+
+def delete_checkpoint(conn, job_name):
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM backfill_checkpoints WHERE job_name = %s", (job_name,))
+    conn.commit()
+
+
+def read_chunks(file_path, chunk_size, last_chunk):
+    """
+    Yields (chunk index, chunk) for the chunks after last_chunk. The rows of the completed chunks are
+    skipped on the open file with the csv module, so resuming takes constant memory. The chunks keep
+    the file's column names.
+    """
+    # Column names as pandas reads them, e.g. "Unnamed: 0" for the unnamed index column
+    names = pd.read_csv(file_path, nrows=0).columns
+    with open(file_path, newline='') as f:
+        deque(islice(csv.reader(f), (last_chunk + 1) * chunk_size + 1), maxlen=0)
+        for index, chunk in enumerate(pd.read_csv(f, chunksize=chunk_size, header=None, names=names),
+                                      start=last_chunk + 1):
+            # Past the end of the file pandas still yields one empty chunk
+            if not chunk.empty:
+                yield index, chunk
+
+
+def load_chunk(conn, records, job_name, chunk_size, chunk_index, rows_loaded):
+    """
+    Interns dimension values, COPYs the cleaned rows and advances the checkpoint in one transaction,
+    so a chunk is either fully loaded and checkpointed or not at all.
+    """
+    try:
+        dimensions.intern_records(conn, records)
+        loaded = bulk_copy(conn, 'processed_transactions', PROCESSED_COLUMNS, processed_values(records))
+        with conn.cursor() as cursor:
+            save_checkpoint(cursor, job_name, chunk_size, chunk_index, rows_loaded + loaded)
+        conn.commit()
+        return loaded
+    except Exception:
+        conn.rollback()
+        dimensions.reset_dimension_cache()
+        raise
+
+
+def run_backfill(file_path, start=None, end=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=None,
+                 job_name=None, restart=False):
+    """
+    Cleans the file in chunks on a process pool and bulk-loads the results into processed_transactions,
+    resuming after the last checkpointed chunk.
+    """
+    job_name = job_name or f"{os.path.basename(file_path)}:{start or ''}:{end or ''}"
+    workers = workers or os.cpu_count()
+
+    conn = connect_to_postgres()
+    try:
+        ensure_checkpoint_table(conn)
+        if restart:
+            delete_checkpoint(conn, job_name)
+        last_chunk, rows_loaded = load_checkpoint(conn, job_name, chunk_size)
+        dimensions.load_dimension_cache(conn)
+        conn.commit()
+
+        if last_chunk >= 0:
+            print(f"Resuming {job_name} after chunk {last_chunk} ({rows_loaded} rows already loaded)")
+        else:
+            print(f"Starting {job_name}")
+
+        started = time.perf_counter()
+        loaded_this_run = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            chunks = read_chunks(file_path, chunk_size, last_chunk)
+            exhausted = False
+            while pending or not exhausted:
+                # Keep every worker busy while bounding the number of chunks held in memory
+                while not exhausted and len(pending) < workers * 2:
+                    try:
+                        chunk_index, chunk = next(chunks)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.append((chunk_index, pool.submit(clean_chunk, chunk, start, end)))
+                if not pending:
+                    break
+
+                # Load in file order so the checkpoint always marks a contiguous prefix
+                chunk_index, future = pending.popleft()
+                loaded = load_chunk(conn, future.result(), job_name, chunk_size, chunk_index, rows_loaded)
+                rows_loaded += loaded
+                loaded_this_run += loaded
+                elapsed = time.perf_counter() - started
+                print(f"Chunk {chunk_index}: loaded {loaded} rows, {rows_loaded} total, "
+                      f"{loaded_this_run / elapsed:,.0f} rows/s")
+
+        print(f"Backfill {job_name} finished: {rows_loaded} rows loaded.")
+        return rows_loaded
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Clean a transactions CSV and bulk-load it into processed_transactions without RabbitMQ."
+    )
+    parser.add_argument('--file', default=DEFAULT_FILE)
+    parser.add_argument('--start', help="first transaction date to load (inclusive), e.g. 2019-06-01")
+    parser.add_argument('--end', help="transaction date to stop at (exclusive), e.g. 2019-07-01")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=None, help="cleaning processes (default: CPU count)")
+    parser.add_argument('--job-name', help="checkpoint name (default: file name and date range)")
+    parser.add_argument('--restart', action='store_true', help="ignore the checkpoint and start from the top")
+    args = parser.parse_args()
+
+    run_backfill(args.file, args.start, args.end, args.chunk_size, args.workers, args.job_name, args.restart)
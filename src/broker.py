@@ -0,0 +1,178 @@
+import json
+import os
+import zlib
+from collections import defaultdict
+
+import pika
+
+
+# Per-queue bounds, read from <QUEUE>_MAX_LENGTH, <QUEUE>_MAX_LENGTH_BYTES and <QUEUE>_OVERFLOW,
+# e.g. PROCESSED_DATA_UPLOAD_MAX_LENGTH=500. Unset means unbounded.
+DEFAULT_OVERFLOW = "reject-publish"
+OVERFLOW_POLICIES = ("reject-publish", "reject-publish-dlx", "drop-head")
+
+PUBLISH_RETRY_DELAY = float(os.getenv("PUBLISH_RETRY_DELAY", 1.0))
+
+# Sharded upload: publishers split batches by key into hash buckets, and a consistent-hash exchange per table
+# (rabbitmq_consistent_hash_exchange plugin) maps every bucket to one of the writer queues.
+# Set to the same number of writers for the producer, processor and uploader; 0 keeps the single uploader.
+UPLOADER_SHARDS = int(os.getenv("UPLOADER_SHARDS", 0))
+SHARD_BUCKETS = int(os.getenv("SHARD_BUCKETS", 32))
+RAW_SHARD_KEY = os.getenv("RAW_SHARD_KEY", "state")
+# Cleaned rows no longer carry the card number
+PROCESSED_SHARD_KEY = "state"
+SHARD_EXCHANGES = {"raw": "raw_shards", "processed": "processed_shards"}
+
+
+def queue_arguments(queue):
+    """
+    Returns the x-arguments for declaring the queue, or None when it is unbounded.
+    Every service declaring a queue must use these, since RabbitMQ rejects a redeclare with other arguments.
+    """
+    prefix = queue.upper()
+    arguments = {}
+    if os.getenv(f"{prefix}_MAX_LENGTH"):
+        arguments["x-max-length"] = int(os.getenv(f"{prefix}_MAX_LENGTH"))
+    if os.getenv(f"{prefix}_MAX_LENGTH_BYTES"):
+        arguments["x-max-length-bytes"] = int(os.getenv(f"{prefix}_MAX_LENGTH_BYTES"))
+    if not arguments:
+        return None
+
+    overflow = os.getenv(f"{prefix}_OVERFLOW", DEFAULT_OVERFLOW)
+    if overflow not in OVERFLOW_POLICIES:
+        raise ValueError(f"{prefix}_OVERFLOW must be one of {', '.join(OVERFLOW_POLICIES)}, not {overflow}")
+    arguments["x-overflow"] = overflow
+    return arguments
+
+
+def declare_queue(channel, queue):
+    """
+    Declares a durable queue with its configured bounds.
+    """
+    arguments = queue_arguments(queue)
+    if arguments:
+        print(f"Queue {queue} bounded: {arguments}")
+    return channel.queue_declare(queue=queue, durable=True, arguments=arguments)
+
+
+def is_bounded(queues):
+    return any(queue_arguments(queue) for queue in queues)
+
+
+def queue_depths(connection, probe, queues):
+    """
+    Returns {queue: ready messages} using passive declares, together with the probe channel to use next time.
+    Queues that do not exist yet are reported as 0.
+    """
+    depths = {}
+    for queue in queues:
+        try:
+            result = probe.queue_declare(queue=queue, passive=True)
+            depths[queue] = result.method.message_count
+        except pika.exceptions.ChannelClosedByBroker:
+            # The consumer has not declared the queue yet and the broker closed the channel
+            probe = connection.channel()
+            depths[queue] = 0
+    return depths, probe
+
+
+def queue_depth(connection, probe, queues):
+    """
+    Returns the deepest backlog (in messages) of the given queues, together with the probe channel.
+    """
+    depths, probe = queue_depths(connection, probe, queues)
+    return max(depths.values(), default=0), probe
+
+
+def publish(channel, routing_key, body, retry_delay=PUBLISH_RETRY_DELAY, exchange="fraud_exchange"):
+    """
+    Publishes a persistent JSON message and returns the number of rejected attempts.
+    On a channel with publisher confirms, a message refused by a full reject-publish queue is nacked;
+    it is then retried after `retry_delay` seconds until the queue has room again.
+    """
+    rejected = 0
+    while True:
+        try:
+            channel.basic_publish(
+                exchange=exchange,
+                routing_key=routing_key,
+                body=body,
+                properties=pika.BasicProperties(
+                    content_type="application/json",
+                    delivery_mode=2
+                )
+            )
+            return rejected
+        except pika.exceptions.NackError:
+            rejected += 1
+            if rejected == 1:
+                print(f"Broker rejected a {routing_key} message (queue full), retrying every {retry_delay} s")
+            channel.connection.sleep(retry_delay)
+
+
+def publish_fanout(channel, routing_key, queues, body, retry_delay=PUBLISH_RETRY_DELAY):
+    """
+    Publishes a message that routing_key delivers to all of `queues`, and returns the number of rejected attempts.
+    A publish nacked by one full queue is still enqueued in the others, so retrying it through the exchange
+    would add another copy there. When any of the queues is bounded the message is therefore published to
+    each queue on its own through the default exchange, and only the full queue is retried.
+    """
+    if len(queues) < 2 or not is_bounded(queues):
+        return publish(channel, routing_key, body, retry_delay)
+    return sum(publish(channel, queue, body, retry_delay, exchange="") for queue in queues)
+
+
+def shard_queue(kind, shard):
+    return f"{kind}_shard_{shard}"
+
+
+def shard_queues(kind, shards=UPLOADER_SHARDS):
+    return [shard_queue(kind, shard) for shard in range(shards)]
+
+
+def declare_shard_exchange(channel, kind):
+    channel.exchange_declare(exchange=SHARD_EXCHANGES[kind], exchange_type="x-consistent-hash", durable=True)
+
+
+def declare_shard_queue(channel, kind, shard):
+    """
+    Declares a writer's queue and binds it to the table's consistent-hash exchange.
+    """
+    declare_shard_exchange(channel, kind)
+    queue = shard_queue(kind, shard)
+    declare_queue(channel, queue)
+    # On a consistent-hash exchange the binding key is the queue's weight on the hash ring
+    channel.queue_bind(queue=queue, exchange=SHARD_EXCHANGES[kind], routing_key="1")
+    return queue
+
+
+def shard_bucket(value, buckets=SHARD_BUCKETS):
+    """
+    Stable hash bucket of a key value; the same in every process, unlike hash().
+    """
+    return zlib.crc32(str(value).encode()) % buckets
+
+
+def split_by_shard(records, key, buckets=SHARD_BUCKETS):
+    """
+    Groups records by the hash bucket of their `key` field, keeping their order. Returns {bucket: records}.
+    """
+    buckets_by_value = {}
+    groups = defaultdict(list)
+    for record in records:
+        value = record.get(key)
+        if value not in buckets_by_value:
+            buckets_by_value[value] = shard_bucket(value, buckets)
+        groups[buckets_by_value[value]].append(record)
+    return groups
+
+
+def publish_shards(channel, kind, records, key, retry_delay=PUBLISH_RETRY_DELAY):
+    """
+    Publishes one message per hash bucket present in the records to the table's shard exchange, with the
+    bucket as routing key, so all rows of a key reach the same writer. Returns the number of rejected attempts.
+    """
+    rejected = 0
+    for bucket, group in split_by_shard(records, key).items():
+        rejected += publish(channel, str(bucket), json.dumps(group), retry_delay, exchange=SHARD_EXCHANGES[kind])
+    return rejected
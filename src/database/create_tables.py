@@ -1,5 +1,55 @@
 from db import connect
 
+
+def migrate_processed_transactions(cur):
+    """
+    Brings a processed_transactions table from before dictionary encoding up to date: interns its
+    merchant and city strings into the dimension tables, replaces them by keys and adds the newer columns.
+    Does nothing on a table that is already up to date.
+    """
+    cur.execute("""
+        ALTER TABLE processed_transactions
+            ADD COLUMN IF NOT EXISTS merchant_id INT REFERENCES dim_merchant (merchant_id),
+            ADD COLUMN IF NOT EXISTS job_id INT REFERENCES dim_job (job_id),
+            ADD COLUMN IF NOT EXISTS city_id INT REFERENCES dim_city (city_id),
+            ADD COLUMN IF NOT EXISTS distance_km FLOAT,
+            ADD COLUMN IF NOT EXISTS geohash VARCHAR(12) COLLATE "C";
+    """)
+
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'processed_transactions'
+            AND column_name IN ('merchant', 'city');
+    """)
+    legacy = {row[0] for row in cur.fetchall()}
+
+    if 'merchant' in legacy:
+        cur.execute("""
+            INSERT INTO dim_merchant (name)
+            SELECT DISTINCT merchant FROM processed_transactions WHERE merchant IS NOT NULL
+            ON CONFLICT DO NOTHING;
+
+            UPDATE processed_transactions p SET merchant_id = m.merchant_id
+            FROM dim_merchant m WHERE m.name = p.merchant;
+
+            ALTER TABLE processed_transactions DROP COLUMN merchant;
+        """)
+        print("Moved processed_transactions.merchant to dim_merchant.")
+
+    if 'city' in legacy:
+        cur.execute("""
+            INSERT INTO dim_city (city, state)
+            SELECT DISTINCT city, state FROM processed_transactions WHERE city IS NOT NULL
+            ON CONFLICT DO NOTHING;
+
+            UPDATE processed_transactions p SET city_id = c.city_id
+            FROM dim_city c WHERE c.city = p.city AND c.state IS NOT DISTINCT FROM p.state;
+
+            ALTER TABLE processed_transactions DROP COLUMN city;
+        """)
+        print("Moved processed_transactions.city to dim_city.")
+
+
 def create_tables():
     conn = connect()
     if conn is None:
@@ -32,16 +82,42 @@ def create_tables():
         );
     """)
 
+    # Lets the archiver find rows past the retention age without scanning the heap
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_raw_data_created_at ON raw_data (created_at);
+    """)
+
+    # Dimension tables: repeated strings are stored once and referenced by integer keys
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS dim_merchant (
+            merchant_id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL UNIQUE
+        );
+
+        CREATE TABLE IF NOT EXISTS dim_city (
+            city_id SERIAL PRIMARY KEY,
+            city VARCHAR(255) NOT NULL,
+            state VARCHAR(10),
+            UNIQUE NULLS NOT DISTINCT (city, state)
+        );
+
+        CREATE TABLE IF NOT EXISTS dim_job (
+            job_id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL UNIQUE
+        );
+    """)
+
     cur.execute("""
-        CREATE TABLE processed_transactions (
+        CREATE TABLE IF NOT EXISTS processed_transactions (
             transaction_id SERIAL PRIMARY KEY,
-            merchant VARCHAR(255),
+            merchant_id INT REFERENCES dim_merchant (merchant_id),
             TRANSACTION_TIME TIMESTAMP,
             category VARCHAR(255),
             job_category VARCHAR(255),
+            job_id INT REFERENCES dim_job (job_id),
             amt FLOAT,
             gender VARCHAR(1),
-            city VARCHAR(255),
+            city_id INT REFERENCES dim_city (city_id),
             state VARCHAR(10),
             is_fraud BOOLEAN,
             hour INT,
@@ -52,16 +128,42 @@ def create_tables():
             year INT,
             lat FLOAT,
             long FLOAT,
+            distance_km FLOAT,
+            geohash VARCHAR(12) COLLATE "C",
             processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
 
     """)
 
+    # Tables created by an older version of this script
+    migrate_processed_transactions(cur)
+
+    # Spatial index for the map and "frauds near" queries: geohash prefixes are btree ranges under the
+    # C collation. Partial, since those queries only read frauds and it keeps inserts of the rest cheap.
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_processed_fraud_geohash
+        ON processed_transactions (geohash) WHERE is_fraud;
+    """)
+
+    # Decoded view for readers that need the names; Postgres drops the joins a query doesn't use
+    cur.execute("""
+        CREATE OR REPLACE VIEW transactions_view AS
+        SELECT
+            p.transaction_id, m.name AS merchant, p.transaction_time, p.category, p.job_category,
+            j.name AS job, p.amt, p.gender, c.city, p.state, p.is_fraud, p.hour,
+            p.age_at_transaction, p.day_of_week, p.month, p.is_weekend, p.year, p.lat, p.long,
+            p.distance_km, p.geohash, p.processed_at
+        FROM processed_transactions p
+        LEFT JOIN dim_merchant m ON m.merchant_id = p.merchant_id
+        LEFT JOIN dim_city c ON c.city_id = p.city_id
+        LEFT JOIN dim_job j ON j.job_id = p.job_id;
+    """)
+
     conn.commit()
     cur.close()
     conn.close()
     print("Tables created.")
 
 
-
-create_tables()
+if __name__ == "__main__":
+    create_tables()
@@ -0,0 +1,85 @@
+from psycopg2.extras import execute_values
+
+
+# Dictionary-encoded attributes of processed_transactions: record fields -> dimension table
+DIMENSIONS = {
+    'merchant': {'table': 'dim_merchant', 'id': 'merchant_id', 'columns': ('name',), 'fields': ('merchant',)},
+    'city': {'table': 'dim_city', 'id': 'city_id', 'columns': ('city', 'state'), 'fields': ('city', 'state')},
+    'job': {'table': 'dim_job', 'id': 'job_id', 'columns': ('name',), 'fields': ('job',)},
+}
+
+# dimension -> {value tuple: surrogate key}, loaded once per process
+dimension_cache = {}
+
+
+def is_missing(value):
+    return value is None or value != value
+
+
+def load_dimension_cache(conn):
+    """
+    Loads every dimension table into the in-process cache and returns the number of entries.
+    """
+    with conn.cursor() as cursor:
+        for name, dim in DIMENSIONS.items():
+            cursor.execute(f"SELECT {dim['id']}, {', '.join(dim['columns'])} FROM {dim['table']}")
+            dimension_cache[name] = {tuple(row[1:]): row[0] for row in cursor.fetchall()}
+    return sum(len(cache) for cache in dimension_cache.values())
+
+
+def reset_dimension_cache():
+    """
+    Drops the cache; called after a rollback, which may have discarded freshly interned keys.
+    """
+    dimension_cache.clear()
+
+
+def record_key(record, dim):
+    key = tuple(None if is_missing(record.get(field)) else record.get(field) for field in dim['fields'])
+    return None if key[0] is None else key
+
+
+def insert_dimension_values(conn, dim, keys):
+    """
+    Inserts new dimension values and returns {value tuple: key} for them, including values
+    another writer inserted concurrently.
+    """
+    columns = ', '.join(dim['columns'])
+    # A stable order keeps concurrent writers from deadlocking on each other's inserts
+    keys = sorted(keys, key=lambda key: tuple('' if value is None else str(value) for value in key))
+    matches = ' AND '.join(f"d.{column} IS NOT DISTINCT FROM v.{column}" for column in dim['columns'])
+    with conn.cursor() as cursor:
+        execute_values(
+            cursor,
+            f"INSERT INTO {dim['table']} ({columns}) VALUES %s ON CONFLICT DO NOTHING",
+            keys
+        )
+        rows = execute_values(
+            cursor,
+            f"""
+            SELECT d.{dim['id']}, {', '.join('d.' + column for column in dim['columns'])}
+            FROM {dim['table']} d JOIN (VALUES %s) AS v ({columns}) ON {matches}
+            """,
+            keys,
+            fetch=True
+        )
+    return {tuple(row[1:]): row[0] for row in rows}
+
+
+def intern_records(conn, data):
+    """
+    Adds merchant_id, city_id and job_id to the records. Values missing from the cache are
+    inserted into the dimension tables inside the caller's transaction.
+    """
+    if not dimension_cache:
+        load_dimension_cache(conn)
+
+    for name, dim in DIMENSIONS.items():
+        cache = dimension_cache[name]
+        keys = [record_key(record, dim) for record in data]
+        unseen = {key for key in keys if key is not None and key not in cache}
+        if unseen:
+            cache.update(insert_dimension_values(conn, dim, unseen))
+        for record, key in zip(data, keys):
+            record[dim['id']] = None if key is None else cache.get(key)
+    return data
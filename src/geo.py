@@ -0,0 +1,142 @@
+import math
+
+import numpy as np
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Stored grid cell: geohash of the cardholder location, 7 characters is about 153 m x 153 m
+GEOHASH_PRECISION = 7
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+BASE32_CODES = np.frombuffer(BASE32.encode(), dtype=np.uint8)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in km between two sets of points, vectorized over arrays or Series.
+    Missing coordinates give NaN.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def encode_geohash(lat, lon, precision=GEOHASH_PRECISION):
+    """
+    Returns the geohash of every point as an object array, None where a coordinate is missing or out of range.
+    The points are quantized to integer cell indexes and the bits interleaved with array operations.
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    valid = np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+
+    bits = 5 * precision
+    lat_bits, lon_bits = bits // 2, (bits + 1) // 2
+    # Cell index along each axis; the upper edge (90 / 180) falls into the last cell
+    lat_index = np.clip(((np.where(valid, lat, 0) + 90) / 180 * 2 ** lat_bits).astype(np.int64), 0, 2 ** lat_bits - 1)
+    lon_index = np.clip(((np.where(valid, lon, 0) + 180) / 360 * 2 ** lon_bits).astype(np.int64), 0, 2 ** lon_bits - 1)
+
+    # Interleave from the most significant bit, longitude first
+    code = np.zeros(lat.shape, dtype=np.int64)
+    for i in range(bits):
+        if i % 2 == 0:
+            bit = (lon_index >> (lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (lat_index >> (lat_bits - 1 - i // 2)) & 1
+        code = (code << 1) | bit
+
+    chars = np.empty(lat.shape + (precision,), dtype=np.uint8)
+    for j in range(precision):
+        chars[..., j] = BASE32_CODES[(code >> (5 * (precision - 1 - j))) & 31]
+    hashes = chars.view(f"S{precision}")[..., 0].astype(str).astype(object)
+    hashes[~valid] = None
+    return hashes
+
+
+def geohash_bounds(geohash):
+    """
+    Returns (lat_min, lat_max, lon_min, lon_max) of a geohash cell.
+    """
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    even = True
+    for char in geohash:
+        code = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bit = (code >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                lon_lo, lon_hi = (mid, lon_hi) if bit else (lon_lo, mid)
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+            even = not even
+    return lat_lo, lat_hi, lon_lo, lon_hi
+
+
+def geohash_center(geohash):
+    lat_lo, lat_hi, lon_lo, lon_hi = geohash_bounds(geohash)
+    return (lat_lo + lat_hi) / 2, (lon_lo + lon_hi) / 2
+
+
+def cell_size_degrees(precision):
+    """
+    Returns the (height, width) of a geohash cell in degrees.
+    """
+    bits = 5 * precision
+    return 180 / 2 ** (bits // 2), 360 / 2 ** ((bits + 1) // 2)
+
+
+def covering_cells(lat, lon, radius_km, max_precision=GEOHASH_PRECISION):
+    """
+    Returns geohash prefixes whose cells together cover the circle around (lat, lon).
+    Uses the finest precision whose cells are at least as large as the radius, so the cell of the
+    point and its (at most 8) neighbours suffice. Returns [""] (everything) when the circle is too large.
+    """
+    lat_radius = radius_km / KM_PER_DEGREE
+    edge_lat = abs(lat) + lat_radius
+    if edge_lat >= 90:
+        return [""]
+    # Degrees of longitude per km grow towards the poles, so size by the circle's edge nearest the pole
+    lon_radius = radius_km / (KM_PER_DEGREE * math.cos(math.radians(edge_lat)))
+
+    precision = 0
+    for candidate in range(1, max_precision + 1):
+        height, width = cell_size_degrees(candidate)
+        if height < lat_radius or width < lon_radius:
+            break
+        precision = candidate
+    if precision == 0:
+        return [""]
+
+    height, width = cell_size_degrees(precision)
+    lats, lons = [], []
+    for dy in (-height, 0, height):
+        for dx in (-width, 0, width):
+            lats.append(min(90.0, max(-90.0, lat + dy)))
+            lons.append((lon + dx + 180) % 360 - 180)
+    return sorted(set(encode_geohash(lats, lons, precision)))
+
+
+def distance_sql(lat_column="lat", lon_column="long"):
+    """
+    SQL haversine distance in km from the :center_lat/:center_lon parameters; runs on Postgres and DuckDB.
+    """
+    return (
+        f"2 * {EARTH_RADIUS_KM} * asin(sqrt(least(1.0, "
+        f"power(sin(radians({lat_column} - :center_lat) / 2), 2) + "
+        f"cos(radians(:center_lat)) * cos(radians({lat_column})) * "
+        f"power(sin(radians({lon_column} - :center_lon) / 2), 2))))"
+    )
+
+
+def near_filter(lat, lon, radius_km, column="geohash", lat_column="lat", lon_column="long"):
+    """
+    Returns (SQL condition, params) for rows within radius_km of (lat, lon): prefix ranges on the covering
+    cells, which a btree on the geohash column answers with index range scans, then the exact distance.
+    """
+    cells = covering_cells(lat, lon, radius_km)
+    params = {"center_lat": float(lat), "center_lon": float(lon), "radius_km": float(radius_km)}
+    params.update({f"cell_{i}": cell + "%" for i, cell in enumerate(cells)})
+    prefixes = " OR ".join(f"{column} LIKE :cell_{i}" for i in range(len(cells)))
+    return f"({prefixes}) AND {distance_sql(lat_column, lon_column)} <= :radius_km", params
@@ -0,0 +1,88 @@
+import os
+
+import pandas as pd
+from sqlalchemy import text
+
+
+LIVE_RECENT_FRAUDS = 20
+# With sharded writers transaction ids commit out of order; only advance past rows older than this.
+# A transaction still open may hold ids below those of one that started up to its own length before it,
+# so the window is twice the longest writer transaction (WRITER_TRANSACTION_SECONDS, see uploader.py).
+LIVE_SHARDED_UPLOAD = int(os.getenv("UPLOADER_SHARDS", 0)) > 0
+LIVE_SETTLE_SECONDS = float(os.getenv(
+    "LIVE_SETTLE_SECONDS",
+    2 * float(os.getenv("WRITER_TRANSACTION_SECONDS", 5.0)) if LIVE_SHARDED_UPLOAD else 0,
+))
+
+
+def new_live_state():
+    return {
+        "high_water_mark": 0,
+        "last_processed_at": None,
+        "last_delta_rows": 0,
+        "hourly": pd.DataFrame(columns=["count", "amount"],
+                               index=pd.MultiIndex.from_tuples([], names=["hour", "is_fraud"])),
+        "recent_frauds": pd.DataFrame(),
+    }
+
+
+def merge_live_delta(state, delta, new_frauds, new_mark, processed_at, limit=LIVE_RECENT_FRAUDS):
+    """
+    Returns the state after the rows up to new_mark: the per (hour, is_fraud) counts and amounts of
+    `delta` added to the cached ones, and `new_frauds` (newest first) in front of the recent frauds.
+    """
+    delta = delta.set_index(["hour", "is_fraud"])
+    recent_frauds = pd.concat([new_frauds, state["recent_frauds"]], ignore_index=True).head(limit)
+    return {
+        **state,
+        "high_water_mark": int(new_mark),
+        "last_processed_at": processed_at,
+        "last_delta_rows": int(delta["count"].sum()),
+        "hourly": state["hourly"].add(delta, fill_value=0),
+        "recent_frauds": recent_frauds,
+    }
+
+
+def refresh_live_state(state, engine):
+    """
+    Fetches rollups of rows added since the high-water mark and merges them into the cached aggregates.
+    Relies on transaction_id becoming visible in increasing order, which holds for a single uploader.
+    Concurrent writers, sharded or a backfill.py running next to the uploader, commit ids out of order.
+    The mark then only moves over rows processed (transaction start) at least LIVE_SETTLE_SECONDS ago and
+    stops below the first row that is not. That window must be twice the longest concurrent transaction.
+    """
+    if LIVE_SETTLE_SECONDS:
+        settled = """
+            AND processed_at <= LOCALTIMESTAMP - :settle * INTERVAL '1 second'
+            AND transaction_id < COALESCE((
+                SELECT MIN(transaction_id) FROM processed_transactions
+                WHERE transaction_id > :hwm AND processed_at > LOCALTIMESTAMP - :settle * INTERVAL '1 second'
+            ), 9223372036854775807)
+        """
+    else:
+        settled = ""
+    mark = pd.read_sql(text(f"""
+        SELECT MAX(transaction_id) AS max_id, MAX(processed_at) AS max_processed_at
+        FROM processed_transactions
+        WHERE transaction_id > :hwm {settled}
+    """), engine, params={"hwm": state["high_water_mark"], "settle": LIVE_SETTLE_SECONDS})
+    new_mark = mark["max_id"][0]
+    if pd.isna(new_mark):
+        return {**state, "last_delta_rows": 0}
+
+    # The rows in (hwm, new_mark]
+    params = {"hwm": state["high_water_mark"], "new_mark": int(new_mark)}
+    delta = pd.read_sql(text("""
+        SELECT hour, is_fraud, COUNT(*) AS count, SUM(amt) AS amount
+        FROM processed_transactions
+        WHERE transaction_id > :hwm AND transaction_id <= :new_mark
+        GROUP BY hour, is_fraud
+    """), engine, params=params)
+    new_frauds = pd.read_sql(text("""
+        SELECT transaction_id, transaction_time, merchant, category, amt, city, state
+        FROM transactions_view
+        WHERE transaction_id > :hwm AND transaction_id <= :new_mark AND is_fraud = TRUE
+        ORDER BY transaction_id DESC
+        LIMIT :limit
+    """), engine, params={**params, "limit": LIVE_RECENT_FRAUDS})
+    return merge_live_delta(state, delta, new_frauds, new_mark, mark["max_processed_at"][0])
@@ -1,69 +1,272 @@
+from startup import lazy_import, report_startup
+
 import pika
-import pandas as pd
 from pika.exchange_type import ExchangeType
 import os
 import json
+import time
+import signal
+import cProfile
+import subprocess
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import broker
+
+# pandas (and numpy through geo) are only needed once the first batch arrives, so they are not loaded at start-up
+pd = lazy_import("pandas")
+geo = lazy_import("geo")
 
 
 host = os.getenv("RABBITMQ_HOST")
 
+# Profiling: per-step timings of clean_data and on-demand profiles of whole batches
+PROFILE_STEPS = os.getenv("PROCESSOR_PROFILE", "0") == "1"
+PROFILE_WINDOW = int(os.getenv("PROCESSOR_PROFILE_WINDOW", 1000))
+PROFILE_REPORT_EVERY = int(os.getenv("PROCESSOR_PROFILE_REPORT_EVERY", 100))
+PROFILE_DIR = os.getenv("PROCESSOR_PROFILE_DIR", "../profiles")
+PROFILE_BATCHES = int(os.getenv("PROCESSOR_PROFILE_BATCHES", 0))
+PROFILE_TRIGGER_BATCHES = int(os.getenv("PROCESSOR_PROFILE_TRIGGER_BATCHES", 50))
+PROFILER = os.getenv("PROCESSOR_PROFILER", "cprofile")
+
+# Normalized merchant names by raw name, shared across batches
+MERCHANT_CACHE_SIZE = int(os.getenv("MERCHANT_CACHE_SIZE", 100000))
+merchant_names = {}
+
+# Backpressure: slow down, then stop taking raw_data_process batches while the uploader's queue backs up
+THROTTLE = os.getenv("PROCESSOR_THROTTLE", "1") == "1"
+DOWNSTREAM_QUEUES = os.getenv(
+    "DOWNSTREAM_QUEUES",
+    ",".join(broker.shard_queues("processed")) if broker.UPLOADER_SHARDS else "processed_data_upload"
+).split(",")
+THROTTLE_SLOW_DEPTH = int(os.getenv("THROTTLE_SLOW_DEPTH", 50))
+THROTTLE_PAUSE_DEPTH = int(os.getenv("THROTTLE_PAUSE_DEPTH", 200))
+THROTTLE_RESUME_DEPTH = int(os.getenv("THROTTLE_RESUME_DEPTH", 100))
+THROTTLE_MAX_DELAY = float(os.getenv("THROTTLE_MAX_DELAY", 1.0))
+THROTTLE_POLL_SECONDS = float(os.getenv("THROTTLE_POLL_SECONDS", 2.0))
+LAG_REPORT_EVERY = int(os.getenv("LAG_REPORT_EVERY", 50))
+
+step_timings = defaultdict(lambda: deque(maxlen=PROFILE_WINDOW))
+profile_state = {"batches_left": PROFILE_BATCHES, "profiler": None, "path": None, "batches": 0, "processed": 0}
+throttle_state = {"state": "running", "probe": None, "depths": {}, "batches": 0,
+                  "slowed_seconds": 0.0, "paused_seconds": 0.0, "rejected": 0}
+
+
+@contextmanager
+def timed_step(name):
+    """
+    Records the duration of a clean_data step when step profiling is enabled.
+    """
+    if not PROFILE_STEPS:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        step_timings[name].append(time.perf_counter() - start)
+
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def step_timing_summary():
+    """
+    Returns per-step timing percentiles (in ms) over the recent batch window, slowest total first.
+    """
+    summary = []
+    for name, durations in step_timings.items():
+        values = sorted(durations)
+        summary.append({
+            "step": name,
+            "batches": len(values),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "total_ms": sum(values) * 1000,
+        })
+    return sorted(summary, key=lambda row: row["total_ms"], reverse=True)
+
+
+def report_step_timings():
+    summary = step_timing_summary()
+    total = sum(row["total_ms"] for row in summary) or 1
+    print(f"{'step':<22}{'batches':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'share':>8}")
+    for row in summary:
+        print(f"{row['step']:<22}{row['batches']:>8}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}"
+              f"{row['p99_ms']:>9.2f}{row['total_ms'] / total:>8.1%}")
+
+
+def trigger_batch_profile(batches=PROFILE_TRIGGER_BATCHES):
+    """
+    Requests a profile of the next `batches` batches (also bound to SIGUSR1).
+    """
+    if profile_state["batches_left"] <= 0:
+        profile_state["batches_left"] = batches
+
+
+def begin_batch_profile():
+    """
+    Starts the requested profiler. A profiler that cannot start (e.g. py-spy not installed) cancels the
+    request instead of failing the batch.
+    """
+    if profile_state["batches_left"] <= 0 or profile_state["profiler"] is not None:
+        return
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if PROFILER == "py-spy":
+            path = os.path.join(PROFILE_DIR, f"processor-{stamp}.svg")
+            # Sampling profiler attached to this process; it writes the flamegraph when interrupted
+            profiler = subprocess.Popen(["py-spy", "record", "--pid", str(os.getpid()), "--output", path])
+        else:
+            path = os.path.join(PROFILE_DIR, f"processor-{stamp}.prof")
+            profiler = cProfile.Profile()
+    except OSError as e:
+        print(f"Could not start the {PROFILER} profiler, profile cancelled: {e}")
+        profile_state["batches_left"] = 0
+        return
+    profile_state.update(profiler=profiler, path=path, batches=0)
+    print(f"Profiling the next {profile_state['batches_left']} batches to {path}")
+
+
+def end_batch_profile():
+    profiler = profile_state["profiler"]
+    if profiler is None:
+        return
+    profile_state["batches"] += 1
+    profile_state["batches_left"] -= 1
+    if profile_state["batches_left"] > 0:
+        return
+
+    try:
+        if isinstance(profiler, cProfile.Profile):
+            profiler.dump_stats(profile_state["path"])
+        else:
+            profiler.send_signal(signal.SIGINT)
+            profiler.wait()
+        print(f"Wrote profile of {profile_state['batches']} batches to {profile_state['path']}")
+    except OSError as e:
+        print(f"Could not write the profile to {profile_state['path']}: {e}")
+    profile_state.update(profiler=None, path=None, batches=0)
+
+
+@contextmanager
+def profiled_batch():
+    """
+    Wraps the handling of one batch: enables cProfile while a profile is requested
+    and periodically reports the per-step timings.
+    """
+    begin_batch_profile()
+    profiler = profile_state["profiler"]
+    if isinstance(profiler, cProfile.Profile):
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+        end_batch_profile()
+        profile_state["processed"] += 1
+        if PROFILE_STEPS and profile_state["processed"] % PROFILE_REPORT_EVERY == 0:
+            report_step_timings()
+
+
 def clean_data(data):
     """
     Cleans and transforms the input DataFrame.
     """
-    data = data.drop_duplicates()
+    with timed_step("drop_duplicates"):
+        data = data.drop_duplicates()
 
     # Drop GDPR data not relevant to presenter
-    data = data.drop(columns=['cc_num', 'first', 'last'])
+    with timed_step("drop_pii"):
+        data = data.drop(columns=['cc_num', 'first', 'last'])
 
     # Convert columns to numeric
-    data['amt'] = pd.to_numeric(data['amt'], errors='coerce')
-    data['lat'] = pd.to_numeric(data['lat'], errors='coerce')
-    data['long'] = pd.to_numeric(data['long'], errors='coerce')
+    with timed_step("to_numeric"):
+        data['amt'] = pd.to_numeric(data['amt'], errors='coerce')
+        data['lat'] = pd.to_numeric(data['lat'], errors='coerce')
+        data['long'] = pd.to_numeric(data['long'], errors='coerce')
+
+    # Cardholder-to-merchant distance and the cardholder's grid cell, before merch_lat/merch_long are dropped
+    with timed_step("geo"):
+        data['distance_km'] = geo.haversine_km(
+            data['lat'], data['long'],
+            pd.to_numeric(data['merch_lat'], errors='coerce'), pd.to_numeric(data['merch_long'], errors='coerce')
+        )
+        data['geohash'] = geo.encode_geohash(data['lat'], data['long'])
 
     # Convert dob to age at the moment of transaction
-    data['dob'] = pd.to_datetime(data['dob'], errors='coerce')
+    with timed_step("dob_to_datetime"):
+        data['dob'] = pd.to_datetime(data['dob'], errors='coerce')
 
     # Convert to datetime
-    data['trans_date_trans_time'] = pd.to_datetime(
-        data['trans_date_trans_time'],
-        format="%Y-%m-%d %H:%M:%S",
-        errors='coerce'
-    )
+    with timed_step("time_to_datetime"):
+        data['trans_date_trans_time'] = pd.to_datetime(
+            data['trans_date_trans_time'],
+            format="%Y-%m-%d %H:%M:%S",
+            errors='coerce'
+        )
 
 
-    data['age_at_trans'] = data.apply(
-        lambda row: calculate_age(row['dob'], row['trans_date_trans_time']),
-        axis=1
-    )
+    with timed_step("age"):
+        data['age_at_trans'] = data.apply(
+            lambda row: calculate_age(row['dob'], row['trans_date_trans_time']),
+            axis=1
+        )
 
     #Map job name to category
-    data['job_category'] = map_job_to_category(data['job'])
+    with timed_step("job_category"):
+        data['job_category'] = map_job_to_category(data['job'])
 
     # Map transaction category to readable names
-    data['category'] = map_category_to_readable_name(data['category'])
+    with timed_step("category"):
+        data['category'] = map_category_to_readable_name(data['category'])
 
     # Clean merchant names
-    data['merchant'] = data['merchant'].str.replace('^fraud_', '', regex=True)
+    with timed_step("merchant"):
+        data['merchant'] = normalize_merchants(data['merchant'])
 
-    # Drop irrelevant columns
-    data = data.drop(columns=['Unnamed: 0', 'zip', 'merch_lat', 'merch_long', 'job', 'unix_time', 'city_pop', 'street', 'dob'])
+    # Drop irrelevant columns (job is kept, the uploader stores it as a dictionary key)
+    with timed_step("drop_columns"):
+        data = data.drop(columns=['Unnamed: 0', 'zip', 'merch_lat', 'merch_long', 'unix_time', 'city_pop', 'street', 'dob'])
 
     # Extract time features
-    data['hour'] = data['trans_date_trans_time'].dt.hour
-    data['day_of_week'] = data['trans_date_trans_time'].dt.dayofweek
-    data['month'] = data['trans_date_trans_time'].dt.month
-    data['is_weekend'] = data['day_of_week'].isin([5, 6]).astype(bool)
-    data['year'] = data['trans_date_trans_time'].dt.year
+    with timed_step("time_features"):
+        data['hour'] = data['trans_date_trans_time'].dt.hour
+        data['day_of_week'] = data['trans_date_trans_time'].dt.dayofweek
+        data['month'] = data['trans_date_trans_time'].dt.month
+        data['is_weekend'] = data['day_of_week'].isin([5, 6]).astype(bool)
+        data['year'] = data['trans_date_trans_time'].dt.year
 
 
     #transform isFraud to boolean
-    data['is_fraud'] = data['is_fraud'].astype(bool)
+    with timed_step("is_fraud"):
+        data['is_fraud'] = data['is_fraud'].astype(bool)
     #convert datetime to str before JSON serialization
-    data['trans_date_trans_time'] = data['trans_date_trans_time'].astype(str)
+    with timed_step("time_to_str"):
+        data['trans_date_trans_time'] = data['trans_date_trans_time'].astype(str)
 
     return data
 
+def normalize_merchants(merchants):
+    """
+    Strips the 'fraud_' prefix from merchant names, running the regex only on names not seen before.
+    """
+    names = merchants.dropna().unique()
+    unseen = [name for name in names if name not in merchant_names]
+    if unseen:
+        if len(merchant_names) + len(unseen) > MERCHANT_CACHE_SIZE:
+            # Start over, but keep every name of this batch: the cached ones are dropped too
+            merchant_names.clear()
+            unseen = list(names)
+        cleaned = pd.Series(unseen, dtype=object).str.replace('^fraud_', '', regex=True)
+        merchant_names.update(zip(unseen, cleaned))
+    return merchants.map(merchant_names)
+
 def calculate_age(born, ref_date):
     """
     Calculates age at the time of transaction.
@@ -129,30 +332,101 @@ def map_category_to_readable_name(category_series):
 
 
 
+def next_throttle_state(state, depth):
+    """
+    Returns "running", "slowed" or "paused" for the downstream queue depth (in messages).
+    Once paused, consuming only resumes below THROTTLE_RESUME_DEPTH so it does not flap at the threshold.
+    """
+    if depth >= THROTTLE_PAUSE_DEPTH or (state == "paused" and depth > THROTTLE_RESUME_DEPTH):
+        return "paused"
+    if depth >= THROTTLE_SLOW_DEPTH:
+        return "slowed"
+    return "running"
+
+
+def throttle_delay(depth):
+    """
+    Delay before the next batch while slowed, growing linearly to THROTTLE_MAX_DELAY at the pause depth.
+    """
+    span = max(1, THROTTLE_PAUSE_DEPTH - THROTTLE_SLOW_DEPTH)
+    return THROTTLE_MAX_DELAY * min(1.0, max(0, depth - THROTTLE_SLOW_DEPTH + 1) / span)
+
+
+def downstream_depth(connection):
+    """
+    Refreshes the lag of the input and downstream queues and returns the deepest downstream one.
+    """
+    probe = throttle_state["probe"] or connection.channel()
+    depths, throttle_state["probe"] = broker.queue_depths(connection, probe, ["raw_data_process", *DOWNSTREAM_QUEUES])
+    throttle_state["depths"] = depths
+    return max(depths[queue] for queue in DOWNSTREAM_QUEUES)
+
+
+def set_throttle_state(state, depth):
+    if state != throttle_state["state"]:
+        print(f"Throttle {throttle_state['state']} -> {state} (downstream depth {depth} messages)")
+        throttle_state["state"] = state
+
+
+def apply_backpressure(connection):
+    """
+    Called before each batch: waits a little while the downstream queues back up, and holds the current
+    delivery while they are full. With prefetch 1 that stops consumption of raw_data_process, so the
+    backlog stays in the input queue instead of growing past the uploader.
+    """
+    depth = downstream_depth(connection)
+    set_throttle_state(next_throttle_state(throttle_state["state"], depth), depth)
+    while throttle_state["state"] == "paused":
+        connection.sleep(THROTTLE_POLL_SECONDS)
+        throttle_state["paused_seconds"] += THROTTLE_POLL_SECONDS
+        depth = downstream_depth(connection)
+        set_throttle_state(next_throttle_state("paused", depth), depth)
+
+    if throttle_state["state"] == "slowed":
+        delay = throttle_delay(depth)
+        throttle_state["slowed_seconds"] += delay
+        connection.sleep(delay)
+
+
+def report_lag():
+    depths = ", ".join(f"{queue}={depth}" for queue, depth in throttle_state["depths"].items())
+    print(f"Lag (ready messages): {depths}; throttle {throttle_state['state']}, "
+          f"slowed {throttle_state['slowed_seconds']:.1f} s, paused {throttle_state['paused_seconds']:.1f} s, "
+          f"rejected publishes {throttle_state['rejected']}")
+
+
 def callback(ch, method, properties, body):
     """
     Callback for processing incoming messages.
     """
     try:
+        if THROTTLE:
+            apply_backpressure(ch.connection)
+
         records = json.loads(body)
         batch = pd.DataFrame(records)
         print(f"Received a batch of size {len(batch)}")
 
 
-        cleaned_batch = clean_data(batch)
+        with profiled_batch():
+            cleaned_batch = clean_data(batch)
 
-        cleaned_json = json.dumps(cleaned_batch.to_dict(orient="records"))
-        ch.basic_publish(
-            exchange="fraud_exchange",
-            routing_key="clean_data",
-            body=cleaned_json,
-            properties=pika.BasicProperties(
-                content_type="application/json",
-                delivery_mode=2
+        cleaned_records = cleaned_batch.to_dict(orient="records")
+        # Waits (without acking the raw batch) while a bounded downstream queue rejects it
+        if broker.UPLOADER_SHARDS:
+            throttle_state["rejected"] += broker.publish_shards(
+                ch, "processed", cleaned_records, broker.PROCESSED_SHARD_KEY, retry_delay=THROTTLE_POLL_SECONDS
+            )
+        else:
+            throttle_state["rejected"] += broker.publish(
+                ch, "clean_data", json.dumps(cleaned_records), retry_delay=THROTTLE_POLL_SECONDS
             )
-        )
         print("Processed and forwarded a batch to Uploader.")
         ch.basic_ack(delivery_tag=method.delivery_tag)
+
+        throttle_state["batches"] += 1
+        if THROTTLE and throttle_state["batches"] % LAG_REPORT_EVERY == 0:
+            report_lag()
     except Exception as e:
         print(f"Error processing batch: {e}")
         ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
@@ -164,7 +438,12 @@ def start_processing():
         Starts the message processing loop.
         """
         print("Start Processor ...")
-        channel.queue_declare(queue="raw_data_process", durable=True)
+        signal.signal(signal.SIGUSR1, lambda signum, frame: trigger_batch_profile())
+        connection.add_on_connection_blocked_callback(
+            lambda conn, frame: print(f"Broker blocked publishing: {frame.method.reason}")
+        )
+        connection.add_on_connection_unblocked_callback(lambda conn, frame: print("Broker unblocked publishing"))
+        broker.declare_queue(channel, "raw_data_process")
         channel.exchange_declare(
             exchange="fraud_exchange",
             exchange_type=ExchangeType.direct
@@ -174,9 +453,14 @@ def start_processing():
             exchange="fraud_exchange",
             routing_key="raw_data"
         )
+        if broker.UPLOADER_SHARDS:
+            broker.declare_shard_exchange(channel, "processed")
+        # Confirms turn a publish refused by a full reject-publish queue into a nack we can retry
+        channel.confirm_delivery()
         channel.basic_qos(prefetch_count=1)
         channel.basic_consume(queue="raw_data_process", on_message_callback=callback)
         print("Waiting for raw data batches.")
+        report_startup("Processor")
 
         channel.start_consuming()
     
@@ -1,60 +1,129 @@
+from startup import report_startup
+
 import pika
 import pandas as pd
 from pika.exchange_type import ExchangeType
 import os
 import json
+import time
+
+import broker
 
 
 batch_size = 1000
 file_path = "../data/fraudTrain.csv"
 #file_path = "../data/test.csv"
 
-
-try:
-    data = pd.read_csv(file_path)
-except FileNotFoundError:
-    print(f"File not found: {file_path}")
-    exit(1)
-
-total_length = len(data)
-
-if total_length == 0:
-    print("No data to process.")
-    exit(0)
-
-
 host = os.getenv("RABBITMQ_HOST")
 
-
-with pika.BlockingConnection(pika.ConnectionParameters(host)) as connection, connection.channel() as channel:
-    channel.exchange_declare(
-        exchange="fraud_exchange", 
-        exchange_type=ExchangeType.direct
-        )
-    
-    for i in range(0, total_length, batch_size):
-        batch = data[i:i + batch_size]
-
-        batch_json = json.dumps(batch.to_dict(orient="records"))
-        
-        channel.basic_publish(
+# Adaptive batching: size batches and pace publishing by the downstream backlog
+ADAPTIVE_BATCHING = os.getenv("ADAPTIVE_BATCHING", "0") == "1"
+MIN_BATCH_SIZE = int(os.getenv("MIN_BATCH_SIZE", 250))
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 10000))
+TARGET_BACKLOG_ROWS = int(os.getenv("TARGET_BACKLOG_ROWS", 20000))
+MAX_BACKLOG_ROWS = int(os.getenv("MAX_BACKLOG_ROWS", 100000))
+MAX_PUBLISH_LATENCY = float(os.getenv("MAX_PUBLISH_LATENCY", 0.5))
+MAX_PUBLISH_DELAY = float(os.getenv("MAX_PUBLISH_DELAY", 2.0))
+# Queues bound to the raw_data routing key: raw_data_store in the fused topology, and only raw_data_process
+# with sharded writers, whose raw rows go through their shard queues instead of raw_data_upload
+RAW_DATA_QUEUES = os.getenv(
+    "RAW_DATA_QUEUES",
+    "raw_data_process" if broker.UPLOADER_SHARDS else "raw_data_process,raw_data_upload"
+).split(",")
+MONITORED_QUEUES = os.getenv(
+    "MONITORED_QUEUES",
+    ",".join([*RAW_DATA_QUEUES, *broker.shard_queues("raw")])
+).split(",")
+
+
+def next_batch_settings(size, delay, depth, latency):
+    """
+    Returns the next (batch size, publish delay) from the queue depth and the last publish latency.
+    Grows batches while consumers keep up and halves them (slowing down) once they fall behind.
+    """
+    backlog = depth * size
+    if backlog > TARGET_BACKLOG_ROWS * 2 or latency > MAX_PUBLISH_LATENCY:
+        size = max(MIN_BATCH_SIZE, size // 2)
+        delay = min(MAX_PUBLISH_DELAY, max(delay * 2, 0.05))
+    elif backlog > TARGET_BACKLOG_ROWS:
+        delay = min(MAX_PUBLISH_DELAY, max(delay * 1.5, 0.01))
+    else:
+        size = min(MAX_BATCH_SIZE, size + max(MIN_BATCH_SIZE, size // 4))
+        delay = delay / 2 if delay > 0.005 else 0.0
+    return size, delay
+
+
+def publish_batch(channel, batch):
+    """
+    Publishes a batch to the raw_data routing key and returns the publish latency in seconds,
+    including any retries while a bounded queue was full. With sharded writers the batch is also
+    split by RAW_SHARD_KEY onto the raw shard exchange.
+    """
+    records = batch.to_dict(orient="records")
+
+    start = time.perf_counter()
+    broker.publish_fanout(channel, "raw_data", RAW_DATA_QUEUES, json.dumps(records), retry_delay=MAX_PUBLISH_DELAY)
+    if broker.UPLOADER_SHARDS:
+        broker.publish_shards(channel, "raw", records, broker.RAW_SHARD_KEY, retry_delay=MAX_PUBLISH_DELAY)
+    return time.perf_counter() - start
+
+
+def start_producer():
+    try:
+        data = pd.read_csv(file_path)
+    except FileNotFoundError:
+        print(f"File not found: {file_path}")
+        return
+
+    total_length = len(data)
+
+    if total_length == 0:
+        print("No data to process.")
+        return
+
+    with pika.BlockingConnection(pika.ConnectionParameters(host)) as connection, connection.channel() as channel:
+        channel.exchange_declare(
             exchange="fraud_exchange",
-            routing_key="raw_data",
-            body=batch_json,
-            properties=pika.BasicProperties(
-                content_type="application/json",
-                delivery_mode=2  
+            exchange_type=ExchangeType.direct
             )
-        )
-
-        print(f"Sent batch {i // batch_size + 1} of size {len(batch)}")
-    
-    print("All data sent successfully.")
-
-    
-    
-
-    
-
-
-
+        if broker.UPLOADER_SHARDS:
+            broker.declare_shard_exchange(channel, "raw")
+        report_startup("Producer")
+
+        if ADAPTIVE_BATCHING or broker.is_bounded([*RAW_DATA_QUEUES, *MONITORED_QUEUES]):
+            # Publisher confirms make the publish latency reflect broker back-pressure,
+            # and report messages a full reject-publish queue refused
+            channel.confirm_delivery()
+        if ADAPTIVE_BATCHING:
+            probe = connection.channel()
+
+        size, delay = batch_size, 0.0
+        i, batch_number = 0, 0
+        while i < total_length:
+            batch = data[i:i + size]
+            latency = publish_batch(channel, batch)
+            i += len(batch)
+            batch_number += 1
+
+            print(f"Sent batch {batch_number} of size {len(batch)}")
+
+            if not ADAPTIVE_BATCHING:
+                continue
+
+            depth, probe = broker.queue_depth(connection, probe, MONITORED_QUEUES)
+            while depth * size > MAX_BACKLOG_ROWS:
+                print(f"Backlog of {depth} messages, pausing publishing")
+                connection.sleep(MAX_PUBLISH_DELAY)
+                depth, probe = broker.queue_depth(connection, probe, MONITORED_QUEUES)
+
+            size, delay = next_batch_settings(size, delay, depth, latency)
+            print(f"Queue depth {depth}, publish latency {latency * 1000:.1f} ms, "
+                  f"next batch size {size}, delay {delay:.2f} s")
+            if delay:
+                connection.sleep(delay)
+
+        print("All data sent successfully.")
+
+
+if __name__ == "__main__":
+    start_producer()
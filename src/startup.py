@@ -0,0 +1,53 @@
+import importlib.util
+import os
+import sys
+import time
+
+
+# Set when the first entry-point module imports this one, before its heavier imports
+STARTED_AT = time.perf_counter()
+STARTUP_REPORT = os.getenv("STARTUP_REPORT", "1") == "1"
+
+# Modules that dominate import time; reported so it is visible which ones a process actually loaded
+HEAVY_MODULES = ("pandas", "pyarrow", "duckdb", "sqlalchemy", "plotly.express", "pydeck", "st_aggrid")
+
+
+def lazy_import(name):
+    """
+    Returns the module `name` without executing it; the real import runs on first attribute access.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def is_loaded(name):
+    """
+    True if the module has been imported and, for lazy modules, actually executed.
+    """
+    module = sys.modules.get(name)
+    return module is not None and not isinstance(module, importlib.util._LazyModule)
+
+
+def loaded_heavy_modules():
+    return [name for name in HEAVY_MODULES if is_loaded(name)]
+
+
+def report_startup(name, since=None):
+    """
+    Prints the time from `since` (default: process start-up) until the entry point is ready,
+    and which heavy modules were loaded by then. Returns the elapsed seconds.
+    """
+    elapsed = time.perf_counter() - (STARTED_AT if since is None else since)
+    if STARTUP_REPORT:
+        modules = ', '.join(loaded_heavy_modules()) or 'none'
+        print(f"{name} ready in {elapsed * 1000:.0f} ms (heavy modules loaded: {modules})")
+    return elapsed
@@ -1,9 +1,23 @@
+from startup import lazy_import, report_startup
 
 import pika
 import json
 import os
 import psycopg2
 import datetime
+import csv
+import io
+import time
+import argparse
+import multiprocessing
+
+import analytics_store
+import broker
+import dimensions
+from processor import clean_data
+
+# Only the fused topology builds DataFrames here
+pd = lazy_import("pandas")
 
 
 RABBITMQ_HOST = os.getenv('RABBITMQ_HOST')
@@ -15,6 +29,41 @@ POSTGRES_PWD=os.getenv('POSTGRES_PASS')
 POSTGRES_HOST=os.getenv('POSTGRES_HOST')
 POSTGRES_PORT=os.getenv('POSTGRES_PORT')
 
+# "split": store raw_data and clean_data messages separately (processor runs as its own service)
+# "fused": clean raw batches here and store both tables in one transaction, skipping the processor
+PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'split')
+
+# Also append processed batches to the DuckDB analytics store read by the dashboard
+ANALYTICS_STORE = os.getenv('ANALYTICS_STORE', '0') == '1'
+# While the dashboard reads the store it holds the file lock; batches that cannot be appended are kept and
+# retried with the next ones, backing off from ANALYTICS_RETRY_SECONDS up to ANALYTICS_MAX_RETRY_SECONDS
+ANALYTICS_RETRY_SECONDS = float(os.getenv('ANALYTICS_RETRY_SECONDS', 1.0))
+ANALYTICS_MAX_RETRY_SECONDS = float(os.getenv('ANALYTICS_MAX_RETRY_SECONDS', 60.0))
+ANALYTICS_MAX_PENDING_ROWS = int(os.getenv('ANALYTICS_MAX_PENDING_ROWS', 500000))
+
+# Sharded upload: UPLOADER_SHARDS writer processes, each consuming its own raw_shard_<i> and processed_shard_<i>
+# queues and bulk-loading them independently (see broker.UPLOADER_SHARDS)
+WRITER_PREFETCH = int(os.getenv('WRITER_PREFETCH', 50))
+WRITER_FLUSH_ROWS = int(os.getenv('WRITER_FLUSH_ROWS', 5000))
+WRITER_FLUSH_SECONDS = float(os.getenv('WRITER_FLUSH_SECONDS', 1.0))
+WRITER_REPORT_SECONDS = float(os.getenv('WRITER_REPORT_SECONDS', 10.0))
+# Expected upper bound of a flush transaction; the dashboard's live monitor waits twice this long
+# (LIVE_SETTLE_SECONDS) before counting rows, since sharded writers commit ids out of order
+WRITER_TRANSACTION_SECONDS = float(os.getenv('WRITER_TRANSACTION_SECONDS', 5.0))
+
+
+RAW_COLUMNS = (
+    'cc_num', 'first', 'last', 'transaction_time', 'category', 'amount', 'merchant', 'merchant_latitude',
+    'merchant_longitude', 'job', 'zip', 'gender', 'city', 'city_pop', 'state', 'latitude', 'longitude',
+    'unix_time', 'is_fraud', 'created_at',
+)
+
+PROCESSED_COLUMNS = (
+    'merchant_id', 'transaction_time', 'category', 'job_category', 'job_id', 'amt',
+    'gender', 'city_id', 'state', 'is_fraud', 'hour', 'age_at_transaction',
+    'day_of_week', 'month', 'is_weekend', 'year', 'lat', 'long', 'distance_km', 'geohash',
+)
+
 
 def connect_to_rabbitmq():
     parameters = pika.ConnectionParameters(host=RABBITMQ_HOST, port=RABBITMQ_PORT)
@@ -37,9 +86,17 @@ def connect_to_postgres():
 
 
 
-def insert_raw_data(conn, data):
+def to_int(value):
     """
-    Inserts raw transaction data into the raw_data table.
+    Integer column value: pandas turns integer columns holding a missing value into floats, and COPY
+    rejects "30.0" for an INT column. Missing values become None (NULL).
+    """
+    return None if dimensions.is_missing(value) else int(value)
+
+
+def raw_values(data):
+    """
+    Builds raw_data insert rows from raw transaction records.
     """
     values = []
     for record in data:
@@ -61,34 +118,38 @@ def insert_raw_data(conn, data):
                 record.get('zip'),
                 record.get('gender'),
                 record.get('city'),
-                record.get('city_pop'),
+                to_int(record.get('city_pop')),
                 record.get('state'),
                 record.get('lat'),
                 record.get('long'),
-                record.get('unix_time'),
-                record.get('is_fraud'),
+                to_int(record.get('unix_time')),
+                to_int(record.get('is_fraud')),
                 datetime.datetime.now()
             ))
         except Exception as e:
             print(f"Error processing record {record}: {e}")
             continue
+    return values
 
+
+def insert_raw_data(conn, data, commit=True):
+    """
+    Inserts raw transaction data into the raw_data table.
+    """
+    values = raw_values(data)
     if not values:
         print("No valid records to insert into raw_data.")
         return
 
-    sql = '''
-        INSERT INTO raw_data (
-            cc_num, first, last, transaction_time, 
-            category, amount, merchant, merchant_latitude, 
-            merchant_longitude, job, zip, gender, city, city_pop,
-            state, latitude, longitude, unix_time, is_fraud, created_at
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    '''
+    sql = f"""
+        INSERT INTO raw_data ({', '.join(RAW_COLUMNS)})
+        VALUES ({', '.join(['%s'] * len(RAW_COLUMNS))})
+    """
     try:
         with conn.cursor() as cursor:
             cursor.executemany(sql, values)
-        conn.commit()
+        if commit:
+            conn.commit()
     except Exception as e:
         conn.rollback()
         print(f"Error inserting raw data: {e}")
@@ -98,9 +159,9 @@ def insert_raw_data(conn, data):
         raise
 
 
-def insert_processed_data(conn, data):
+def processed_values(data):
     """
-    Inserts processed transaction data into the processed_transactions table.
+    Builds processed_transactions insert rows from cleaned records with interned dimension keys.
     """
     values = []
     for record in data:
@@ -109,45 +170,63 @@ def insert_processed_data(conn, data):
             transaction_time = datetime.datetime.fromisoformat(transaction_time) if transaction_time else None
 
             values.append((
-                record.get('merchant'),
+                record.get('merchant_id'),
                 transaction_time,
                 record.get('category'),
                 record.get('job_category'),
+                record.get('job_id'),
                 record.get('amt'),
                 record.get('gender'),
-                record.get('city'),
+                record.get('city_id'),
                 record.get('state'),
                 bool(record.get('is_fraud')),
-                record.get('hour'),
-                record.get('age_at_trans'),
-                record.get('day_of_week'),
-                record.get('month'),
+                to_int(record.get('hour')),
+                to_int(record.get('age_at_trans')),
+                to_int(record.get('day_of_week')),
+                to_int(record.get('month')),
                 bool(record.get('is_weekend')),
-                record.get('year'),
+                to_int(record.get('year')),
                 record.get('lat'),
-                record.get('long')
+                record.get('long'),
+                None if dimensions.is_missing(record.get('distance_km')) else record.get('distance_km'),
+                None if dimensions.is_missing(record.get('geohash')) else record.get('geohash')
             ))
         except Exception as e:
             print(f"Error processing record {record}: {e}")
             continue
+    return values
+
+
+def insert_processed_data(conn, data, commit=True):
+    """
+    Inserts processed transaction data into the processed_transactions table,
+    interning merchant, city and job into their dimension tables first.
+    """
+    try:
+        dimensions.intern_records(conn, data)
+    except Exception as e:
+        conn.rollback()
+        dimensions.reset_dimension_cache()
+        print(f"Error interning dimension values: {e}")
+        raise
 
+    values = processed_values(data)
     if not values:
         print("No valid records to insert into processed_transactions.")
         return
 
-    sql = """
-        INSERT INTO processed_transactions (
-            merchant, transaction_time, category, job_category, amt,
-            gender, city, state, is_fraud, hour, age_at_transaction,
-            day_of_week, month, is_weekend, year, lat, long
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    sql = f"""
+        INSERT INTO processed_transactions ({', '.join(PROCESSED_COLUMNS)})
+        VALUES ({', '.join(['%s'] * len(PROCESSED_COLUMNS))})
     """
     try:
         with conn.cursor() as cursor:
             cursor.executemany(sql, values)
-        conn.commit()
+        if commit:
+            conn.commit()
     except Exception as e:
         conn.rollback()
+        dimensions.reset_dimension_cache()
         print(f"Error inserting processed data: {e}")
         print("Values attempted for insertion:")
         for v in values:
@@ -155,6 +234,63 @@ def insert_processed_data(conn, data):
         raise
 
 
+def bulk_copy(conn, table, columns, values):
+    """
+    Loads rows with COPY ... FROM STDIN, much faster than row-by-row inserts for large batches.
+    Missing values (None or NaN) are written as NULL. Does not commit.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in values:
+        writer.writerow(['\\N' if value is None or value != value else value for value in row])
+    buffer.seek(0)
+
+    with conn.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+    return len(values)
+
+
+def new_analytics_backlog():
+    return {'records': [], 'retry_at': 0.0, 'delay': 0.0}
+
+
+analytics_backlog = new_analytics_backlog()
+
+
+def mirror_to_analytics_store(data, now=None):
+    """
+    Appends processed records to the DuckDB analytics store when it is enabled.
+    Records the store cannot take yet are kept and appended with a later batch, retrying with exponential
+    backoff. Beyond ANALYTICS_MAX_PENDING_ROWS the oldest are dropped and the store must be rebuilt.
+    Returns the number of records appended.
+    """
+    if not ANALYTICS_STORE:
+        return 0
+    backlog = analytics_backlog
+    backlog['records'].extend(data)
+    now = time.monotonic() if now is None else now
+    if now < backlog['retry_at']:
+        return 0
+    try:
+        appended = analytics_store.append_batch(backlog['records'])
+    except Exception as e:
+        backlog['delay'] = min(max(2 * backlog['delay'], ANALYTICS_RETRY_SECONDS), ANALYTICS_MAX_RETRY_SECONDS)
+        backlog['retry_at'] = now + backlog['delay']
+        dropped = len(backlog['records']) - ANALYTICS_MAX_PENDING_ROWS
+        if dropped > 0:
+            del backlog['records'][:dropped]
+            print(f"Dropped {dropped} records the analytics store could not take; rebuild it with analytics_store.py")
+        print(f"Error appending to analytics store, retrying {len(backlog['records'])} records "
+              f"in {backlog['delay']:.0f} s: {e}")
+        return 0
+    backlog['records'], backlog['retry_at'], backlog['delay'] = [], 0.0, 0.0
+    print(f"Appended {appended} records to the analytics store")
+    return appended
+
+
 def process_raw_data(channel, method, properties, body, db_conn):
     """
     Callback for processing raw data messages from RabbitMQ.
@@ -183,6 +319,7 @@ def process_processed_data(channel, method, properties, body, db_conn):
 
         insert_processed_data(db_conn, data)
         print(f"Inserted {len(data)} records into processed_transactions table")
+        mirror_to_analytics_store(data)
 
         # Acknowledge the message
         channel.basic_ack(delivery_tag=method.delivery_tag)
@@ -191,6 +328,62 @@ def process_processed_data(channel, method, properties, body, db_conn):
         # Nack and requeue on error
         channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
 
+def process_and_store(channel, method, properties, body, db_conn):
+    """
+    Callback for the fused topology: decodes a raw batch once, cleans it and stores
+    the raw and cleaned rows in the same transaction.
+    """
+    try:
+        data = json.loads(body)
+        print(f"Received {len(data)} records of raw data")
+
+        cleaned = clean_data(pd.DataFrame(data)).to_dict(orient="records")
+
+        insert_raw_data(db_conn, data, commit=False)
+        insert_processed_data(db_conn, cleaned, commit=False)
+        db_conn.commit()
+        print(f"Inserted {len(data)} raw and {len(cleaned)} processed records")
+        mirror_to_analytics_store(cleaned)
+
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+    except Exception as e:
+        db_conn.rollback()
+        dimensions.reset_dimension_cache()
+        print(f"Error processing and storing raw data message: {e}")
+        channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+
+def start_fused_uploader():
+    with pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST)) as connection, connection.channel() as channel:
+
+        print("Start Uploader (fused process-and-store) ...")
+
+        channel.exchange_declare(exchange='fraud_exchange', exchange_type='direct')
+
+        db_conn = connect_to_postgres()
+        print(f"Loaded {dimensions.load_dimension_cache(db_conn)} dimension values")
+        db_conn.commit()
+
+        broker.declare_queue(channel, 'raw_data_store')
+        channel.queue_bind(
+            queue='raw_data_store',
+            exchange='fraud_exchange',
+            routing_key='raw_data'
+        )
+        channel.basic_qos(prefetch_count=1)
+        channel.basic_consume(
+            queue='raw_data_store',
+            on_message_callback=lambda ch, method, properties,
+            body: process_and_store(ch, method, properties, body, db_conn)
+        )
+
+        report_startup("Uploader")
+        try:
+            channel.start_consuming()
+        finally:
+            db_conn.close()
+
+    print("Uploader stopped.")
 
 
 def start_uploader():
@@ -201,9 +394,11 @@ def start_uploader():
         channel.exchange_declare(exchange='fraud_exchange', exchange_type='direct')
         
         db_conn = connect_to_postgres()
+        print(f"Loaded {dimensions.load_dimension_cache(db_conn)} dimension values")
+        db_conn.commit()
 
         # Upload raw data
-        channel.queue_declare(queue='raw_data_upload', durable=True)
+        broker.declare_queue(channel, 'raw_data_upload')
         channel.queue_bind(
             queue='raw_data_upload', 
             exchange='fraud_exchange', 
@@ -217,7 +412,7 @@ def start_uploader():
         )
 
         # Upload processed data
-        channel.queue_declare(queue='processed_data_upload', durable=True)
+        broker.declare_queue(channel, 'processed_data_upload')
         channel.queue_bind(
             queue='processed_data_upload', 
             exchange='fraud_exchange', 
@@ -230,6 +425,7 @@ def start_uploader():
             body: process_processed_data(ch, method, properties, body, db_conn)
         )
 
+        report_startup("Uploader")
         try:
             channel.start_consuming()
         finally:
@@ -238,7 +434,185 @@ def start_uploader():
     print("Uploader stopped.")
 
 
+def load_shard_rows(conn, kind, data):
+    """
+    Bulk-loads a shard buffer into its table inside the caller's transaction. Returns the number of rows.
+    """
+    if kind == 'raw':
+        return bulk_copy(conn, 'raw_data', RAW_COLUMNS, raw_values(data))
+    dimensions.intern_records(conn, data)
+    return bulk_copy(conn, 'processed_transactions', PROCESSED_COLUMNS, processed_values(data))
+
+
+def new_shard_buffer(channel):
+    # messages: (delivery tag, records) in delivery order
+    return {'channel': channel, 'messages': [], 'rows': 0, 'loaded': 0, 'reported': 0}
+
+
+def flush_shard_buffer(db_conn, kind, buffer):
+    """
+    Loads all buffered messages of one shard queue in a single transaction, then acks them at once.
+    If that fails they are loaded one by one, so a bad message cannot stall the shard. Returns the rows loaded.
+    """
+    messages = buffer['messages']
+    if not messages:
+        return 0
+    try:
+        started = time.perf_counter()
+        loaded = load_shard_rows(db_conn, kind, [record for _, records in messages for record in records])
+        db_conn.commit()
+        elapsed = time.perf_counter() - started
+        if elapsed > WRITER_TRANSACTION_SECONDS:
+            print(f"Flushing {loaded} {kind} rows took {elapsed:.1f} s, over WRITER_TRANSACTION_SECONDS; "
+                  "the live monitor may miss rows unless LIVE_SETTLE_SECONDS is at least twice this long")
+        buffer['channel'].basic_ack(delivery_tag=messages[-1][0], multiple=True)
+    except Exception as e:
+        db_conn.rollback()
+        dimensions.reset_dimension_cache()
+        print(f"Error loading {len(messages)} {kind} shard messages, loading them one by one: {e}")
+        loaded = load_shard_messages(db_conn, kind, buffer['channel'], messages)
+    buffer['messages'], buffer['rows'] = [], 0
+    buffer['loaded'] += loaded
+    return loaded
+
+
+def load_shard_messages(db_conn, kind, channel, messages):
+    """
+    Loads and acks messages one transaction each. A message the database rejects for its data is rejected
+    without requeueing: dead-lettered if the queue has a dead-letter policy, dropped otherwise.
+    Any other error (e.g. a lost connection) requeues the remaining messages. Returns the rows loaded.
+    """
+    loaded = 0
+    for i, (tag, records) in enumerate(messages):
+        try:
+            loaded += load_shard_rows(db_conn, kind, records)
+            db_conn.commit()
+            channel.basic_ack(delivery_tag=tag)
+        except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+            db_conn.rollback()
+            dimensions.reset_dimension_cache()
+            print(f"Rejecting a {kind} shard message of {len(records)} records: {e}")
+            channel.basic_nack(delivery_tag=tag, requeue=False)
+        except Exception as e:
+            db_conn.rollback()
+            dimensions.reset_dimension_cache()
+            print(f"Error loading {kind} shard messages, requeueing {len(messages) - i}: {e}")
+            channel.basic_nack(delivery_tag=messages[-1][0], multiple=True, requeue=True)
+            break
+    return loaded
+
+
+def buffer_shard_message(db_conn, kind, buffer, method, body):
+    """
+    Callback of a writer: buffers a shard message and flushes once enough rows are buffered, or once
+    every prefetched message is buffered, since the broker will not deliver more before an ack.
+    """
+    try:
+        records = json.loads(body)
+    except ValueError as e:
+        print(f"Rejecting an undecodable {kind} shard message: {e}")
+        buffer['channel'].basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        return
+    buffer['messages'].append((method.delivery_tag, records))
+    buffer['rows'] += len(records)
+    if buffer['rows'] >= WRITER_FLUSH_ROWS or len(buffer['messages']) >= WRITER_PREFETCH:
+        flush_shard_buffer(db_conn, kind, buffer)
+
+
+def report_writer(shard, buffers, elapsed):
+    """
+    Prints the rows each table received from this writer since the last report, and its rows/s.
+    """
+    rates = []
+    for kind, buffer in buffers.items():
+        rows = buffer['loaded'] - buffer['reported']
+        buffer['reported'] = buffer['loaded']
+        rates.append(f"{kind} {rows} rows ({rows / elapsed:,.0f} rows/s, {buffer['loaded']} total)")
+    print(f"Writer {shard}: {', '.join(rates)}")
+
+
+def start_shard_writer(shard):
+    """
+    Runs one writer: consumes raw_shard_<shard> and processed_shard_<shard> on separate channels of one
+    connection and bulk-loads each into its table with its own Postgres connection.
+    """
+    with pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST)) as connection:
+        db_conn = connect_to_postgres()
+        print(f"Writer {shard}: loaded {dimensions.load_dimension_cache(db_conn)} dimension values")
+        db_conn.commit()
+
+        buffers = {}
+        for kind in broker.SHARD_EXCHANGES:
+            channel = connection.channel()
+            queue = broker.declare_shard_queue(channel, kind, shard)
+            channel.basic_qos(prefetch_count=WRITER_PREFETCH)
+            buffers[kind] = new_shard_buffer(channel)
+            channel.basic_consume(
+                queue=queue,
+                on_message_callback=lambda ch, method, properties, body, kind=kind:
+                buffer_shard_message(db_conn, kind, buffers[kind], method, body)
+            )
+
+        last_report = [time.monotonic()]
+
+        def flush_and_report():
+            # Flushes partly filled buffers when traffic is light
+            for kind, buffer in buffers.items():
+                flush_shard_buffer(db_conn, kind, buffer)
+            now = time.monotonic()
+            if now - last_report[0] >= WRITER_REPORT_SECONDS:
+                report_writer(shard, buffers, now - last_report[0])
+                last_report[0] = now
+            connection.call_later(WRITER_FLUSH_SECONDS, flush_and_report)
+
+        connection.call_later(WRITER_FLUSH_SECONDS, flush_and_report)
+
+        report_startup(f"Writer {shard}")
+        try:
+            # Serves the consumers of both channels, they share the connection
+            buffers['raw']['channel'].start_consuming()
+        finally:
+            db_conn.close()
+
+
+def start_sharded_uploader(shards):
+    """
+    Starts one writer process per shard and waits for them. Rows of a key (state, or card with
+    RAW_SHARD_KEY=cc_num) always go to the same writer, so the writers never touch the same keys.
+    """
+    print(f"Start Uploader ({shards} sharded writers) ...")
+    if ANALYTICS_STORE:
+        # A DuckDB file has a single writer; rebuild it from Postgres with analytics_store.py instead
+        print("ANALYTICS_STORE is not mirrored by sharded writers")
+
+    writers = [
+        multiprocessing.Process(target=start_shard_writer, args=(shard,), name=f"writer-{shard}")
+        for shard in range(shards)
+    ]
+    for writer in writers:
+        writer.start()
+    try:
+        for writer in writers:
+            writer.join()
+    except KeyboardInterrupt:
+        for writer in writers:
+            writer.terminate()
+            writer.join()
+
+    print("Uploader stopped.")
+
+
 if __name__ == "__main__":
-    start_uploader()
+    parser = argparse.ArgumentParser(description="Stores raw and processed transactions in Postgres.")
+    parser.add_argument("--shards", type=int, default=broker.UPLOADER_SHARDS,
+                        help="number of sharded writer processes (default UPLOADER_SHARDS, 0 = single uploader)")
+    args = parser.parse_args()
+
+    if PIPELINE_MODE == 'fused':
+        start_fused_uploader()
+    elif args.shards > 0:
+        start_sharded_uploader(args.shards)
+    else:
+        start_uploader()
         
 
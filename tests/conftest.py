@@ -0,0 +1,202 @@
+import json
+import os
+import sys
+
+import pytest
+from psycopg2.extensions import QuotedString, adapt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--update-golden", action="store_true",
+        help="rewrite the golden outputs and throughput baseline from the current code",
+    )
+
+
+@pytest.fixture
+def update_golden(request):
+    return request.config.getoption("--update-golden")
+
+
+def load_golden(name):
+    with open(os.path.join(GOLDEN_DIR, name)) as f:
+        return json.load(f)
+
+
+def save_golden(name, data):
+    with open(os.path.join(GOLDEN_DIR, name), "w") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+
+
+@pytest.fixture
+def raw_records():
+    return load_golden("raw_batch.json")
+
+
+class RecordingCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append((sql, params))
+
+    def fetchone(self):
+        return self.conn.row
+
+    def copy_expert(self, sql, buffer):
+        data = buffer.read()
+        if self.conn.fail or (self.conn.fail_on is not None and self.conn.fail_on in data):
+            raise self.conn.error
+        self.conn.copied.append((sql, data))
+
+
+class RecordingConnection:
+    """
+    Stands in for a psycopg2 connection: records statements and COPY data, and answers fetchone with `row`.
+    COPY raises `error` always (`fail`) or when the data contains `fail_on`.
+    """
+    def __init__(self, row=None, fail=False, fail_on=None, error=None):
+        self.row = row
+        self.fail = fail
+        self.fail_on = fail_on
+        self.error = error or RuntimeError("copy failed")
+        self.executed = []
+        self.copied = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return RecordingCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class RecordingChannel:
+    """
+    Stands in for a pika channel: records acks, nacks and publishes.
+    """
+    def __init__(self):
+        self.acked = []
+        self.nacked = []
+        self.published = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acked.append((delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        self.nacked.append((delivery_tag, multiple, requeue))
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((exchange, routing_key, json.loads(body)))
+
+
+# The dimension tables of create_tables.py in DuckDB's dialect: sequences instead of SERIAL, and a plain
+# UNIQUE (city, state), which unlike Postgres' NULLS NOT DISTINCT lets two (city, NULL) rows in
+DUCKDB_DIMENSION_TABLES = """
+    CREATE SEQUENCE merchant_ids; CREATE SEQUENCE city_ids; CREATE SEQUENCE job_ids;
+    CREATE TABLE dim_merchant (
+        merchant_id INTEGER PRIMARY KEY DEFAULT nextval('merchant_ids'), name VARCHAR NOT NULL UNIQUE
+    );
+    CREATE TABLE dim_city (
+        city_id INTEGER PRIMARY KEY DEFAULT nextval('city_ids'), city VARCHAR NOT NULL, state VARCHAR,
+        UNIQUE (city, state)
+    );
+    CREATE TABLE dim_job (job_id INTEGER PRIMARY KEY DEFAULT nextval('job_ids'), name VARCHAR NOT NULL UNIQUE);
+"""
+
+
+def quote(value):
+    if isinstance(value, str):
+        quoted = QuotedString(value)
+        quoted.encoding = "UTF8"
+        return quoted.getquoted().decode()
+    return adapt(value).getquoted().decode()
+
+
+class DuckDBCursor:
+    def __init__(self, conn):
+        self.connection = conn
+        self.result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def mogrify(self, sql, params):
+        if isinstance(sql, bytes):
+            sql = sql.decode()
+        return (sql % tuple(quote(value) for value in params)).encode()
+
+    def execute(self, sql, params=None):
+        if params is not None:
+            sql = self.mogrify(sql, params)
+        if isinstance(sql, bytes):
+            sql = sql.decode()
+        self.connection.begin()
+        self.connection.executed.append(sql)
+        self.result = self.connection.con.execute(sql)
+
+    def executemany(self, sql, params_list):
+        for params in params_list:
+            self.execute(sql, params)
+
+    def fetchone(self):
+        return self.result.fetchone()
+
+    def fetchall(self):
+        return self.result.fetchall()
+
+
+class DuckDBConnection:
+    """
+    Stands in for a psycopg2 connection on an in-memory DuckDB database, so the SQL a module generates for
+    Postgres actually runs. Like psycopg2, the first statement opens a transaction unless `autocommit` is set.
+    Records every statement.
+    """
+    encoding = "UTF8"
+    autocommit = False
+
+    def __init__(self):
+        import duckdb
+
+        self.con = duckdb.connect()
+        self.executed = []
+        self.in_transaction = False
+
+    def begin(self):
+        if not self.in_transaction and not self.autocommit:
+            self.con.begin()
+            self.in_transaction = True
+
+    def cursor(self):
+        return DuckDBCursor(self)
+
+    def commit(self):
+        if self.in_transaction:
+            self.con.commit()
+            self.in_transaction = False
+
+    def rollback(self):
+        if self.in_transaction:
+            self.con.rollback()
+            self.in_transaction = False
+
+    def query(self, sql):
+        return self.con.execute(sql).fetchall()
@@ -0,0 +1,184 @@
+import functools
+import subprocess
+import sys
+
+import duckdb
+import pandas as pd
+import pytest
+
+import analytics_store
+import uploader
+from processor import clean_data
+
+
+@pytest.fixture
+def interned_records(raw_records):
+    """
+    The golden batch as the uploader hands it to the store: cleaned, with dimension keys.
+    """
+    records = clean_data(pd.DataFrame(raw_records)).to_dict(orient="records")
+    keys = {}
+    for record in records:
+        for field, key in (("merchant", "merchant_id"), ("city", "city_id"), ("job", "job_id")):
+            value = record.get(field)
+            record[key] = None if pd.isna(value) else keys.setdefault((field, value), len(keys) + 1)
+    return records
+
+
+def test_to_frame_types(interned_records):
+    df = analytics_store.to_frame(interned_records)
+
+    assert list(df.columns) == [*analytics_store.COLUMNS, "merchant", "city", "job"]
+    assert str(df["hour"].dtype) == "Int64" and df["hour"].isna().any()
+    assert str(df["age_at_transaction"].dtype) == "Int64" and df["age_at_transaction"].isna().any()
+    assert df["is_fraud"].dtype == bool and df["is_weekend"].dtype == bool
+    assert pd.api.types.is_datetime64_any_dtype(df["transaction_time"])
+    assert df["transaction_time"].isna().any()
+
+
+def test_to_frame_fills_missing_keys():
+    df = analytics_store.to_frame([{"amt": "12.5", "is_fraud": 1, "is_weekend": 0}])
+
+    assert df.loc[0, "amt"] == 12.5 and df.loc[0, "is_fraud"]
+    assert pd.isna(df.loc[0, "merchant_id"]) and pd.isna(df.loc[0, "geohash"])
+
+
+def test_append_batch_stores_types_nulls_and_dimensions(interned_records, tmp_path):
+    path = str(tmp_path / "analytics.duckdb")
+
+    assert analytics_store.append_batch(interned_records, path) == len(interned_records)
+    assert analytics_store.append_batch([], path) == 0
+
+    with duckdb.connect(path) as con:
+        types = dict(con.execute(
+            "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = 'processed_transactions'"
+        ).fetchall())
+        assert types["hour"] == "INTEGER" and types["is_fraud"] == "BOOLEAN"
+        assert types["transaction_time"] == "TIMESTAMP" and types["distance_km"] == "DOUBLE"
+
+        stored = con.execute("SELECT * FROM transactions_view ORDER BY transaction_id").df()
+    expected = analytics_store.to_frame(interned_records)
+    assert len(stored) == len(expected)
+    assert stored["hour"].isna().tolist() == expected["hour"].isna().tolist()
+    assert stored["age_at_transaction"].isna().tolist() == expected["age_at_transaction"].isna().tolist()
+    assert stored["transaction_time"].isna().tolist() == expected["transaction_time"].isna().tolist()
+    assert stored["is_fraud"].tolist() == expected["is_fraud"].tolist()
+    # The view decodes the keys through the mirrored dimension tables
+    assert stored["merchant"].tolist() == [record["merchant"] for record in interned_records]
+    assert stored["city"].tolist() == [record["city"] for record in interned_records]
+    assert stored["transaction_id"].is_unique
+
+
+def test_append_batch_does_not_duplicate_dimensions(interned_records, tmp_path):
+    path = str(tmp_path / "analytics.duckdb")
+    analytics_store.append_batch(interned_records, path)
+    analytics_store.append_batch(interned_records, path)
+
+    with duckdb.connect(path) as con:
+        rows = con.execute("SELECT COUNT(*) FROM processed_transactions").fetchone()[0]
+        merchants = con.execute("SELECT COUNT(*) FROM dim_merchant").fetchone()[0]
+    assert rows == 2 * len(interned_records)
+    assert merchants == len({record["merchant"] for record in interned_records if not pd.isna(record["merchant"])})
+
+
+@pytest.fixture
+def dashboard_reader():
+    """
+    Opens a DuckDB file read-only in another process, as the dashboard's engine does, until closed.
+    """
+    readers = []
+
+    def open_reader(path):
+        reader = subprocess.Popen(
+            [sys.executable, "-c", "import sys, duckdb; con = duckdb.connect(sys.argv[1], read_only=True); "
+                                   "print('ready', flush=True); sys.stdin.readline()", path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        )
+        assert reader.stdout.readline().strip() == "ready"
+        readers.append(reader)
+        return reader
+
+    yield open_reader
+    for reader in readers:
+        if reader.poll() is None:
+            reader.communicate("\n", timeout=10)
+
+
+def test_mirror_keeps_batches_while_the_dashboard_holds_the_lock(interned_records, tmp_path, monkeypatch,
+                                                                 dashboard_reader):
+    path = str(tmp_path / "analytics.duckdb")
+    analytics_store.append_batch(interned_records[:1], path)
+    monkeypatch.setattr(analytics_store, "append_batch", functools.partial(analytics_store.append_batch, path=path))
+    monkeypatch.setattr(uploader, "ANALYTICS_STORE", True)
+    monkeypatch.setattr(uploader, "analytics_backlog", uploader.new_analytics_backlog())
+    monkeypatch.setattr(uploader, "ANALYTICS_RETRY_SECONDS", 1.0)
+
+    reader = dashboard_reader(path)
+    with pytest.raises(duckdb.IOException, match="lock"):
+        analytics_store.append_batch(interned_records)
+    assert uploader.mirror_to_analytics_store(interned_records, now=100.0) == 0
+    assert len(uploader.analytics_backlog["records"]) == len(interned_records)
+    # Backing off: the next batch is only queued
+    assert uploader.mirror_to_analytics_store(interned_records, now=100.5) == 0
+    assert uploader.mirror_to_analytics_store(interned_records, now=101.0) == 0
+    assert uploader.analytics_backlog["delay"] == 2.0 and uploader.analytics_backlog["retry_at"] == 103.0
+    reader.communicate("\n", timeout=10)
+
+    assert uploader.mirror_to_analytics_store([], now=103.0) == 3 * len(interned_records)
+    assert uploader.analytics_backlog == uploader.new_analytics_backlog()
+    with duckdb.connect(path) as con:
+        assert con.execute("SELECT COUNT(*) FROM processed_transactions").fetchone()[0] == 1 + 3 * len(interned_records)
+
+
+def test_mirror_drops_the_oldest_records_beyond_the_limit(monkeypatch):
+    def locked(records):
+        raise OSError("Could not set lock on file")
+
+    monkeypatch.setattr(analytics_store, "append_batch", locked)
+    monkeypatch.setattr(uploader, "ANALYTICS_STORE", True)
+    monkeypatch.setattr(uploader, "analytics_backlog", uploader.new_analytics_backlog())
+    monkeypatch.setattr(uploader, "ANALYTICS_MAX_PENDING_ROWS", 3)
+
+    uploader.mirror_to_analytics_store([{"amt": 1}, {"amt": 2}], now=0.0)
+    uploader.mirror_to_analytics_store([{"amt": 3}, {"amt": 4}], now=10.0)
+
+    assert uploader.analytics_backlog["records"] == [{"amt": 2}, {"amt": 3}, {"amt": 4}]
+
+
+@pytest.fixture
+def con():
+    with duckdb.connect() as con:
+        analytics_store.create_schema(con)
+        yield con
+
+
+# Values of Postgres' width_bucket(x, lo, hi, n)
+@pytest.mark.parametrize("x, lo, hi, n, bucket", [
+    (-0.5, 0, 10, 5, 0),
+    (0, 0, 10, 5, 1),
+    (1.999, 0, 10, 5, 1),
+    (2, 0, 10, 5, 2),
+    (9.999, 0, 10, 5, 5),
+    (10, 0, 10, 5, 6),
+    (42, 0, 10, 5, 6),
+    (5, 0, 10, 3, 2),
+    (30, 18.0, 91.0, 30, 5),
+    (None, 0, 10, 5, None),
+])
+def test_width_bucket_matches_postgres(con, x, lo, hi, n, bucket):
+    assert con.execute("SELECT width_bucket(?, ?, ?, ?)", [x, lo, hi, n]).fetchone()[0] == bucket
+
+
+def test_sample_clause_is_repeatable(con):
+    con.execute("INSERT INTO processed_transactions (amt) SELECT i FROM range(200000) t(i)")
+
+    def sampled(percent, seed=42):
+        return con.execute(
+            f"SELECT COUNT(*), SUM(amt) FROM processed_transactions {analytics_store.sample_clause(percent, seed)}"
+        ).fetchone()
+
+    assert sampled(100)[0] == 200000
+    assert sampled(0)[0] == 0
+    count, total = sampled(25)
+    assert 0 < count < 200000
+    assert sampled(25) == (count, total)
@@ -0,0 +1,107 @@
+import datetime
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from archiver import RAW_DATA_SCHEMA, list_archived_days, read_archive, write_partitions
+
+
+def raw_rows(ids, created_at, **overrides):
+    """
+    raw_data rows as archive_batch fetches them: one per transaction id, all created at `created_at`.
+    """
+    rows = pd.DataFrame({
+        'transaction_id': list(ids),
+        'cc_num': '2703186189652095',
+        'first': 'Jennifer',
+        'last': 'Banks',
+        'transaction_time': datetime.datetime(2019, 1, 1, 0, 0, 18),
+        'category': 'misc_net',
+        'amount': 4.97,
+        'merchant': 'fraud_Rippin, Kub and Mann',
+        'merchant_latitude': 36.011293,
+        'merchant_longitude': -82.048315,
+        'job': 'Psychologist, counselling',
+        'zip': '28654',
+        'gender': 'F',
+        'city': 'Moravian Falls',
+        'city_pop': 3495,
+        'state': 'NC',
+        'latitude': 36.0788,
+        'longitude': -81.1781,
+        'unix_time': 1325376018,
+        'is_fraud': 0,
+        'created_at': pd.Timestamp(created_at),
+    })
+    for column, value in overrides.items():
+        rows[column] = value
+    return rows
+
+
+def test_write_partitions_round_trip(tmp_path):
+    batch = pd.concat([raw_rows(range(1, 4), "2024-01-01 10:00"), raw_rows(range(4, 6), "2024-01-02 09:30")])
+
+    written = write_partitions(batch, str(tmp_path))
+
+    assert sorted(os.path.relpath(path, tmp_path) for path in written) == [
+        os.path.join("day=2024-01-01", "part-1-3.parquet"), os.path.join("day=2024-01-02", "part-4-5.parquet"),
+    ]
+    assert list_archived_days(str(tmp_path)) == ["2024-01-01", "2024-01-02"]
+    assert pq.read_schema(written[0]).equals(RAW_DATA_SCHEMA)
+
+    archived = read_archive(archive_dir=str(tmp_path))
+    assert archived["transaction_id"].tolist() == [1, 2, 3, 4, 5]
+    assert archived.loc[0, "merchant"] == "fraud_Rippin, Kub and Mann"
+    assert archived.loc[4, "created_at"] == pd.Timestamp("2024-01-02 09:30")
+    assert archived["day"].astype(str).tolist() == ["2024-01-01"] * 3 + ["2024-01-02"] * 2
+
+
+def test_read_archive_only_returns_the_requested_days(tmp_path):
+    for day, ids in (("2024-01-01", range(1, 3)), ("2024-01-02", range(3, 5)), ("2024-01-03", range(5, 7))):
+        write_partitions(raw_rows(ids, day), str(tmp_path))
+
+    archived = read_archive("2024-01-02", "2024-01-03", columns=["transaction_id", "amount"],
+                            archive_dir=str(tmp_path))
+
+    assert archived.columns.tolist() == ["transaction_id", "amount"]
+    assert archived["transaction_id"].tolist() == [3, 4, 5, 6]
+    assert read_archive(end_day="2024-01-01", archive_dir=str(tmp_path))["transaction_id"].tolist() == [1, 2]
+
+
+def test_read_archive_drops_rows_archived_twice(tmp_path):
+    # A batch whose delete rolled back after its files were written is archived again with other rows
+    write_partitions(raw_rows(range(1, 4), "2024-01-01"), str(tmp_path))
+    write_partitions(raw_rows(range(2, 6), "2024-01-01"), str(tmp_path))
+
+    assert read_archive(archive_dir=str(tmp_path))["transaction_id"].tolist() == [1, 2, 3, 4, 5]
+
+
+def test_days_with_all_null_columns_combine_with_the_others(tmp_path):
+    write_partitions(raw_rows(range(1, 3), "2024-01-01", first=None, job=None, city_pop=None), str(tmp_path))
+    write_partitions(raw_rows(range(3, 5), "2024-01-02"), str(tmp_path))
+
+    archived = read_archive(archive_dir=str(tmp_path))
+
+    assert archived["first"].isna().tolist() == [True, True, False, False]
+    assert archived["job"].tolist()[2:] == ["Psychologist, counselling"] * 2
+    assert archived["city_pop"].tolist()[2:] == [3495, 3495]
+
+
+def test_read_archive_reads_files_written_with_inferred_types(tmp_path):
+    # Archives from before the explicit schema: the null-typed day sorts first
+    for day, batch in (("2024-01-01", raw_rows(range(1, 3), "2024-01-01", job=None)),
+                       ("2024-01-02", raw_rows(range(3, 5), "2024-01-02"))):
+        os.makedirs(tmp_path / f"day={day}")
+        pq.write_table(pa.Table.from_pandas(batch, preserve_index=False), tmp_path / f"day={day}" / "part.parquet")
+
+    archived = read_archive(archive_dir=str(tmp_path))
+
+    assert archived["transaction_id"].tolist() == [1, 2, 3, 4]
+    assert archived["job"].tolist()[2:] == ["Psychologist, counselling"] * 2
+
+
+def test_read_archive_of_an_empty_archive(tmp_path):
+    assert read_archive(archive_dir=str(tmp_path / "missing"), columns=["transaction_id"]).empty
+    assert list_archived_days(str(tmp_path / "missing")) == []
@@ -0,0 +1,95 @@
+import csv
+import datetime
+import io
+
+import pandas as pd
+import pytest
+
+from backfill import clean_chunk, load_checkpoint, read_chunks, select_range
+from conftest import RecordingConnection
+from processor import clean_data
+from uploader import PROCESSED_COLUMNS, bulk_copy, processed_values
+
+
+def test_select_range_keeps_start_and_excludes_end(raw_records):
+    chunk = pd.DataFrame(raw_records)
+
+    selected = select_range(chunk, "2019-06-15", "2020-02-29")
+
+    assert sorted(selected["trans_date_trans_time"]) == ["2019-06-15 23:59:59", "2020-02-28 12:00:00"]
+
+
+def test_clean_chunk_returns_cleaned_records(raw_records):
+    records = clean_chunk(pd.DataFrame(raw_records), end="2019-01-02")
+
+    assert records and all(record["trans_date_trans_time"].startswith("2019-01-01") for record in records)
+    assert clean_chunk(pd.DataFrame(raw_records), start="2030-01-01") == []
+
+
+def test_bulk_copy_writes_missing_values_as_null():
+    conn = RecordingConnection()
+    rows = [(1, "Kub, and Sons", None, float("nan"), True, datetime.datetime(2019, 1, 1, 0, 0, 18))]
+
+    assert bulk_copy(conn, "processed_transactions", ("a", "b", "c", "d", "e", "f"), rows) == 1
+
+    sql, data = conn.copied[0]
+    assert sql.startswith("COPY processed_transactions (a, b, c, d, e, f) FROM STDIN")
+    assert data == '1,"Kub, and Sons",\\N,\\N,True,2019-01-01 00:00:18\r\n'
+
+
+def test_bulk_copy_writes_integer_columns_without_decimals(raw_records):
+    # The batch has rows without a parseable time or dob, so pandas makes hour, year, ... floats
+    records = clean_data(pd.DataFrame(raw_records)).to_dict(orient="records")
+    conn = RecordingConnection()
+
+    bulk_copy(conn, "processed_transactions", PROCESSED_COLUMNS, processed_values(records))
+
+    rows = list(csv.reader(io.StringIO(conn.copied[0][1])))
+    assert rows
+    for column in ("hour", "age_at_transaction", "day_of_week", "month", "year"):
+        values = [row[PROCESSED_COLUMNS.index(column)] for row in rows]
+        assert all(value == "\\N" or value.lstrip("-").isdigit() for value in values), (column, values)
+    assert "\\N" in [row[PROCESSED_COLUMNS.index("age_at_transaction")] for row in rows]
+
+
+def test_load_checkpoint_without_a_row_starts_from_the_top():
+    conn = RecordingConnection(row=None)
+
+    assert load_checkpoint(conn, "fraudTrain.csv::", 1000) == (-1, 0)
+    assert conn.executed[0][1] == ("fraudTrain.csv::",)
+
+
+def test_load_checkpoint_returns_the_last_chunk():
+    assert load_checkpoint(RecordingConnection(row=(1000, 4, 4980)), "job", 1000) == (4, 4980)
+
+
+def test_load_checkpoint_rejects_another_chunk_size():
+    with pytest.raises(ValueError, match="chunk size 1000, not 500"):
+        load_checkpoint(RecordingConnection(row=(1000, 4, 4980)), "job", 500)
+
+
+def test_read_chunks_resumes_after_the_last_chunk(tmp_path):
+    path = tmp_path / "transactions.csv"
+    # Written with its index, like fraudTrain.csv, and a quoted value spanning two lines
+    pd.DataFrame({
+        "row": range(10), "merchant": ["fraud_Kub,\nand Sons" if i == 4 else f"m{i}" for i in range(10)],
+        "amt": [i * 1.5 for i in range(10)],
+    }).to_csv(path)
+
+    chunks = list(read_chunks(path, chunk_size=3, last_chunk=1))
+
+    assert [index for index, _ in chunks] == [2, 3]
+    first = chunks[0][1]
+    assert list(first.columns) == ["Unnamed: 0", "row", "merchant", "amt"]
+    assert first.iloc[0].tolist() == [6, 6, "m6", 9.0]
+    assert list(first["row"]) == [6, 7, 8] and list(chunks[1][1]["row"]) == [9]
+    assert [index for index, _ in read_chunks(path, chunk_size=3, last_chunk=-1)] == [0, 1, 2, 3]
+    assert list(read_chunks(path, chunk_size=3, last_chunk=0))[0][1].loc[1, "merchant"] == "fraud_Kub,\nand Sons"
+
+
+def test_read_chunks_after_the_last_row_yields_nothing(tmp_path):
+    path = tmp_path / "transactions.csv"
+    pd.DataFrame({"row": range(6)}).to_csv(path, index=False)
+
+    assert list(read_chunks(path, chunk_size=3, last_chunk=1)) == []
+    assert list(read_chunks(path, chunk_size=3, last_chunk=5)) == []
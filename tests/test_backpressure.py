@@ -0,0 +1,183 @@
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+import broker
+import processor
+from processor import next_throttle_state, throttle_delay
+
+
+class FakeConnection:
+    def __init__(self):
+        self.slept = []
+        self.channels = 0
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+
+    def channel(self):
+        self.channels += 1
+        return FakeChannel(self)
+
+
+class FakeChannel:
+    def __init__(self, connection, depths=None, nacks=0):
+        self.connection = connection
+        self.depths = depths or {}
+        self.nacks = nacks
+        self.published = []
+
+    def queue_declare(self, queue, passive=False):
+        if queue not in self.depths:
+            raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no queue '{queue}'")
+        return SimpleNamespace(method=SimpleNamespace(message_count=self.depths[queue]))
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        if self.nacks:
+            self.nacks -= 1
+            raise pika.exceptions.NackError([])
+        self.published.append((exchange, routing_key, body))
+
+
+def test_queue_arguments_from_env(monkeypatch):
+    assert broker.queue_arguments("processed_data_upload") is None
+
+    monkeypatch.setenv("PROCESSED_DATA_UPLOAD_MAX_LENGTH", "500")
+    assert broker.queue_arguments("processed_data_upload") == {
+        "x-max-length": 500, "x-overflow": "reject-publish"
+    }
+
+    monkeypatch.setenv("PROCESSED_DATA_UPLOAD_MAX_LENGTH_BYTES", "1048576")
+    monkeypatch.setenv("PROCESSED_DATA_UPLOAD_OVERFLOW", "drop-head")
+    assert broker.queue_arguments("processed_data_upload") == {
+        "x-max-length": 500, "x-max-length-bytes": 1048576, "x-overflow": "drop-head"
+    }
+    assert broker.is_bounded(["raw_data_upload", "processed_data_upload"])
+    assert not broker.is_bounded(["raw_data_upload"])
+
+
+def test_queue_arguments_reject_unknown_overflow(monkeypatch):
+    monkeypatch.setenv("RAW_DATA_PROCESS_MAX_LENGTH", "100")
+    monkeypatch.setenv("RAW_DATA_PROCESS_OVERFLOW", "drop-everything")
+    with pytest.raises(ValueError):
+        broker.queue_arguments("raw_data_process")
+
+
+def test_queue_depths_reports_missing_queues_as_empty():
+    connection = FakeConnection()
+    probe = FakeChannel(connection, depths={"raw_data_process": 12})
+
+    depths, next_probe = broker.queue_depths(connection, probe, ["raw_data_process", "processed_data_upload"])
+
+    assert depths == {"raw_data_process": 12, "processed_data_upload": 0}
+    # The broker closes a channel on a failed passive declare, so a new probe is opened
+    assert next_probe is not probe and connection.channels == 1
+
+
+def test_publish_retries_rejected_messages():
+    connection = FakeConnection()
+    channel = FakeChannel(connection, nacks=2)
+
+    rejected = broker.publish(channel, "clean_data", "[]", retry_delay=0.5)
+
+    assert rejected == 2
+    assert connection.slept == [0.5, 0.5]
+    assert channel.published == [("fraud_exchange", "clean_data", "[]")]
+
+
+class RoutingChannel:
+    """
+    A direct exchange in front of bounded reject-publish queues: a publish is enqueued in every bound queue
+    with room and nacked if any of them is full.
+    """
+    def __init__(self, connection, bindings, max_length):
+        self.connection = connection
+        self.bindings = bindings
+        self.max_length = max_length
+        self.queues = {queue: [] for queues in bindings.values() for queue in queues}
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        targets = self.bindings[routing_key] if exchange else [routing_key]
+        full = [queue for queue in targets if len(self.queues[queue]) >= self.max_length.get(queue, float("inf"))]
+        for queue in targets:
+            if queue not in full:
+                self.queues[queue].append(body)
+        if full:
+            raise pika.exceptions.NackError([])
+
+
+def fanout_channel(monkeypatch):
+    monkeypatch.setenv("RAW_DATA_UPLOAD_MAX_LENGTH", "1")
+    connection = FakeConnection()
+    channel = RoutingChannel(connection, {"raw_data": ["raw_data_process", "raw_data_upload"]}, {"raw_data_upload": 1})
+    channel.queues["raw_data_upload"].append("older batch")
+
+    def consume(seconds):
+        # The uploader takes a message while the producer waits
+        connection.slept.append(seconds)
+        channel.queues["raw_data_upload"].pop(0)
+    connection.sleep = consume
+    return connection, channel
+
+
+def test_retrying_a_fanned_out_publish_through_the_exchange_duplicates_it(monkeypatch):
+    connection, channel = fanout_channel(monkeypatch)
+
+    broker.publish(channel, "raw_data", "batch", retry_delay=0.5)
+
+    assert channel.queues["raw_data_process"] == ["batch", "batch"]
+
+
+def test_publish_fanout_retries_only_the_full_queue(monkeypatch):
+    connection, channel = fanout_channel(monkeypatch)
+
+    rejected = broker.publish_fanout(channel, "raw_data", ["raw_data_process", "raw_data_upload"], "batch", 0.5)
+
+    assert rejected == 1 and connection.slept == [0.5]
+    assert channel.queues == {"raw_data_process": ["batch"], "raw_data_upload": ["batch"]}
+
+
+def test_publish_fanout_uses_the_exchange_for_unbounded_queues():
+    channel = FakeChannel(FakeConnection())
+
+    broker.publish_fanout(channel, "raw_data", ["raw_data_process", "raw_data_upload"], "batch")
+
+    assert channel.published == [("fraud_exchange", "raw_data", "batch")]
+
+
+def test_throttle_states_with_hysteresis():
+    assert next_throttle_state("running", 0) == "running"
+    assert next_throttle_state("running", processor.THROTTLE_SLOW_DEPTH) == "slowed"
+    assert next_throttle_state("slowed", processor.THROTTLE_PAUSE_DEPTH) == "paused"
+    # Between the resume and pause depths a paused processor stays paused, a running one only slows down
+    between = (processor.THROTTLE_RESUME_DEPTH + processor.THROTTLE_PAUSE_DEPTH) // 2
+    assert next_throttle_state("paused", between) == "paused"
+    assert next_throttle_state("slowed", between) == "slowed"
+    assert next_throttle_state("paused", processor.THROTTLE_RESUME_DEPTH) == "slowed"
+    assert next_throttle_state("paused", 0) == "running"
+
+
+def test_throttle_delay_grows_to_the_maximum():
+    delays = [throttle_delay(depth) for depth in range(processor.THROTTLE_SLOW_DEPTH, processor.THROTTLE_PAUSE_DEPTH + 1)]
+    assert delays == sorted(delays)
+    assert 0 < delays[0] < processor.THROTTLE_MAX_DELAY
+    assert delays[-1] == processor.THROTTLE_MAX_DELAY
+
+
+def test_apply_backpressure_holds_the_batch_until_the_uploader_catches_up(monkeypatch):
+    connection = FakeConnection()
+    probe = FakeChannel(connection, depths={"raw_data_process": 40, "processed_data_upload": 500})
+    monkeypatch.setattr(processor, "throttle_state", {**processor.throttle_state, "state": "running", "probe": probe})
+
+    def drain(seconds):
+        connection.slept.append(seconds)
+        probe.depths["processed_data_upload"] //= 4
+    connection.sleep = drain
+
+    processor.apply_backpressure(connection)
+
+    # 500 -> paused; 125 is still above the resume depth; 31 resumes at full speed
+    assert connection.slept == [processor.THROTTLE_POLL_SECONDS] * 2
+    assert processor.throttle_state["state"] == "running"
+    assert processor.throttle_state["depths"] == {"raw_data_process": 40, "processed_data_upload": 31}
@@ -0,0 +1,163 @@
+import os
+import re
+import sys
+
+import pytest
+
+import dimensions
+import uploader
+from conftest import DUCKDB_DIMENSION_TABLES, DuckDBConnection, DuckDBCursor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "database"))
+
+from create_tables import migrate_processed_transactions  # noqa: E402
+
+
+@pytest.fixture
+def conn():
+    conn = DuckDBConnection()
+    conn.con.execute(DUCKDB_DIMENSION_TABLES)
+    dimensions.reset_dimension_cache()
+    yield conn
+    dimensions.reset_dimension_cache()
+
+
+def records(*rows):
+    return [dict(zip(("merchant", "city", "state", "job"), row)) for row in rows]
+
+
+def test_intern_records_inserts_new_values_once(conn):
+    data = records(("Kub", "Moravian Falls", "NC", "Psychologist"), ("Kub", "Orient", "WA", None),
+                   (None, float("nan"), "ID", "Psychologist"))
+
+    dimensions.intern_records(conn, data)
+    conn.commit()
+
+    merchants = dict(conn.query("SELECT name, merchant_id FROM dim_merchant"))
+    cities = {(city, state): key for key, city, state in conn.query("SELECT city_id, city, state FROM dim_city")}
+    assert [record["merchant_id"] for record in data] == [merchants["Kub"], merchants["Kub"], None]
+    assert [record["city_id"] for record in data] == [cities["Moravian Falls", "NC"], cities["Orient", "WA"], None]
+    assert data[0]["job_id"] == data[2]["job_id"] is not None and data[1]["job_id"] is None
+    assert len(merchants) == 1 and len(cities) == 2
+
+
+def test_intern_records_uses_the_cache_for_known_values(conn):
+    dimensions.intern_records(conn, records(("Kub", "Orient", "WA", "Psychologist")))
+    conn.commit()
+    conn.executed.clear()
+
+    data = dimensions.intern_records(conn, records(("Kub", "Orient", "WA", "Psychologist")))
+
+    assert conn.executed == []
+    assert data[0]["merchant_id"] is not None and data[0]["city_id"] is not None
+
+
+def test_intern_records_picks_up_keys_another_writer_inserted(conn):
+    dimensions.load_dimension_cache(conn)
+    # Inserted by another writer after this one loaded its cache
+    conn.con.execute("INSERT INTO dim_merchant (name) VALUES ('Kub')")
+    theirs = conn.query("SELECT merchant_id FROM dim_merchant WHERE name = 'Kub'")[0][0]
+
+    data = dimensions.intern_records(conn, records(("Kub", None, None, None), ("Bins", None, None, None)))
+
+    assert data[0]["merchant_id"] == theirs and data[1]["merchant_id"] not in (None, theirs)
+    assert dimensions.dimension_cache["merchant"][("Kub",)] == theirs
+    assert conn.query("SELECT COUNT(*) FROM dim_merchant") == [(2,)]
+    assert any("ON CONFLICT DO NOTHING" in sql for sql in conn.executed)
+
+
+def test_intern_records_matches_cities_without_a_state(conn):
+    data = dimensions.intern_records(conn, records((None, "Orient", None, None), (None, "Orient", "WA", None)))
+
+    keys = dict(((city, state), key) for key, city, state in conn.query("SELECT city_id, city, state FROM dim_city"))
+    # The select-back compares with IS NOT DISTINCT FROM, so the NULL state finds its row
+    assert data[0]["city_id"] == keys["Orient", None] and data[1]["city_id"] == keys["Orient", "WA"]
+    assert dimensions.dimension_cache["city"] == {("Orient", None): keys["Orient", None],
+                                                  ("Orient", "WA"): keys["Orient", "WA"]}
+
+
+def test_a_failed_insert_clears_the_keys_its_rollback_discarded(conn):
+    # processed_transactions does not exist, so the insert after interning fails and rolls back
+    with pytest.raises(Exception):
+        uploader.insert_processed_data(conn, records(("Kub", "Orient", "WA", "Psychologist")))
+
+    assert dimensions.dimension_cache == {}
+    assert conn.query("SELECT COUNT(*) FROM dim_merchant") == [(0,)]
+    data = dimensions.intern_records(conn, records(("Kub", "Orient", "WA", "Psychologist")))
+    conn.commit()
+    assert conn.query("SELECT merchant_id FROM dim_merchant") == [(data[0]["merchant_id"],)]
+
+
+class DuckDBMigrationCursor(DuckDBCursor):
+    """
+    Runs the migration's ALTER as one statement per added column without the foreign keys,
+    since DuckDB takes only one action per ALTER and no constraints on added columns.
+    """
+    def execute(self, sql, params=None):
+        if "ADD COLUMN" in sql:
+            actions = sql.split("processed_transactions", 1)[1].strip().rstrip(";").split(",")
+            sql = "; ".join(
+                f"ALTER TABLE processed_transactions {re.sub(r' REFERENCES .*', '', action.strip())}"
+                for action in actions
+            )
+        super().execute(sql, params)
+
+
+LEGACY_PROCESSED_TRANSACTIONS = """
+    CREATE TABLE processed_transactions (
+        transaction_id INTEGER PRIMARY KEY, merchant VARCHAR, transaction_time TIMESTAMP, category VARCHAR,
+        job_category VARCHAR, amt DOUBLE, gender VARCHAR, city VARCHAR, state VARCHAR, is_fraud BOOLEAN,
+        hour INTEGER, age_at_transaction INTEGER, day_of_week INTEGER, month INTEGER, is_weekend BOOLEAN,
+        year INTEGER, lat DOUBLE, long DOUBLE, processed_at TIMESTAMP DEFAULT current_timestamp
+    );
+    INSERT INTO processed_transactions (transaction_id, merchant, city, state, amt) VALUES
+        (1, 'fraud_Kub', 'Orient', 'WA', 1.5),
+        (2, 'fraud_Kub', 'Orient', NULL, 2.5),
+        (3, 'fraud_Bins', 'Moravian Falls', 'NC', 3.5),
+        (4, NULL, NULL, 'NC', 4.5);
+"""
+
+
+def test_migration_moves_legacy_strings_into_the_dimensions(conn):
+    # DuckDB cannot commit a transaction that updates a table and then drops one of its columns
+    conn.autocommit = True
+    conn.con.execute(LEGACY_PROCESSED_TRANSACTIONS)
+    # An existing dimension row keeps its key
+    conn.con.execute("INSERT INTO dim_merchant (name) VALUES ('fraud_Bins')")
+    bins = conn.query("SELECT merchant_id FROM dim_merchant")[0][0]
+
+    migrate_processed_transactions(DuckDBMigrationCursor(conn))
+
+    columns = [row[0] for row in conn.query(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = 'processed_transactions'"
+    )]
+    assert "merchant" not in columns and "city" not in columns
+    assert {"merchant_id", "city_id", "job_id", "distance_km", "geohash"} <= set(columns)
+
+    rows = conn.query("""
+        SELECT p.transaction_id, p.merchant_id, m.name, c.city, c.state, p.state, p.amt, p.job_id
+        FROM processed_transactions p
+        LEFT JOIN dim_merchant m USING (merchant_id) LEFT JOIN dim_city c USING (city_id)
+        ORDER BY p.transaction_id
+    """)
+    assert [row[2:] for row in rows] == [
+        ("fraud_Kub", "Orient", "WA", "WA", 1.5, None),
+        ("fraud_Kub", "Orient", None, None, 2.5, None),
+        ("fraud_Bins", "Moravian Falls", "NC", "NC", 3.5, None),
+        (None, None, None, "NC", 4.5, None),
+    ]
+    assert rows[2][1] == bins
+    assert conn.query("SELECT COUNT(*) FROM dim_city") == [(3,)]
+
+
+def test_migration_of_an_up_to_date_table_only_adds_missing_columns(conn):
+    conn.autocommit = True
+    conn.con.execute(LEGACY_PROCESSED_TRANSACTIONS)
+    cursor = DuckDBMigrationCursor(conn)
+    migrate_processed_transactions(cursor)
+    conn.executed.clear()
+
+    migrate_processed_transactions(cursor)
+
+    assert len(conn.executed) == 2
+    assert conn.executed[1].strip().startswith("SELECT column_name FROM information_schema.columns")
@@ -0,0 +1,97 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import dimensions
+import uploader
+from conftest import DUCKDB_DIMENSION_TABLES, DuckDBConnection, RecordingChannel
+
+RAW_DATA = """
+    CREATE SEQUENCE raw_ids;
+    CREATE TABLE raw_data (
+        transaction_id INTEGER DEFAULT nextval('raw_ids'), cc_num VARCHAR, first VARCHAR, last VARCHAR,
+        transaction_time TIMESTAMP, category VARCHAR, amount DOUBLE, merchant VARCHAR, merchant_latitude DOUBLE,
+        merchant_longitude DOUBLE, job VARCHAR, zip VARCHAR, gender VARCHAR, city VARCHAR, city_pop INTEGER,
+        state VARCHAR, latitude DOUBLE, longitude DOUBLE, unix_time BIGINT, is_fraud INTEGER, created_at TIMESTAMP
+    );
+"""
+
+PROCESSED_TRANSACTIONS = """
+    CREATE SEQUENCE processed_ids;
+    CREATE TABLE processed_transactions (
+        transaction_id INTEGER DEFAULT nextval('processed_ids'), merchant_id INTEGER, transaction_time TIMESTAMP,
+        category VARCHAR, job_category VARCHAR, job_id INTEGER, amt DOUBLE, gender VARCHAR, city_id INTEGER,
+        state VARCHAR, is_fraud BOOLEAN, hour INTEGER, age_at_transaction INTEGER, day_of_week INTEGER,
+        month INTEGER, is_weekend BOOLEAN, year INTEGER, lat DOUBLE, long DOUBLE, distance_km DOUBLE,
+        geohash VARCHAR
+    );
+"""
+
+
+class EventConnection(DuckDBConnection):
+    def __init__(self, events):
+        super().__init__()
+        self.events = events
+
+    def commit(self):
+        self.events.append("commit")
+        super().commit()
+
+    def rollback(self):
+        self.events.append("rollback")
+        super().rollback()
+
+
+class EventChannel(RecordingChannel):
+    def __init__(self, events):
+        super().__init__()
+        self.events = events
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.events.append("ack")
+        super().basic_ack(delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        self.events.append("nack")
+        super().basic_nack(delivery_tag, multiple, requeue)
+
+
+@pytest.fixture
+def events():
+    dimensions.reset_dimension_cache()
+    yield []
+    dimensions.reset_dimension_cache()
+
+
+def count(conn, table):
+    return conn.query(f"SELECT COUNT(*) FROM {table}")[0][0]
+
+
+def test_fused_upload_stores_both_tables_in_one_transaction_then_acks(raw_records, events):
+    conn, channel = EventConnection(events), EventChannel(events)
+    conn.con.execute(DUCKDB_DIMENSION_TABLES + RAW_DATA + PROCESSED_TRANSACTIONS)
+    # The rows of the golden batch the database accepts as they are
+    batch = raw_records[:4]
+
+    uploader.process_and_store(channel, SimpleNamespace(delivery_tag=3), None, json.dumps(batch), conn)
+
+    assert events == ["commit", "ack"]
+    assert channel.acked == [(3, False)] and channel.nacked == []
+    assert count(conn, "raw_data") == count(conn, "processed_transactions") == len(batch)
+    assert count(conn, "dim_merchant") > 0 and dimensions.dimension_cache["merchant"]
+
+
+def test_fused_upload_rolls_back_both_tables_and_requeues_on_error(raw_records, events):
+    conn, channel = EventConnection(events), EventChannel(events)
+    # No processed_transactions table: the raw rows and dimension values are written, then the insert fails
+    conn.con.execute(DUCKDB_DIMENSION_TABLES + RAW_DATA)
+
+    uploader.process_and_store(channel, SimpleNamespace(delivery_tag=3), None, json.dumps(raw_records[:4]), conn)
+
+    assert "commit" not in events and "ack" not in events
+    assert events[-1] == "nack" and "rollback" in events
+    assert channel.nacked == [(3, False, True)]
+    assert count(conn, "raw_data") == 0 and count(conn, "dim_merchant") == 0
+    # The keys interned in the rolled back transaction are gone from the cache too
+    assert dimensions.dimension_cache == {}
@@ -0,0 +1,84 @@
+import math
+
+import numpy as np
+
+import geo
+
+
+def reference_geohash(lat, lon, precision):
+    """
+    Textbook geohash encoding by interval bisection, one point at a time.
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    bits = []
+    for i in range(5 * precision):
+        value, interval = (lon, lon_range) if i % 2 == 0 else (lat, lat_range)
+        mid = (interval[0] + interval[1]) / 2
+        if value >= mid:
+            bits.append(1)
+            interval[0] = mid
+        else:
+            bits.append(0)
+            interval[1] = mid
+    return "".join(
+        geo.BASE32[int("".join(map(str, bits[i:i + 5])), 2)] for i in range(0, len(bits), 5)
+    )
+
+
+def test_encode_geohash_known_values():
+    hashes = geo.encode_geohash([57.64911, 36.0788, float("nan"), 91.0], [10.40744, -81.1781, 10.0, 0.0], 11)
+    assert list(hashes) == ["u4pruydqqvj", "dnqm0xzyjpv", None, None]
+
+
+def test_encode_geohash_matches_bisection():
+    rng = np.random.default_rng(7)
+    lat = rng.uniform(-90, 90, 500)
+    lon = rng.uniform(-180, 180, 500)
+    for precision in (1, 5, 7, 12):
+        expected = [reference_geohash(a, b, precision) for a, b in zip(lat, lon)]
+        assert list(geo.encode_geohash(lat, lon, precision)) == expected
+
+
+def test_geohash_bounds_contain_the_point():
+    lat_lo, lat_hi, lon_lo, lon_hi = geo.geohash_bounds("dnqm0xz")
+    assert lat_lo <= 36.0788 < lat_hi and lon_lo <= -81.1781 < lon_hi
+    height, width = geo.cell_size_degrees(7)
+    assert math.isclose(lat_hi - lat_lo, height) and math.isclose(lon_hi - lon_lo, width)
+
+
+def test_haversine_km():
+    # Moravian Falls, NC to a merchant about 78.6 km west, and one degree of latitude
+    assert math.isclose(geo.haversine_km(36.0788, -81.1781, 36.011293, -82.048315), 78.5977, rel_tol=1e-4)
+    assert math.isclose(geo.haversine_km(0, 0, 1, 0), geo.KM_PER_DEGREE)
+    distances = geo.haversine_km([0, np.nan], [0, 0], [0, 1], [0, 0])
+    assert distances[0] == 0 and np.isnan(distances[1])
+
+
+def test_covering_cells_contain_every_point_in_the_circle():
+    rng = np.random.default_rng(3)
+    for _ in range(100):
+        lat, lon = rng.uniform(-70, 70), rng.uniform(-180, 180)
+        radius_km = float(rng.choice([0.5, 5, 50, 500]))
+        cells = geo.covering_cells(lat, lon, radius_km)
+        assert len(cells) <= 9
+
+        # Points on the circle itself, bearing by bearing
+        bearing = rng.uniform(0, 2 * np.pi, 200)
+        d = radius_km * 0.999 / geo.EARTH_RADIUS_KM
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        lat2 = np.arcsin(np.sin(lat1) * np.cos(d) + np.cos(lat1) * np.sin(d) * np.cos(bearing))
+        lon2 = lon1 + np.arctan2(np.sin(bearing) * np.sin(d) * np.cos(lat1), np.cos(d) - np.sin(lat1) * np.sin(lat2))
+        points = geo.encode_geohash(np.degrees(lat2), (np.degrees(lon2) + 180) % 360 - 180)
+        assert all(any(point.startswith(cell) for cell in cells) for point in points)
+
+
+def test_covering_cells_of_a_huge_circle_is_everything():
+    assert geo.covering_cells(80, 0, 2000) == [""]
+
+
+def test_near_filter_params():
+    condition, params = geo.near_filter(36.0788, -81.1781, 25)
+    cells = geo.covering_cells(36.0788, -81.1781, 25)
+    assert [params[f"cell_{i}"] for i in range(len(cells))] == [cell + "%" for cell in cells]
+    assert condition.startswith("(geohash LIKE :cell_0 OR ")
+    assert params["radius_km"] == 25.0
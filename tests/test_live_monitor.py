@@ -0,0 +1,121 @@
+import duckdb
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+import analytics_store
+import live_monitor
+from live_monitor import merge_live_delta, new_live_state, refresh_live_state
+
+
+def delta(*rows):
+    return pd.DataFrame(rows, columns=["hour", "is_fraud", "count", "amount"])
+
+
+def frauds(*ids):
+    return pd.DataFrame({"transaction_id": list(ids), "amt": [float(i) for i in ids]})
+
+
+def test_merge_adds_counts_per_bucket_and_advances_the_mark():
+    state = merge_live_delta(new_live_state(), delta((9, False, 3, 30.0), (9, True, 1, 500.0)), frauds(4), 4, "t1")
+    state = merge_live_delta(state, delta((9, False, 2, 20.0), (10, False, 1, 5.0)), frauds(), 7, "t2")
+
+    hourly = state["hourly"]
+    assert hourly.loc[(9, False)].tolist() == [5, 50.0]
+    assert hourly.loc[(9, True)].tolist() == [1, 500.0]
+    assert hourly.loc[(10, False)].tolist() == [1, 5.0]
+    assert state["high_water_mark"] == 7 and state["last_processed_at"] == "t2"
+    assert state["last_delta_rows"] == 3
+    assert state["recent_frauds"]["transaction_id"].tolist() == [4]
+
+
+def test_merge_keeps_the_newest_frauds_first():
+    state = merge_live_delta(new_live_state(), delta((1, True, 3, 3.0)), frauds(3, 2, 1), 3, None, limit=4)
+    state = merge_live_delta(state, delta((1, True, 2, 2.0)), frauds(5, 4), 5, None, limit=4)
+
+    assert state["recent_frauds"]["transaction_id"].tolist() == [5, 4, 3, 2]
+
+
+def test_merge_does_not_modify_the_previous_state():
+    before = new_live_state()
+
+    merge_live_delta(before, delta((1, False, 1, 1.0)), frauds(), 1, None)
+
+    assert before["high_water_mark"] == 0 and before["hourly"].empty
+
+
+@pytest.fixture
+def store(tmp_path):
+    """
+    A processed_transactions table and transactions_view, written through `insert` and read by the engine.
+    """
+    path = str(tmp_path / "live.duckdb")
+    with duckdb.connect(path) as con:
+        analytics_store.create_schema(con)
+
+    def insert(*ids, is_fraud=False, age=60):
+        """
+        Inserts rows whose transaction started `age` seconds ago.
+        """
+        with duckdb.connect(path) as con:
+            con.executemany(
+                "INSERT INTO processed_transactions (transaction_id, hour, is_fraud, amt, processed_at) "
+                "VALUES (?, 9, ?, 10, LOCALTIMESTAMP - ? * INTERVAL '1 second')",
+                [(i, is_fraud, age) for i in ids],
+            )
+
+    engine = create_engine(f"duckdb:///{path}", poolclass=NullPool)
+    yield engine, insert
+    engine.dispose()
+
+
+def test_refresh_counts_every_row_once(store):
+    engine, insert = store
+    insert(1, 2, 3)
+    insert(4, is_fraud=True)
+
+    state = refresh_live_state(new_live_state(), engine)
+    assert state["high_water_mark"] == 4 and state["last_delta_rows"] == 4
+
+    state = refresh_live_state(state, engine)
+    assert state["high_water_mark"] == 4 and state["last_delta_rows"] == 0
+
+    # The first row above the mark is counted, the mark itself is not counted again
+    insert(5, 6)
+    insert(7, is_fraud=True)
+    state = refresh_live_state(state, engine)
+
+    assert state["high_water_mark"] == 7 and state["last_delta_rows"] == 3
+    assert state["hourly"].loc[(9, False)].tolist() == [5, 50.0]
+    assert state["hourly"].loc[(9, True)].tolist() == [2, 20.0]
+    assert state["recent_frauds"]["transaction_id"].tolist() == [7, 4]
+
+
+def test_refresh_stops_below_rows_that_have_not_settled(store, monkeypatch):
+    engine, insert = store
+    monkeypatch.setattr(live_monitor, "LIVE_SETTLE_SECONDS", 10.0)
+    # Writer X started recently and committed ids 2-3; writer Y started earlier and drew the later ids 4-5
+    insert(1, age=60)
+    insert(2, 3, age=1)
+    insert(4, 5, age=30)
+
+    state = refresh_live_state(new_live_state(), engine)
+    assert state["high_water_mark"] == 1 and state["last_delta_rows"] == 1
+
+    with duckdb.connect(engine.url.database) as con:
+        con.execute("UPDATE processed_transactions SET processed_at = processed_at - INTERVAL '20 seconds'")
+    state = refresh_live_state(state, engine)
+
+    assert state["high_water_mark"] == 5 and state["last_delta_rows"] == 4
+    assert state["hourly"].loc[(9, False)].tolist() == [5, 50.0]
+
+
+def test_refresh_waits_for_every_row_to_settle(store, monkeypatch):
+    engine, insert = store
+    monkeypatch.setattr(live_monitor, "LIVE_SETTLE_SECONDS", 10.0)
+    insert(1, 2, age=1)
+
+    state = refresh_live_state(new_live_state(), engine)
+
+    assert state["high_water_mark"] == 0 and state["last_delta_rows"] == 0
@@ -0,0 +1,180 @@
+import json
+
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from conftest import load_golden, save_golden
+import processor
+from processor import (
+    calculate_age, clean_data, map_category_to_readable_name, map_job_to_category, normalize_merchants,
+)
+
+
+def to_wire(df):
+    """
+    Returns the records exactly as the processor publishes them to clean_data.
+    """
+    return json.loads(json.dumps(df.to_dict(orient="records")))
+
+
+def normalize(records):
+    # pandas < 3 renders a missing timestamp as "NaT" when cast to str, newer versions keep it missing
+    return pd.DataFrame(records).replace("NaT", None)
+
+
+def test_clean_data_matches_golden(raw_records, update_golden):
+    records = to_wire(clean_data(pd.DataFrame(raw_records)))
+    if update_golden:
+        save_golden("clean_batch.json", records)
+
+    expected = normalize(load_golden("clean_batch.json"))
+    actual = normalize(records)
+    assert list(actual.columns) == list(expected.columns)
+    assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_clean_data_drops_duplicates_and_pii(raw_records):
+    cleaned = clean_data(pd.DataFrame(raw_records))
+
+    assert len(cleaned) == len(raw_records) - 1
+    assert not {"cc_num", "first", "last", "street", "dob"} & set(cleaned.columns)
+
+
+def test_clean_data_strips_only_leading_fraud_prefix(raw_records):
+    merchants = clean_data(pd.DataFrame(raw_records))["merchant"].tolist()
+
+    assert merchants[0] == "Rippin, Kub and Mann"
+    assert "fraud_Double Prefix" in merchants
+    assert "" in merchants
+    assert "Merchant fraud_ in middle" in merchants
+
+
+def test_clean_data_bad_timestamp_gives_missing_time_features(raw_records):
+    cleaned = clean_data(pd.DataFrame(raw_records)).set_index("trans_num")
+
+    row = cleaned.loc[f"{4:032x}"]
+    assert pd.isna(row["trans_date_trans_time"]) or row["trans_date_trans_time"] == "NaT"
+    assert pd.isna(row["hour"]) and pd.isna(row["age_at_trans"])
+
+
+def test_normalize_merchants_reuses_cached_names():
+    processor.merchant_names.clear()
+    merchants = pd.Series(["fraud_Kub", "Kub", "fraud_Kub", None])
+
+    assert normalize_merchants(merchants).tolist()[:3] == ["Kub", "Kub", "Kub"]
+    assert set(processor.merchant_names) == {"fraud_Kub", "Kub"}
+    assert pd.isna(normalize_merchants(merchants).iloc[3])
+
+
+def test_normalize_merchants_keeps_cached_names_when_the_cache_overflows(monkeypatch):
+    monkeypatch.setattr(processor, "MERCHANT_CACHE_SIZE", 3)
+    processor.merchant_names.clear()
+    normalize_merchants(pd.Series(["fraud_A", "B"]))
+
+    # fraud_A is cached, C and D overflow the cache, which is cleared
+    assert normalize_merchants(pd.Series(["fraud_A", "C", "D"])).tolist() == ["A", "C", "D"]
+    assert set(processor.merchant_names) == {"fraud_A", "C", "D"}
+
+
+@pytest.mark.parametrize("born, ref, age", [
+    ("1988-03-09", "2019-03-08", 30),
+    ("1988-03-09", "2019-03-09", 31),
+    ("1992-02-29", "2020-02-28", 27),
+    ("1992-02-29", "2020-02-29", 28),
+    ("1992-02-29", "2021-03-01", 29),
+])
+def test_calculate_age(born, ref, age):
+    assert calculate_age(pd.Timestamp(born), pd.Timestamp(ref)) == age
+
+
+@pytest.mark.parametrize("born, ref", [(pd.NaT, pd.Timestamp("2020-01-01")), (pd.Timestamp("1990-01-01"), pd.NaT)])
+def test_calculate_age_missing_dates(born, ref):
+    assert calculate_age(born, ref) is None
+
+
+def test_map_job_to_category():
+    jobs = pd.Series([
+        "Software developer", "Engineer, civil (consulting)", "Nurse, adult", "Teacher, primary school",
+        "Illustrator", "Accountant, chartered", "Barrister", "Hotel manager", "Research scientist",
+        "Chief Executive Officer", None,
+    ])
+
+    assert map_job_to_category(jobs).tolist() == [
+        "IT", "Engineering", "Healthcare", "Education", "Arts", "Finance", "Legal", "Hospitality",
+        "Science", "Other", "Other",
+    ]
+
+
+def test_map_job_to_category_uses_first_matching_category():
+    # "software engineer" matches IT before Engineering
+    assert map_job_to_category(pd.Series(["Software engineer"])).tolist() == ["IT"]
+
+
+def test_map_category_to_readable_name():
+    categories = pd.Series(["gas_transport", "kids_pets", "crypto_exchange", None])
+
+    assert map_category_to_readable_name(categories).tolist() == [
+        "Transportation & Fuel", "Kids & Pets", "Other", "Other",
+    ]
+
+
+def test_missing_py_spy_cancels_the_profile_without_failing_batches(monkeypatch, tmp_path):
+    def popen(*args, **kwargs):
+        raise FileNotFoundError(2, "No such file or directory", "py-spy")
+
+    monkeypatch.setattr(processor, "PROFILER", "py-spy")
+    monkeypatch.setattr(processor, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(processor.subprocess, "Popen", popen)
+    monkeypatch.setitem(processor.profile_state, "batches_left", 3)
+    monkeypatch.setitem(processor.profile_state, "profiler", None)
+
+    for _ in range(2):
+        with processor.profiled_batch():
+            pass
+
+    assert processor.profile_state["batches_left"] == 0
+    assert processor.profile_state["profiler"] is None
+
+
+CLEAN_DATA_STEPS = {
+    "drop_duplicates", "drop_pii", "to_numeric", "geo", "dob_to_datetime", "time_to_datetime", "age",
+    "job_category", "category", "merchant", "drop_columns", "time_features", "is_fraud", "time_to_str",
+}
+
+
+def test_step_timings_report_every_step(raw_records, monkeypatch, capsys):
+    monkeypatch.setattr(processor, "PROFILE_STEPS", True)
+    monkeypatch.setattr(processor, "PROFILE_REPORT_EVERY", 3)
+    monkeypatch.setattr(processor, "step_timings", processor.defaultdict(processor.deque))
+    monkeypatch.setitem(processor.profile_state, "batches_left", 0)
+    monkeypatch.setitem(processor.profile_state, "processed", 0)
+
+    for _ in range(3):
+        with processor.profiled_batch():
+            clean_data(pd.DataFrame(raw_records))
+
+    summary = processor.step_timing_summary()
+    assert {row["step"] for row in summary} == CLEAN_DATA_STEPS
+    for row in summary:
+        assert row["batches"] == 3
+        assert 0 < row["p50_ms"] <= row["p95_ms"] <= row["p99_ms"] <= row["total_ms"] < 10000
+    assert [row["total_ms"] for row in summary] == sorted((row["total_ms"] for row in summary), reverse=True)
+
+    report = capsys.readouterr().out.splitlines()
+    assert report[0].split() == ["step", "batches", "p50", "ms", "p95", "ms", "p99", "ms", "share"]
+    assert {line.split()[0] for line in report[1:]} == CLEAN_DATA_STEPS
+
+
+def test_step_timings_are_not_recorded_when_disabled(raw_records, monkeypatch):
+    monkeypatch.setattr(processor, "PROFILE_STEPS", False)
+    monkeypatch.setattr(processor, "step_timings", processor.defaultdict(processor.deque))
+
+    clean_data(pd.DataFrame(raw_records))
+
+    assert processor.step_timing_summary() == []
+
+
+@pytest.mark.parametrize("q, expected", [(0, 1), (50, 51), (95, 95), (99, 99), (100, 100)])
+def test_percentile_picks_the_nearest_rank(q, expected):
+    assert processor.percentile(list(range(1, 101)), q) == expected
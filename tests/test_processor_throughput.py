@@ -0,0 +1,83 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from conftest import load_golden, save_golden
+from processor import calculate_age, clean_data, map_category_to_readable_name, map_job_to_category
+
+BATCH_ROWS = 5000
+REPEATS = 5
+# Allowed slowdown against the recorded baseline before a benchmark fails
+TOLERANCE = float(os.getenv("THROUGHPUT_TOLERANCE", 0.5))
+BASELINE_FILE = "throughput_baseline.json"
+
+
+def make_batch(raw_records, rows=BATCH_ROWS):
+    """
+    Tiles the golden raw batch up to `rows` distinct rows.
+    """
+    tile = pd.DataFrame(raw_records)
+    batch = pd.concat([tile] * (rows // len(tile) + 1), ignore_index=True).head(rows)
+    batch["Unnamed: 0"] = range(len(batch))
+    return batch
+
+
+def parse_dates(batch):
+    batch["dob"] = pd.to_datetime(batch["dob"], errors="coerce")
+    batch["trans_date_trans_time"] = pd.to_datetime(
+        batch["trans_date_trans_time"], format="%Y-%m-%d %H:%M:%S", errors="coerce"
+    )
+    return batch
+
+
+CASES = {
+    "clean_data": (lambda batch: batch, clean_data),
+    "calculate_age": (
+        parse_dates,
+        lambda batch: batch.apply(lambda row: calculate_age(row["dob"], row["trans_date_trans_time"]), axis=1),
+    ),
+    "map_job_to_category": (lambda batch: batch, lambda batch: map_job_to_category(batch["job"])),
+    "map_category_to_readable_name": (
+        lambda batch: batch, lambda batch: map_category_to_readable_name(batch["category"]),
+    ),
+}
+
+
+def rows_per_second(prepare, run, batch):
+    """
+    Returns the best throughput over several runs, each on a fresh copy of the batch.
+    """
+    best = float("inf")
+    for _ in range(REPEATS):
+        data = prepare(batch.copy())
+        start = time.perf_counter()
+        run(data)
+        best = min(best, time.perf_counter() - start)
+    return len(batch) / best
+
+
+@pytest.fixture(scope="module")
+def baseline(request):
+    baseline = load_golden(BASELINE_FILE)
+    yield baseline
+    if request.config.getoption("--update-golden"):
+        save_golden(BASELINE_FILE, baseline)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("name", list(CASES))
+def test_throughput_does_not_regress(name, raw_records, baseline, update_golden):
+    prepare, run = CASES[name]
+    measured = rows_per_second(prepare, run, make_batch(raw_records))
+    print(f"{name}: {measured:,.0f} rows/s (baseline {baseline.get(name, 0):,.0f})")
+
+    if update_golden:
+        baseline[name] = round(measured)
+        return
+
+    assert measured >= baseline[name] * (1 - TOLERANCE), (
+        f"{name} throughput {measured:,.0f} rows/s is more than {TOLERANCE:.0%} below "
+        f"the baseline of {baseline[name]:,} rows/s"
+    )
@@ -0,0 +1,34 @@
+import pytest
+
+import producer
+from producer import next_batch_settings
+
+
+@pytest.fixture(autouse=True)
+def batching_limits(monkeypatch):
+    monkeypatch.setattr(producer, "MIN_BATCH_SIZE", 250)
+    monkeypatch.setattr(producer, "MAX_BATCH_SIZE", 10000)
+    monkeypatch.setattr(producer, "TARGET_BACKLOG_ROWS", 20000)
+    monkeypatch.setattr(producer, "MAX_PUBLISH_LATENCY", 0.5)
+    monkeypatch.setattr(producer, "MAX_PUBLISH_DELAY", 2.0)
+
+
+@pytest.mark.parametrize("size, delay, depth, latency, expected", [
+    # Keeping up: grow by a quarter (at least MIN_BATCH_SIZE) and halve the delay
+    (1000, 0.0, 0, 0.01, (1250, 0.0)),
+    (400, 0.1, 1, 0.01, (650, 0.05)),
+    (1000, 0.004, 20, 0.01, (1250, 0.0)),
+    (9000, 0.0, 0, 0.01, (10000, 0.0)),
+    (10000, 0.0, 2, 0.01, (10000, 0.0)),
+    # Above the target backlog: same size, slow down by half again, from at least 10 ms
+    (1000, 0.0, 21, 0.01, (1000, 0.01)),
+    (1000, 0.1, 40, 0.01, (1000, 0.15)),
+    (1000, 1.8, 30, 0.01, (1000, 2.0)),
+    # Above twice the target, or slow publishes: halve the batch and double the delay, from at least 50 ms
+    (1000, 0.0, 41, 0.01, (500, 0.05)),
+    (1000, 0.1, 0, 0.8, (500, 0.2)),
+    (300, 1.5, 200, 0.01, (250, 2.0)),
+    (250, 0.0, 200, 0.01, (250, 0.05)),
+])
+def test_next_batch_settings(size, delay, depth, latency, expected):
+    assert next_batch_settings(size, delay, depth, latency) == pytest.approx(expected)
@@ -0,0 +1,106 @@
+import json
+from types import SimpleNamespace
+
+import psycopg2
+
+import broker
+import uploader
+from conftest import RecordingChannel, RecordingConnection
+
+
+STATES = ("NC", "WA", "ID", "MT", "VA", "PA", "KS", "TN", "IA", "WV", "FL", "CA", "NM", "NJ", "OK", "IN")
+
+
+def make_records(rows=200):
+    return [{"row": i, "state": STATES[i % len(STATES)], "cc_num": 4000000000000000 + i % 37} for i in range(rows)]
+
+
+def test_shard_bucket_is_stable_across_processes():
+    # crc32, not the salted hash() of str
+    assert broker.shard_bucket("NY", 32) == 4
+    assert broker.shard_bucket(4613314721966, 32) == broker.shard_bucket("4613314721966", 32)
+    assert all(0 <= broker.shard_bucket(state, 7) < 7 for state in ("NC", "WA", "ID", None))
+
+
+def test_split_by_shard_keeps_every_record_in_order():
+    records = make_records()
+    groups = broker.split_by_shard(records, "state", 4)
+
+    assert len(groups) > 1 and sum(map(len, groups.values())) == len(records)
+    for bucket, group in groups.items():
+        assert group == [record for record in records if broker.shard_bucket(record["state"], 4) == bucket]
+
+
+def test_publish_shards_routes_each_bucket_to_the_shard_exchange():
+    channel = RecordingChannel()
+    records = make_records()
+
+    broker.publish_shards(channel, "raw", records, "cc_num")
+
+    assert len(channel.published) > 1
+    assert {exchange for exchange, _, _ in channel.published} == {"raw_shards"}
+    for _, routing_key, group in channel.published:
+        assert {str(broker.shard_bucket(record["cc_num"])) for record in group} == {routing_key}
+    assert sorted(record["row"] for _, _, group in channel.published for record in group) == list(range(len(records)))
+
+
+def test_writer_flushes_full_buffer_in_one_copy_and_one_ack(raw_records, monkeypatch):
+    monkeypatch.setattr(uploader, "WRITER_FLUSH_ROWS", len(raw_records) + 1)
+    monkeypatch.setattr(uploader, "WRITER_PREFETCH", 2)
+    conn, channel = RecordingConnection(), RecordingChannel()
+    buffer = uploader.new_shard_buffer(channel)
+
+    first, second = raw_records[:2], raw_records[2:]
+    uploader.buffer_shard_message(conn, "raw", buffer, SimpleNamespace(delivery_tag=1), json.dumps(first))
+    assert conn.copied == [] and channel.acked == []
+
+    uploader.buffer_shard_message(conn, "raw", buffer, SimpleNamespace(delivery_tag=2), json.dumps(second))
+    sql, data = conn.copied[0]
+    assert sql.startswith(f"COPY raw_data ({', '.join(uploader.RAW_COLUMNS)}) FROM STDIN")
+    # Rows raw_values cannot parse are skipped, as in the single uploader
+    loaded = len(uploader.raw_values(raw_records))
+    assert len(data.splitlines()) == loaded
+    assert conn.commits == 1 and channel.acked == [(2, True)]
+    assert buffer["loaded"] == loaded and buffer["messages"] == [] and buffer["rows"] == 0
+
+
+def buffer_messages(buffer, messages):
+    buffer["messages"] = list(messages)
+    buffer["rows"] = sum(len(records) for _, records in messages)
+
+
+def test_writer_requeues_buffer_when_the_load_fails(raw_records):
+    conn, channel = RecordingConnection(fail=True), RecordingChannel()
+    buffer = uploader.new_shard_buffer(channel)
+    buffer_messages(buffer, [(5, raw_records[:2]), (6, raw_records[2:])])
+
+    assert uploader.flush_shard_buffer(conn, "raw", buffer) == 0
+    # The batch and then the first message fail; the error is not in the data, so nothing is dropped
+    assert conn.rollbacks == 2 and conn.commits == 0
+    assert channel.acked == [] and channel.nacked == [(6, True, True)]
+    assert buffer["messages"] == [] and buffer["rows"] == 0 and buffer["loaded"] == 0
+
+
+def test_writer_rejects_poison_messages_and_loads_the_rest(raw_records):
+    conn = RecordingConnection(fail_on="POISON", error=psycopg2.DataError("invalid input syntax"))
+    channel = RecordingChannel()
+    buffer = uploader.new_shard_buffer(channel)
+    poison = [dict(raw_records[0], merchant="POISON")]
+    buffer_messages(buffer, [(1, raw_records[:2]), (2, poison), (3, raw_records[2:])])
+
+    loaded = uploader.flush_shard_buffer(conn, "raw", buffer)
+
+    assert loaded == len(uploader.raw_values(raw_records)) and buffer["loaded"] == loaded
+    assert len(conn.copied) == 2 and conn.commits == 2 and conn.rollbacks == 2
+    assert channel.acked == [(1, False), (3, False)]
+    assert channel.nacked == [(2, False, False)]
+    assert buffer["messages"] == []
+
+
+def test_writer_rejects_undecodable_messages():
+    conn, channel = RecordingConnection(), RecordingChannel()
+    buffer = uploader.new_shard_buffer(channel)
+
+    uploader.buffer_shard_message(conn, "raw", buffer, SimpleNamespace(delivery_tag=7), b"{not json")
+
+    assert channel.nacked == [(7, False, False)] and buffer["messages"] == []
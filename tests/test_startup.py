@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from startup import is_loaded, lazy_import
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+def test_lazy_import_defers_execution():
+    module = lazy_import("tabnanny")
+    assert not is_loaded("tabnanny")
+    assert callable(module.check)
+    assert is_loaded("tabnanny")
+
+
+def test_lazy_import_of_missing_module_fails_early():
+    with pytest.raises(ModuleNotFoundError):
+        lazy_import("no_such_module_for_startup_test")
+
+
+@pytest.mark.parametrize("module", ["processor", "uploader"])
+def test_worker_import_does_not_load_pandas(module):
+    # A fresh interpreter, since the test session has long imported pandas
+    code = f"import {module}, startup; print(startup.loaded_heavy_modules())"
+    result = subprocess.run([sys.executable, "-c", code], cwd=SRC_DIR, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"